@@ -45,13 +45,15 @@ import openquake.engine
 
 from openquake.engine import __version__
 from openquake.engine import engine
+from openquake.engine.calculators.risk.event_based import asset_loss
 from openquake.engine.db import models
 from openquake.engine.export import hazard as hazard_export
 from openquake.engine.export import risk as risk_export
 from openquake.engine.input import source
 from openquake.engine.tools.import_gmf_scenario import import_gmf_scenario
 from openquake.engine.tools.import_hazard_curves import import_hazard_curves
-from openquake.engine.tools import save_hazards, load_hazards
+from openquake.engine.tools import (
+    save_hazards, load_hazards, performance_report, performance_trace)
 
 HAZARD_OUTPUT_ARG = "--hazard-output-id"
 HAZARD_CALCULATION_ARG = "--hazard-calculation-id"
@@ -170,6 +172,31 @@ def set_up_arg_parser():
         '--drc',
         help='Delete a risk calculation and all associated outputs',
         metavar='RISK_CALCULATION_ID')
+    risk_grp.add_argument(
+        '--prune-exposures',
+        '--pe',
+        help=('Delete the stored exposure models which are duplicates of '
+              'a more recent one with the same content. Use '
+              '"--list-inputs exposure" to list the stored exposure models'),
+        action='store_true')
+    risk_grp.add_argument(
+        '--aggregate-losses',
+        '--al',
+        help=('Compute the aggregate loss curves of a subset of the assets '
+              'of an event based risk calculation run with '
+              '"asset_loss_table = true", by using the stored losses. '
+              'The assets can be selected with --taxonomies and --region'),
+        metavar='RISK_CALCULATION_ID')
+    risk_grp.add_argument(
+        '--taxonomies',
+        help=('Use with --aggregate-losses to select the assets with the '
+              'given comma separated taxonomies'),
+        metavar='TAXONOMIES')
+    risk_grp.add_argument(
+        '--region',
+        help=('Use with --aggregate-losses to select the assets inside the '
+              'given polygon, in WKT format'),
+        metavar='WKT_POLYGON')
 
     export_grp = parser.add_argument_group('Export')
     export_grp.add_argument(
@@ -219,6 +246,29 @@ def set_up_arg_parser():
         help=('List outputs which were imported from a file, not calculated '
               'from a job'))
 
+    perf_grp = parser.add_argument_group('Performance')
+    perf_grp.add_argument(
+        '--performance',
+        help=('Display a report of the time and memory spent by the '
+              'given job, per controller phase, per operation and task '
+              'type, and for the slowest tasks'),
+        metavar='JOB_ID', type=int)
+    perf_grp.add_argument(
+        '--performance-format',
+        choices=performance_report.FORMATS,
+        default='text',
+        help='Use with --performance, defaults to "text"')
+    perf_grp.add_argument(
+        '--slowest-tasks',
+        help=('Use with --performance, the number of slowest tasks to '
+              'display; defaults to 10'),
+        default=10, type=int, metavar='N')
+    perf_grp.add_argument(
+        '--performance-trace',
+        help=('Export the timeline of the given job in the Chrome trace '
+              'format, to be opened with chrome://tracing or Perfetto'),
+        nargs=2, metavar=('JOB_ID', 'TRACE_FILE'))
+
     pre_proc_grp = parser.add_argument_group('Pre-processing')
     pre_proc_grp.add_argument(
         '--optimize-source-model',
@@ -243,15 +293,15 @@ def list_inputs(input_type):
         engine.complain_and_exit(
             "Wrong input type. Available input types: exposure")
 
-    inputs = model.objects.all()
+    inputs = model.objects.all().order_by('id')
 
     if not inputs.count():
         print "No inputs found of type %s" % input_type
         return
-    print ('model id | name')
+    print ('model id | job id | checksum | name')
 
     for inp in inputs:
-        print "%9d|%s" % (inp.id, inp.name)
+        print "%9d|%7d|%s|%s" % (inp.id, inp.job_id, inp.checksum, inp.name)
 
 
 def list_calculations(calc_manager):
@@ -382,6 +432,49 @@ def del_risk_calc(rc_id, confirmed=False):
             print err.message
 
 
+def prune_exposures(confirmed=False):
+    """
+    Delete the stored exposure models which are duplicates of a more
+    recent one.
+    """
+    if confirmed or confirm(
+            'Are you sure you want to delete the duplicated exposure '
+            'models?\nThis action cannot be undone. (y/n): '):
+        deleted = engine.prune_exposures()
+        print 'Deleted %d exposure model(s): %s' % (
+            len(deleted), ', '.join(map(str, deleted)))
+
+
+def aggregate_losses(rc_id, taxonomies=None, region=None):
+    """
+    Print the aggregate loss curves of the selected assets of a risk
+    calculation, for each loss type and hazard output.
+    """
+    rc = models.RiskCalculation.objects.get(pk=rc_id)
+    if taxonomies or region:
+        asset_ids = asset_loss.select_assets(
+            rc, taxonomies and taxonomies.split(','), region)
+        print 'Selected %d asset(s)' % len(asset_ids)
+    else:
+        asset_ids = None
+    loss_types = models.AssetLoss.objects.filter(
+        risk_calculation=rc).values_list('loss_type', flat=True).distinct()
+    if not loss_types:
+        print ('No asset losses stored for risk calculation %s: run it with '
+               '"asset_loss_table = true"' % rc_id)
+        return
+    for loss_type in sorted(loss_types):
+        for curve in asset_loss.aggregate_loss_curves(
+                rc, loss_type, asset_ids):
+            print 'loss_type=%s, hazard_output=%s' % (
+                loss_type, curve.hazard_output.id)
+            print 'average loss | stddev loss'
+            print '%s | %s' % (curve.average_loss, curve.stddev_loss)
+            print 'loss | poe'
+            for loss, poe in zip(curve.losses, curve.poes):
+                print '%s | %s' % (loss, poe)
+
+
 def confirm(prompt):
     """
     Ask for confirmation, given a ``prompt`` and return a boolean value.
@@ -469,6 +562,10 @@ def main():
                         hazard_calculation_id=args.hazard_calculation_id)
     elif args.delete_risk_calculation is not None:
         del_risk_calc(args.delete_risk_calculation, args.yes)
+    elif args.prune_exposures:
+        prune_exposures(args.yes)
+    elif args.aggregate_losses is not None:
+        aggregate_losses(args.aggregate_losses, args.taxonomies, args.region)
     # import
     elif args.load_gmf is not None:
         with open(args.load_gmf) as f:
@@ -480,6 +577,13 @@ def main():
             out, hc = import_hazard_curves(f)
             print 'Added output id=%d of type %s; hazard_calculation_id=%d'\
                 % (out.id, out.output_type, hc.id)
+    elif args.performance is not None:
+        performance_report.main(args.performance, args.performance_format,
+                                args.slowest_tasks)
+    elif args.performance_trace is not None:
+        job_id, trace_file = args.performance_trace
+        performance_trace.main(int(job_id), expanduser(trace_file))
+        print 'Written %s' % trace_file
     elif args.list_imported_outputs:
         list_imported_outputs()
     elif args.delete_uncompleted_calculations:
@@ -312,7 +312,7 @@ class BaseHazardCalculator(base.Calculator):
             with logs.tracing('storing exposure'):
                 exposure.ExposureDBWriter(
                     self.job).serialize(
-                    parsers.ExposureModelParser(hc.inputs['exposure']))
+                    exposure.exposure_parser(hc.inputs['exposure']))
 
     @EnginePerformanceMonitor.monitor
     def initialize_site_model(self):
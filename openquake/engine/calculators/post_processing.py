@@ -138,3 +138,44 @@ def quantile_curve(curves, quantile):
 
     data = numpy.sort(arr, axis=0).transpose()
     return (1.0 - gamma) * data[:, k - 1] + gamma * data[:, k]
+
+
+class MeanStd(object):
+    """
+    Incremental computation of the mean and of the sample standard
+    deviation (ddof=1) of a set of samples received in chunks, so that
+    the samples are never held all together in memory. The partial
+    results of the chunks are combined with the parallel variance
+    formula of Chan et al.
+
+    :param int axis: the axis of the samples in the chunks
+    """
+    def __init__(self, axis=0):
+        self.axis = axis
+        self.n = 0
+        self.mean = None
+        self.m2 = None
+
+    def update(self, samples):
+        """
+        :param samples: an array with the samples of the chunk
+        """
+        samples = numpy.asarray(samples)
+        n = samples.shape[self.axis]
+        mean = samples.mean(axis=self.axis)
+        m2 = ((samples - numpy.expand_dims(mean, self.axis)) ** 2).sum(
+            axis=self.axis)
+        if not self.n:
+            self.n, self.mean, self.m2 = n, mean, m2
+            return
+        total = self.n + n
+        delta = mean - self.mean
+        self.mean = self.mean + delta * n / float(total)
+        self.m2 = self.m2 + m2 + delta ** 2 * self.n * n / float(total)
+        self.n = total
+
+    def get(self):
+        """
+        :returns: a pair (mean, standard deviation)
+        """
+        return self.mean, numpy.sqrt(self.m2 / (self.n - 1))
@@ -0,0 +1,107 @@
+# Copyright (c) 2010-2013, GEM Foundation.
+#
+# OpenQuake is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# OpenQuake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with OpenQuake.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Grouping of the assets used to compute the aggregate losses of
+portions of the portfolio (e.g. by taxonomy or by region) inside the
+risk tasks, as requested by the parameter `aggregate_by` of the risk
+calculation.
+"""
+
+import csv
+import collections
+
+import numpy
+
+from django.contrib.gis.geos import GEOSGeometry
+
+#: The supported values of the parameter `aggregate_by`
+AGGREGATE_BY = ('taxonomy', 'region')
+
+
+def read_regions(path):
+    """
+    Read a regions file, i.e. a CSV file with two columns: the name of
+    the region and the polygon of the region, in WKT format (quoted).
+
+    :returns: a list of pairs (name, wkt)
+    """
+    with open(path) as regions_file:
+        return [(name.strip(), wkt.strip())
+                for name, wkt in csv.reader(regions_file)]
+
+
+class AssetGroups(object):
+    """
+    Assign the assets to the groups specified by the user.
+
+    :param str key:
+        the grouping key, one of :data:`AGGREGATE_BY`
+    :param regions:
+        a list of pairs (name, wkt) with the polygons of the regions;
+        required if `key` is "region". An asset outside all the regions
+        does not belong to any group.
+    """
+    def __init__(self, key, regions=()):
+        if key not in AGGREGATE_BY:
+            raise ValueError('Invalid grouping key %r, must be one of %s' %
+                             (key, ', '.join(AGGREGATE_BY)))
+        if key == 'region' and not regions:
+            raise ValueError('Grouping by region requires a regions file')
+        self.key = key
+        self.regions = list(regions)
+        self._polygons = None
+
+    def __getstate__(self):
+        # the prepared geometries are not pickleable, they are
+        # instantiated again in the task
+        return dict(key=self.key, regions=self.regions, _polygons=None)
+
+    def group(self, asset):
+        """
+        :returns: the name of the group of `asset`, or None
+        """
+        if self.key == 'taxonomy':
+            return asset.taxonomy
+        if self._polygons is None:
+            self._polygons = [(name, GEOSGeometry(wkt).prepared)
+                              for name, wkt in self.regions]
+        for name, polygon in self._polygons:
+            if polygon.contains(asset.site):
+                return name
+
+    def sum_by_group(self, assets, loss_type, loss_matrix):
+        """
+        :param assets:
+            a list of N :class:`openquake.engine.db.models.ExposureData`
+        :param str loss_type:
+            the loss type of the loss ratios
+        :param loss_matrix:
+            an array of shape (N, E) with the loss ratios of the assets
+            for E events
+        :returns:
+            a dictionary group -> array of E aggregate losses
+        """
+        indices = collections.defaultdict(list)
+        for i, asset in enumerate(assets):
+            group = self.group(asset)
+            if group is not None:
+                indices[group].append(i)
+        if not indices:
+            return {}
+        values = numpy.array([asset.value(loss_type) for asset in assets])
+        losses = numpy.array(loss_matrix) * values.reshape(len(values), 1)
+        return dict((group, losses[idx].sum(axis=0))
+                    for group, idx in indices.iteritems())
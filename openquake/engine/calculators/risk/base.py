@@ -17,13 +17,19 @@
 
 """Base RiskCalculator class."""
 
+import itertools
 import collections
 
-from openquake.engine import logs, export
+from django import db
+
+from openquake.risklib import workflows
+
+from openquake.engine import logs, export, writer
 from openquake.engine.utils import config
 from openquake.engine.db import models
 from openquake.engine.calculators import base
-from openquake.engine.calculators.risk import writers, validation, loaders
+from openquake.engine.calculators.risk import (
+    writers, validation, loaders, hazard_getters, asset_groups)
 
 
 class RiskCalculator(base.Calculator):
@@ -46,6 +52,10 @@ class RiskCalculator(base.Calculator):
                   validation.OrphanTaxonomies, validation.ExposureLossTypes,
                   validation.NoRiskModels]
 
+    # True if the hazard getters need the association asset -> hazard
+    # site (i.e. they read ground motion values stored per hazard site)
+    associate_assets_to_sites = False
+
     def __init__(self, job):
         super(RiskCalculator, self).__init__(job)
 
@@ -55,16 +65,26 @@ class RiskCalculator(base.Calculator):
     def pre_execute(self):
         """
         In this phase, the general workflow is:
-            1. Parse the exposure to get the taxonomies
+            1. Parse the exposure to get the taxonomies (an exposure
+               model already stored from a file with the same content
+               is reused)
             2. Parse the available risk models
             3. Initialize progress counters
             4. Validate exposure and risk models
+            5. Associate each asset to the closest hazard site (if needed)
         """
         with logs.tracing('get exposure'):
-            self.taxonomies_asset_count = \
-                (self.rc.preloaded_exposure_model or loaders.exposure(
+            if self.rc.preloaded_exposure_model is None:
+                exposure_model = loaders.exposure(
                     self.job, self.rc.inputs['exposure'])
-                 ).taxonomies_in(self.rc.region_constraint)
+                if exposure_model.job_id != self.job.id:
+                    # stored by another job, reuse it
+                    self.rc.preloaded_exposure_model = exposure_model
+                    self.rc.save()
+            else:
+                exposure_model = self.rc.preloaded_exposure_model
+            self.taxonomies_asset_count = exposure_model.taxonomies_in(
+                self.rc.region_constraint)
 
         with logs.tracing('parse risk models'):
             self.risk_models = self.get_risk_models()
@@ -85,16 +105,124 @@ class RiskCalculator(base.Calculator):
                 raise ValueError("""Problems in calculator configuration:
                                  %s""" % error)
 
+        if self.associate_assets_to_sites:
+            with logs.tracing('associating assets->site'):
+                self.associate_sites()
+
+    def associate_sites(self):
+        """
+        Store in :class:`openquake.engine.db.models.AssetSite` the
+        closest hazard site (within the maximum distance) of each asset
+        contained in the region constraint. It is done with a single
+        spatial join over the whole exposure, so that the hazard
+        getters only need to read the association by asset ids.
+
+        If the hazard sites have been built by snapping the locations
+        of the assets to a grid, each asset is associated exactly to
+        the site of its cell, see :meth:`associate_sites_by_cell`.
+        """
+        if 'exposure' in self.hc.inputs and self.hc.exposure_site_spacing:
+            return self.associate_sites_by_cell()
+
+        # NB: the ``distinct ON (exposure_data.id)`` combined with the
+        # ``ORDER BY ST_Distance`` does the job to select the closest site.
+        query = """
+INSERT INTO riskr.asset_site (risk_calculation_id, asset_id, site_id)
+SELECT DISTINCT ON (exp.id) %s, exp.id, hsite.id
+FROM riski.exposure_data AS exp
+JOIN hzrdi.hazard_site AS hsite
+ON ST_DWithin(exp.site, hsite.location, %s)
+WHERE hsite.hazard_calculation_id = %s
+AND exp.exposure_model_id = %s
+AND ST_COVERS(ST_GeographyFromText(%s), exp.site)
+ORDER BY exp.id, ST_Distance(exp.site, hsite.location, false)"""
+        args = (self.rc.id,
+                self.rc.best_maximum_distance *
+                hazard_getters.KILOMETERS_TO_METERS,
+                self.hc.id,
+                self.rc.exposure_model.id,
+                "SRID=4326; %s" % self.rc.region_constraint.wkt)
+        with db.transaction.commit_on_success(using='job_init'):
+            cursor = models.getcursor('job_init')
+            cursor.execute(query, args)
+            logs.LOG.info('Associated %d assets to the hazard sites',
+                          cursor.rowcount)
+
+    def associate_sites_by_cell(self):
+        """
+        Store in :class:`openquake.engine.db.models.AssetSite` the site
+        of the cell containing each asset, in the grid with size
+        `exposure_site_spacing` used to build the hazard sites. The
+        assets in cells without a hazard site are not associated.
+        """
+        spacing = self.hc.exposure_site_spacing
+        cursor = models.getcursor('job_init')
+        cursor.execute("""
+SELECT id, ST_X(location::geometry), ST_Y(location::geometry)
+FROM hzrdi.hazard_site WHERE hazard_calculation_id = %s""", (self.hc.id,))
+        site_ids, lons, lats = zip(*cursor.fetchall()) or ([], [], [])
+        cell_sites = dict(
+            zip(zip(*models.grid_cells(lons, lats, spacing)), site_ids))
+
+        cursor.execute("""
+SELECT id, ST_X(site::geometry), ST_Y(site::geometry)
+FROM riski.exposure_data
+WHERE exposure_model_id = %s
+AND ST_COVERS(ST_GeographyFromText(%s), site)""", (
+            self.rc.exposure_model.id,
+            "SRID=4326; %s" % self.rc.region_constraint.wkt))
+        asset_ids, lons, lats = zip(*cursor.fetchall()) or ([], [], [])
+        cells = zip(*models.grid_cells(lons, lats, spacing))
+
+        asset_sites = [
+            models.AssetSite(risk_calculation_id=self.rc.id,
+                             asset_id=asset_id, site_id=cell_sites[cell])
+            for asset_id, cell in zip(asset_ids, cells)
+            if cell in cell_sites]
+        if asset_sites:
+            writer.CacheInserter.saveall(asset_sites)
+        logs.LOG.info('Associated %d assets to the hazard sites',
+                      len(asset_sites))
+
     def block_size(self):
         """
         Number of assets handled per task.
         """
         return int(config.get('risk', 'block_size'))
 
+    def task_distribution(self):
+        """
+        The strategy used to distribute the assets among the tasks, as
+        set by the `task_distribution` parameter in openquake.cfg:
+
+        * 'taxonomy': each task works on a block of assets of the
+          same taxonomy (the default)
+        * 'site': each task works on a block of assets of any
+          taxonomy, grouped by the associated hazard site, so that
+          the hazard of a site is read only once
+
+        The 'site' strategy needs the association asset -> hazard site,
+        so it falls back to 'taxonomy' for the calculators not
+        performing it.
+        """
+        distribution = config.get('risk', 'task_distribution') or 'taxonomy'
+        if distribution not in ('taxonomy', 'site'):
+            raise ValueError(
+                'Invalid task_distribution in openquake.cfg: %s' %
+                distribution)
+        if distribution == 'site' and not self.associate_assets_to_sites:
+            return 'taxonomy'
+        return distribution
+
     def expected_tasks(self, block_size):
         """
         Number of tasks generated by the task_arg_gen
         """
+        if self.task_distribution() == 'site':
+            n, r = divmod(sum(self.taxonomies_asset_count.values()),
+                          block_size)
+            return n + 1 if r else n
+
         num_tasks = 0
         for num_assets in self.taxonomies_asset_count.values():
             n, r = divmod(num_assets, block_size)
@@ -114,9 +242,9 @@ class RiskCalculator(base.Calculator):
         Generator function for creating the arguments for each task.
 
         It is responsible for the distribution strategy. It divides
-        the considered exposure into chunks of homogeneous assets
-        (i.e. having the same taxonomy). The chunk size is given by
-        the `block_size` openquake config parameter
+        the considered exposure into chunks of assets (see
+        :meth:`asset_blocks`). The chunk size is given by the
+        `block_size` openquake config parameter.
 
         :param int block_size:
             The number of work items per task (sources, sites, etc.).
@@ -134,23 +262,12 @@ class RiskCalculator(base.Calculator):
             [builder(self) for builder in self.output_builders])
 
         num_tasks = 0
-        for taxonomy, assets_nr in self.taxonomies_asset_count.items():
-            asset_offsets = range(0, assets_nr, block_size)
-
-            for offset in asset_offsets:
-                with logs.tracing("getting assets"):
-                    assets = models.ExposureData.objects.get_asset_chunk(
-                        self.rc, taxonomy, offset, block_size)
-
-                calculation_units = [
-                    self.calculation_unit(loss_type, assets)
-                    for loss_type in models.loss_types(self.risk_models)]
-
-                num_tasks += 1
-                yield [self.job.id,
-                       calculation_units,
-                       output_containers,
-                       self.calculator_parameters]
+        for assets in self.asset_blocks(block_size):
+            num_tasks += 1
+            yield [self.job.id,
+                   self.calculation_units(assets),
+                   output_containers,
+                   self.calculator_parameters]
 
         # sanity check to protect against future changes of the distribution
         # logic
@@ -159,6 +276,51 @@ class RiskCalculator(base.Calculator):
             raise RuntimeError('Expected %d tasks, generated %d!' % (
                                expected_tasks, num_tasks))
 
+    def asset_blocks(self, block_size):
+        """
+        :returns:
+            an iterator over blocks of `block_size` assets, read in a
+            single pass over the exposure. With the 'taxonomy' task
+            distribution the assets of a block have the same taxonomy,
+            with the 'site' distribution they are grouped by hazard
+            site across all the taxonomies.
+        """
+        manager = models.ExposureData.objects
+        if self.task_distribution() == 'site':
+            return manager.get_asset_blocks_by_site(
+                self.rc, self.taxonomies_asset_count, block_size)
+        return (assets
+                for taxonomy in self.taxonomies_asset_count
+                for assets in manager.get_asset_blocks(
+                    self.rc, taxonomy, block_size))
+
+    def calculation_units(self, assets):
+        """
+        :param assets:
+            a block of assets, possibly of different taxonomies
+        :returns:
+            a list of :class:`openquake.risklib.workflows.CalculationUnit`
+            instances, one for each loss type and taxonomy. The units
+            needing the same hazard (same IMT and hazard outputs) share
+            their hazard getters, so that the hazard is read (or
+            computed) once per task even if there are several loss
+            types and the assets have different vulnerability models.
+        """
+        assets_by_taxonomy = collections.OrderedDict()
+        for asset in assets:
+            assets_by_taxonomy.setdefault(asset.taxonomy, []).append(asset)
+
+        units = [self.calculation_unit(loss_type, taxonomy_assets)
+                 for loss_type in models.loss_types(self.risk_models)
+                 for taxonomy_assets in assets_by_taxonomy.itervalues()]
+        if len(units) > 1:
+            getters = hazard_getters.share_getters(
+                [unit.getter for unit in units])
+            units = [workflows.CalculationUnit(
+                     unit.loss_type, unit.workflow, getter)
+                     for unit, getter in zip(units, getters)]
+        return units
+
     def _get_outputs_for_export(self):
         """
         Util function for getting :class:`openquake.engine.db.models.Output`
@@ -200,6 +362,20 @@ class RiskCalculator(base.Calculator):
         """
         return []
 
+    def get_asset_groups(self):
+        """
+        :returns:
+            an :class:`openquake.engine.calculators.risk.asset_groups.AssetGroups`
+            instance, or None if the losses are not aggregated by group
+        """
+        if not self.rc.aggregate_by:
+            return None
+        if self.rc.aggregate_by == 'region':
+            regions = asset_groups.read_regions(self.rc.inputs['regions'])
+        else:
+            regions = ()
+        return asset_groups.AssetGroups(self.rc.aggregate_by, regions)
+
     def get_risk_models(self, retrofitted=False):
         """
         Parse vulnerability models for each loss type in
@@ -219,6 +395,35 @@ class RiskCalculator(base.Calculator):
 
         return risk_models
 
+
+def realization_slices():
+    """
+    :returns:
+        an iterator over the slices splitting the ground motion fields
+        of a scenario in chunks of `gmf_block_size` realizations, as set
+        in openquake.cfg (a single chunk with all the realizations if
+        the parameter is missing or 0). The number of realizations is
+        not known in advance: the caller must stop at the first chunk
+        which is not full, see :func:`is_last_chunk`.
+    """
+    block_size = int(config.get('risk', 'gmf_block_size') or 0)
+    if not block_size:
+        yield slice(0, None)
+        return
+    for start in itertools.count(0, block_size):
+        yield slice(start, start + block_size)
+
+
+def is_last_chunk(realizations, num_realizations):
+    """
+    :param realizations: a slice returned by :func:`realization_slices`
+    :param int num_realizations: the number of realizations read
+    :returns: True if there are no more realizations to read
+    """
+    return (realizations.stop is None or
+            num_realizations < realizations.stop - realizations.start)
+
+
 #: Calculator parameters are used to compute derived outputs like loss
 #: maps, disaggregation plots, quantile/mean curves. See
 #: :class:`openquake.engine.db.models.RiskCalculation` for a description
@@ -235,7 +440,13 @@ CalcParams = collections.namedtuple(
         'mag_bin_width',
         'distance_bin_width',
         'coordinate_bin_width',
-        'damage_state_ids'
+        'damage_state_ids',
+        'asset_loss_table',
+        'asset_groups',
+        'rupture_chunks',
+        'time_span',
+        'tses',
+        'loss_curve_resolution'
     ])
 
 
@@ -249,7 +460,13 @@ def make_calc_params(conditional_loss_poes=None,
                      mag_bin_width=None,
                      distance_bin_width=None,
                      coordinate_bin_width=None,
-                     damage_state_ids=None):
+                     damage_state_ids=None,
+                     asset_loss_table=None,
+                     asset_groups=None,
+                     rupture_chunks=None,
+                     time_span=None,
+                     tses=None,
+                     loss_curve_resolution=None):
     """
     Constructor of CalculatorParameters
     """
@@ -263,4 +480,10 @@ def make_calc_params(conditional_loss_poes=None,
                       mag_bin_width,
                       distance_bin_width,
                       coordinate_bin_width,
-                      damage_state_ids)
+                      damage_state_ids,
+                      asset_loss_table,
+                      asset_groups,
+                      rupture_chunks,
+                      time_span,
+                      tses,
+                      loss_curve_resolution)
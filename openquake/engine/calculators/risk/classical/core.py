@@ -18,6 +18,7 @@ Core functionality for the classical PSHA risk calculator.
 """
 
 import itertools
+import numpy
 from openquake.risklib import workflows
 
 from django.db import transaction
@@ -25,7 +26,7 @@ from django.db import transaction
 from openquake.engine.performance import EnginePerformanceMonitor
 from openquake.engine.calculators import post_processing
 from openquake.engine.calculators.risk import (
-    base, hazard_getters, validation, writers)
+    base, hazard_getters, validation, workflow_cache, writers)
 from openquake.engine.utils import tasks
 
 
@@ -50,7 +51,7 @@ def classical(job_id, units, containers, params):
     # Do the job in other functions, such that they can be unit tested
     # without the celery machinery
     with transaction.commit_on_success(using='job_init'):
-        for unit in units:
+        for unit in workflow_cache.cached(job_id, units):
             do_classical(
                 unit,
                 containers.with_args(loss_type=unit.loss_type),
@@ -198,6 +199,37 @@ def save_statistical_output(containers, stats, params):
             output_type="loss_curve", statistics="quantile", insured=True)
 
 
+class DistinctLossCurves(object):
+    """
+    Wrap the loss ratio curves calculator of a
+    :class:`openquake.risklib.workflows.Classical` workflow, so that the
+    loss ratio curves are computed once per distinct hazard curve and
+    not once per asset. The assets of a calculation unit have the same
+    taxonomy, so the assets associated to the same hazard site have the
+    same loss ratio curve.
+
+    :param calculator:
+        the callable computing the loss ratio curves of a list of hazard
+        curves, each one given as a list of pairs (iml, poe), as returned
+        by :class:`..hazard_getters.HazardCurveGetterPerAsset`
+    """
+    def __init__(self, calculator):
+        self.calculator = calculator
+
+    def __call__(self, hazard_curves):
+        if not len(hazard_curves):
+            return self.calculator(hazard_curves)
+        unique, inverse = hazard_getters.unique_data(
+            hazard_curves, [tuple(curve) for curve in hazard_curves])
+        return numpy.array(self.calculator(unique))[inverse]
+
+    def __getattr__(self, name):
+        # the attribute `calculator` is missing only while unpickling
+        if name == 'calculator':
+            raise AttributeError(name)
+        return getattr(self.calculator, name)
+
+
 class ClassicalRiskCalculator(base.RiskCalculator):
     """
     Classical PSHA risk calculator. Computes loss curves and loss maps
@@ -226,14 +258,17 @@ class ClassicalRiskCalculator(base.RiskCalculator):
         taxonomy = assets[0].taxonomy
         model = self.risk_models[taxonomy][loss_type]
 
+        workflow = workflows.Classical(
+            model.vulnerability_function,
+            self.rc.lrem_steps_per_interval,
+            self.rc.conditional_loss_poes,
+            self.rc.poes_disagg,
+            self.rc.insured_losses)
+        workflow.curves = DistinctLossCurves(workflow.curves)
+
         return workflows.CalculationUnit(
             loss_type,
-            workflows.Classical(
-                model.vulnerability_function,
-                self.rc.lrem_steps_per_interval,
-                self.rc.conditional_loss_poes,
-                self.rc.poes_disagg,
-                self.rc.insured_losses),
+            workflow,
             hazard_getters.HazardCurveGetterPerAsset(
                 self.rc.hazard_outputs(),
                 assets,
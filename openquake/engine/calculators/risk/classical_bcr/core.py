@@ -105,16 +105,21 @@ class ClassicalBCRRiskCalculator(classical.ClassicalRiskCalculator):
                 self.rc.interest_rate,
                 self.rc.asset_life_expectancy),
             hazard_getters.BCRGetter(
-                hazard_getters.HazardCurveGetterPerAsset(
-                    self.rc.hazard_outputs(),
-                    assets,
-                    self.rc.best_maximum_distance,
-                    model_orig.imt),
-                hazard_getters.HazardCurveGetterPerAsset(
-                    self.rc.hazard_outputs(),
-                    assets,
-                    self.rc.best_maximum_distance,
-                    model_retro.imt)))
+                self.hazard_getter(assets, model_orig.imt),
+                None if model_retro.imt == model_orig.imt
+                else self.hazard_getter(assets, model_retro.imt)))
+
+    def hazard_getter(self, assets, imt):
+        """
+        :returns:
+            a :class:`openquake.engine.calculators.risk.hazard_getters.
+            HazardCurveGetterPerAsset` for the given assets and IMT
+        """
+        return hazard_getters.HazardCurveGetterPerAsset(
+            self.rc.hazard_outputs(),
+            assets,
+            self.rc.best_maximum_distance,
+            imt)
 
     def pre_execute(self):
         """
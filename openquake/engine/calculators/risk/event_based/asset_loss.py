@@ -0,0 +1,198 @@
+# Copyright (c) 2010-2013, GEM Foundation.
+#
+# OpenQuake is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# OpenQuake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with OpenQuake.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Storage and re-aggregation of the losses per asset and per rupture
+computed by the event based risk calculator, enabled by the parameter
+`asset_loss_table` of the risk calculation.
+
+The losses are stored in :class:`openquake.engine.db.models.AssetLoss`
+in sparse form (only the non-zero losses are kept, in single
+precision), one row per block of assets, so that the aggregate losses
+and loss curves of any subset of the portfolio can be computed with a
+scan of the table, without running again the risk calculation.
+"""
+
+import collections
+
+import numpy
+
+from openquake.risklib import scientific
+
+from openquake.engine import writer
+from openquake.engine.db import models
+
+
+AggregateLossCurve = collections.namedtuple(
+    'AggregateLossCurve',
+    'hazard_output loss_type losses poes average_loss stddev_loss')
+
+
+def sparse_losses(assets, loss_type, loss_matrix, rupture_ids):
+    """
+    :param assets:
+        a list of A :class:`openquake.engine.db.models.ExposureData`
+    :param str loss_type:
+        the loss type of the loss ratios
+    :param loss_matrix:
+        an array of shape (A, R) with the loss ratios of the assets
+    :param rupture_ids:
+        the R ids of the ruptures, one for each column of `loss_matrix`
+    :returns:
+        three arrays (asset_ids, rupture_ids, losses) with the non-zero
+        absolute losses, in single precision
+    """
+    values = numpy.array([asset.value(loss_type) for asset in assets])
+    losses = (numpy.array(loss_matrix) *
+              values.reshape(len(values), 1)).astype(numpy.float32)
+    asset_idx, rupture_idx = losses.nonzero()
+    asset_ids = numpy.array([asset.id for asset in assets], dtype=int)
+    return (asset_ids[asset_idx],
+            numpy.array(rupture_ids, dtype=int)[rupture_idx],
+            losses[asset_idx, rupture_idx])
+
+
+def save_asset_losses(rc_id, hazard_output_id, loss_type, assets,
+                      loss_matrix, rupture_ids):
+    """
+    Store the non-zero losses of a block of assets, in a single row.
+    See :func:`sparse_losses` for a description of the parameters.
+
+    :param int rc_id:
+        the id of the current
+        :class:`openquake.engine.db.models.RiskCalculation`
+    :param int hazard_output_id:
+        the id of the hazard output the losses are computed from
+    """
+    asset_ids, rupture_ids, losses = sparse_losses(
+        assets, loss_type, loss_matrix, rupture_ids)
+    if len(losses):
+        writer.CacheInserter(models.AssetLoss, 1).copy([models.AssetLoss(
+            risk_calculation_id=rc_id,
+            hazard_output_id=hazard_output_id,
+            loss_type=loss_type,
+            asset_ids=asset_ids,
+            rupture_ids=rupture_ids,
+            losses=losses)])
+
+
+def select_assets(rc, taxonomies=None, region=None):
+    """
+    :param rc:
+        a :class:`openquake.engine.db.models.RiskCalculation` instance
+    :param taxonomies:
+        if given, a list of taxonomies to select
+    :param region:
+        if given, the WKT of the polygon containing the assets to select
+    :returns:
+        a sorted array with the ids of the selected assets of the
+        exposure of `rc`
+    """
+    assets = models.ExposureData.objects.filter(
+        exposure_model=rc.exposure_model)
+    if taxonomies:
+        assets = assets.filter(taxonomy__in=taxonomies)
+    if region:
+        # NB: the `within` lookup is not supported on geography fields
+        assets = assets.filter(site__coveredby=region)
+    return numpy.array(sorted(assets.values_list('id', flat=True)), dtype=int)
+
+
+def aggregate_losses(rc_id, hazard_output_id, loss_type, asset_ids=None):
+    """
+    Sum the stored losses of the given assets for each rupture.
+
+    :param int rc_id:
+        the id of a :class:`openquake.engine.db.models.RiskCalculation`
+    :param int hazard_output_id:
+        the id of the hazard output the losses are computed from
+    :param str loss_type:
+        the loss type to consider
+    :param asset_ids:
+        a sorted array of asset ids; if None, all the assets are considered
+    :returns:
+        a pair of arrays (rupture_ids, aggregate_losses) for the ruptures
+        causing a loss to the selected assets, sorted by rupture id
+    """
+    rows = models.AssetLoss.objects.filter(
+        risk_calculation=rc_id, hazard_output=hazard_output_id,
+        loss_type=loss_type).values_list('asset_ids', 'rupture_ids', 'losses')
+
+    all_ruptures = [numpy.array([], dtype=int)]
+    all_losses = [numpy.array([])]
+    for row_assets, row_ruptures, row_losses in rows.iterator():
+        row_ruptures = numpy.array(row_ruptures, dtype=int)
+        row_losses = numpy.array(row_losses)
+        if asset_ids is not None:
+            selected = numpy.in1d(row_assets, asset_ids)
+            row_ruptures = row_ruptures[selected]
+            row_losses = row_losses[selected]
+        all_ruptures.append(row_ruptures)
+        all_losses.append(row_losses)
+    return sum_by_rupture(
+        numpy.concatenate(all_ruptures), numpy.concatenate(all_losses))
+
+
+def sum_by_rupture(rupture_ids, losses):
+    """
+    :param rupture_ids: an array of N rupture ids, possibly repeated
+    :param losses: an array of N losses
+    :returns:
+        a pair of arrays (distinct_rupture_ids, aggregate_losses)
+    """
+    if not len(rupture_ids):
+        return rupture_ids, losses
+    distinct, inverse = numpy.unique(rupture_ids, return_inverse=True)
+    return distinct, numpy.bincount(inverse, weights=losses)
+
+
+def aggregate_loss_curves(rc, loss_type, asset_ids=None):
+    """
+    Compute the aggregate loss curves of the given assets, one for each
+    hazard output of the risk calculation, by using the stored losses.
+
+    Since only the non-zero losses are stored, the ruptures affecting
+    the assets without causing a loss are not known, whereas they are
+    counted by the aggregate loss curve of the calculator. The curve
+    and the average loss are the same, since a zero loss never exceeds
+    the loss levels of the curve, but the standard deviation is
+    computed on the non-zero losses only, so it can differ.
+    Hazard outputs with no losses for the given assets are skipped.
+
+    :param rc:
+        a :class:`openquake.engine.db.models.RiskCalculation` instance
+    :param str loss_type:
+        the loss type to consider
+    :param asset_ids:
+        a sorted array of asset ids; if None, all the assets are considered
+    :returns:
+        a list of :class:`AggregateLossCurve` instances
+    """
+    hc = rc.get_hazard_calculation()
+    tses = hc.ses_per_logic_tree_path * hc.investigation_time
+    curves = []
+    for hazard_output in rc.hazard_outputs():
+        _rupture_ids, losses = aggregate_losses(
+            rc.id, hazard_output.id, loss_type, asset_ids)
+        if not len(losses):
+            continue
+        curve_losses, curve_poes = scientific.event_based(
+            losses, tses=tses, time_span=rc.investigation_time,
+            curve_resolution=rc.loss_curve_resolution)
+        curves.append(AggregateLossCurve(
+            hazard_output, loss_type, curve_losses, curve_poes,
+            scientific.average_loss(curve_losses, curve_poes),
+            numpy.std(losses)))
+    return curves
@@ -18,7 +18,10 @@
 Core functionality for the classical PSHA risk calculator.
 """
 
+import copy
+import math
 import random
+import tempfile
 import collections
 import itertools
 import numpy
@@ -29,13 +32,16 @@ from openquake.hazardlib.geo import mesh
 from openquake.risklib import scientific, workflows
 
 from openquake.engine.calculators import post_processing
+from openquake.engine.calculators.hazard import general
 from openquake.engine.calculators.risk import (
     base, hazard_getters, validation, writers)
+from openquake.engine.calculators.risk.event_based import asset_loss
 from openquake.engine.db import models
 from openquake.engine import logs, writer
 from openquake.engine.input import logictree
 from openquake.engine.performance import EnginePerformanceMonitor
-from openquake.engine.utils import tasks
+from openquake.engine.utils import config, tasks
+from openquake.engine.utils.general import block_splitter
 
 
 @tasks.oqtask
@@ -54,57 +60,469 @@ def event_based(job_id, units, containers, params):
       An instance of :class:`..base.CalcParams` used to compute
       derived outputs
     :returns:
-      A dictionary {loss_type: event_loss_table}
+      A pair of dictionaries {loss_type: (rupture_ids, aggregate_losses)},
+      see :func:`event_loss_arrays`, and {(loss_type, group):
+      (rupture_ids, aggregate_losses)} with the aggregate losses of the
+      groups of assets, if `params.asset_groups` is set
     """
     monitor = EnginePerformanceMonitor(
         None, job_id, event_based, tracing=True)
 
     # Do the job in other functions, such that they can be unit tested
     # without the celery machinery
-    event_loss_tables = dict()
+    if params.asset_loss_table:
+        rc_id = models.OqJob.objects.get(pk=job_id).risk_calculation_id
+    else:
+        rc_id = None
 
     with db.transaction.commit_on_success(using='job_init'):
-        for unit in units:
-            event_loss_tables[unit.loss_type] = do_event_based(
-                unit, containers.with_args(loss_type=unit.loss_type),
-                params, monitor.copy)
-    return event_loss_tables
+        event_loss_tables, group_losses = do_event_based(
+            units, containers, params, monitor.copy, rc_id)
+    return (dict((loss_type, event_loss_arrays(event_loss_table))
+                 for loss_type, event_loss_table
+                 in event_loss_tables.iteritems()),
+            dict((key, asset_loss.sum_by_rupture(
+                numpy.concatenate([rupture_ids for rupture_ids, _ in pairs]),
+                numpy.concatenate([losses for _, losses in pairs])))
+                for key, pairs in group_losses.iteritems()))
+
+
+def event_loss_arrays(event_loss_table):
+    """
+    :param event_loss_table:
+        a Counter rupture_id -> aggregate loss
+    :returns:
+        a pair of arrays (rupture_ids, aggregate_losses), sorted by
+        rupture id, which are cheaper to transfer and to reduce than
+        the Counter
+    """
+    rupture_ids = sorted(event_loss_table)
+    return (numpy.array(rupture_ids, dtype=int),
+            numpy.array([event_loss_table[r] for r in rupture_ids]))
 
 
-def do_event_based(unit, containers, params, profile):
+@tasks.oqtask
+def event_based_gmfs(job_id, hazard_output_id, gsims, imts, site_ids,
+                     rupture_ids, rupture_seeds):
+    """
+    Celery task computing the ground motion values radiated by a block
+    of ruptures on the hazard sites associated to the assets. The
+    values are stored in :class:`openquake.engine.db.models.GmfCache`,
+    so that they can be read by all the event_based tasks.
+
+    :param job_id: the id of the current
+        :class:`openquake.engine.db.models.OqJob`
+    :param int hazard_output_id:
+        the id of the output of type ses holding the ruptures
+    :param gsims:
+        a dictionary of the gsims considered keyed by the tectonic
+        region type
+    :param imts:
+        the intensity measure types (in long form) required by the
+        risk models
+    :param site_ids:
+        the ids of the :class:`openquake.engine.db.models.HazardSite`
+        objects associated to the assets
+    :param rupture_ids:
+        a list of N ids of :class:`openquake.engine.db.models.SESRupture`
+    :param rupture_seeds:
+        a list of N seeds, one for each rupture
+    """
+    monitor = EnginePerformanceMonitor(
+        None, job_id, event_based_gmfs, tracing=True)
+
+    rc = models.OqJob.objects.get(pk=job_id).risk_calculation
+    hc = rc.get_hazard_calculation()
+    if hc.ground_motion_correlation_model is not None:
+        correl_model = general.get_correl_model(hc)
+    else:
+        correl_model = None
+
+    with monitor.copy('getting ruptures'):
+        ruptures = hazard_getters.get_ruptures(rupture_ids)
+
+    sites_assets = [(site_id, []) for site_id in site_ids]
+    inserter = writer.CacheInserter(models.GmfCache, 1000)
+    for imt in imts:
+        calc_getter = hazard_getters.GroundMotionValuesCalcGetter(
+            imt, hc.site_collection, sites_assets,
+            hc.truncation_level, gsims, correl_model, hc.id)
+
+        with monitor.copy('computing gmvs'):
+            site_gmv = calc_getter.compute_site_gmvs(
+                ruptures, rupture_seeds, rupture_ids, hc.maximum_distance)
+
+        with monitor.copy('saving gmvs'):
+            for site_id in sorted(site_gmv):
+                gmv = site_gmv.pop(site_id)
+                site_ruptures = sorted(gmv)
+                inserter.add(models.GmfCache(
+                    risk_calculation=rc,
+                    hazard_output_id=hazard_output_id,
+                    imt=imt,
+                    site_id=site_id,
+                    gmvs=[gmv[r] for r in site_ruptures],
+                    rupture_ids=site_ruptures))
+            inserter.flush()
+
+
+def do_event_based(units, containers, params, profile, rc_id=None):
     """
-    See `event_based` for a description of the params
+    See `event_based` for a description of the params. If `rc_id` is
+    given, the losses of each asset for each rupture are stored too.
 
-    :returns: the event loss table generated by `units`
+    The ruptures are processed in the chunks given by
+    `params.rupture_chunks`, one chunk at the time for all the units,
+    so that the loss matrices in memory do not depend on the number of
+    events and the hazard shared by several units is read once per
+    chunk. The losses are accumulated by :class:`EventBasedLosses`.
+
+    :returns:
+      a dictionary loss_type -> event loss table and a dictionary
+      (loss_type, group) -> list of pairs (rupture_ids, aggregate_losses)
+    """
+    unit_losses = [EventBasedLosses(unit, params, rc_id) for unit in units]
+    for ruptures in params.rupture_chunks or [None]:
+        for losses in unit_losses:
+            losses.update(ruptures, profile)
+
+    # there can be several units per loss type (one per taxonomy)
+    event_loss_tables = collections.defaultdict(collections.Counter)
+    group_losses = collections.defaultdict(list)
+    for losses in unit_losses:
+        loss_type = losses.unit.loss_type
+        event_loss_table, unit_group_losses = losses.save(
+            containers.with_args(loss_type=loss_type), profile)
+        event_loss_tables[loss_type] += event_loss_table
+        for group, pairs in unit_group_losses.iteritems():
+            group_losses[loss_type, group].extend(pairs)
+    return event_loss_tables, group_losses
+
+
+class _PrecomputedWorkflow(object):
+    """
+    A workflow returning the outputs already computed by
+    :class:`EventBasedLosses`, so that the statistics can be computed
+    by a :class:`openquake.risklib.workflows.CalculationUnit`. The other
+    attributes are the ones of the wrapped workflow.
     """
-    outputs, stats = unit(profile('getting data'),
-                          profile('computing individual risk'),
-                          post_processing, params.quantiles)
+    def __init__(self, workflow):
+        self.workflow = workflow
 
-    if not len(outputs):
-        logs.LOG.info("Exit from task as no asset could be processed")
-        return collections.Counter()
+    def __call__(self, *args):
+        # the last argument is the hazard data returned by the getter,
+        # i.e. the precomputed output
+        return args[-1]
 
-    for out in outputs:
-        if params.sites_disagg:
+    def __getattr__(self, name):
+        return getattr(self.workflow, name)
+
+
+class OutputLosses(object):
+    """
+    The losses of the assets of a calculation unit for a hazard output,
+    accumulated chunk of ruptures by chunk of ruptures. The loss ratio
+    matrices of the chunks are written to a temporary file, so that the
+    loss curves of each asset can be computed at the end from all of
+    its losses, reading back a block of assets at the time.
+
+    :param workflow:
+        the :class:`openquake.risklib.workflows.ProbabilisticEventBased`
+        instance of the calculation unit
+    """
+    def __init__(self, workflow):
+        self.workflow = workflow
+        self.rng_state = None
+        self.assets = []
+        # asset id -> ordinal of the asset in self.assets
+        self.ordinals = {}
+        # list of triples (sorted asset ordinals, number of ruptures,
+        # position in the file), one for each chunk
+        self.chunks = []
+        self.num_ruptures = 0
+        # the output of the last chunk
+        self.output = None
+        self.event_loss_table = collections.Counter()
+        # (asset id, magnitude_distance, coordinate) ->
+        # [asset, magnitude_distance, coordinate, fraction]
+        self.disagg = collections.OrderedDict()
+        self.losses_file = tempfile.TemporaryFile()
+
+    def add(self, output):
+        """
+        Add the losses of a chunk of ruptures.
+
+        :param output:
+          a :class:`openquake.risklib.workflows.ProbabilisticEventBased.Output`
+          computed on the chunk
+        """
+        ordinals = []
+        for asset in output.assets:
+            if asset.id not in self.ordinals:
+                self.ordinals[asset.id] = len(self.assets)
+                self.assets.append(asset)
+            ordinals.append(self.ordinals[asset.id])
+        ordinals = numpy.array(ordinals, dtype=int)
+        order = ordinals.argsort()
+        loss_matrix = numpy.array(output.loss_matrix, dtype=float)
+        self.losses_file.seek(0, 2)  # the end of the file
+        self.chunks.append((ordinals[order], loss_matrix.shape[1],
+                            self.losses_file.tell()))
+        loss_matrix[order].tofile(self.losses_file)
+        self.num_ruptures += loss_matrix.shape[1]
+        self.event_loss_table.update(output.event_loss_table)
+        self.output = output
+
+    def add_disagg(self, disagg_outputs):
+        """
+        Sum the loss fractions of a chunk of ruptures, given as a
+        :class:`DisaggregationOutputs` instance, to the ones of the
+        previous chunks falling in the same bins
+        """
+        for asset, mag_dist, coord, fraction in itertools.izip(
+                disagg_outputs.assets_disagg,
+                disagg_outputs.magnitude_distance,
+                disagg_outputs.coordinate, disagg_outputs.fractions):
+            key = (asset.id, mag_dist, coord)
+            if key in self.disagg:
+                self.disagg[key][3] += fraction
+            else:
+                self.disagg[key] = [asset, mag_dist, coord, fraction]
+
+    def disagg_outputs(self):
+        """
+        :returns: a :class:`DisaggregationOutputs` with the loss fractions
+            of all the chunks
+        """
+        rows = self.disagg.values()
+        return DisaggregationOutputs([row[0] for row in rows],
+                                     [row[1] for row in rows],
+                                     [row[2] for row in rows],
+                                     [row[3] for row in rows])
+
+    def read(self, start, stop):
+        """
+        :returns:
+            an array of shape (stop - start, R) with the loss ratios of
+            the assets with ordinals in the range [start, stop) for the
+            R ruptures of all the chunks; the losses of an asset for the
+            ruptures of a chunk where it has no ground motion values are
+            zeros
+        """
+        losses = numpy.zeros((stop - start, self.num_ruptures))
+        itemsize = losses.dtype.itemsize
+        column = 0
+        for ordinals, num_ruptures, position in self.chunks:
+            i, j = ordinals.searchsorted([start, stop])
+            if j > i:
+                self.losses_file.seek(position + i * num_ruptures * itemsize)
+                losses[ordinals[i:j] - start,
+                       column:column + num_ruptures] = numpy.fromfile(
+                    self.losses_file, count=(j - i) * num_ruptures
+                ).reshape(j - i, num_ruptures)
+            column += num_ruptures
+        return losses
+
+    def get_output(self, loss_type, params, block_size):
+        """
+        Compute the loss curves, the average and standard deviation of
+        the losses, the loss maps and the insured losses of all the
+        assets, reading the losses of `block_size` assets at the time.
+
+        :returns:
+          a :class:`openquake.risklib.workflows.ProbabilisticEventBased.Output`
+          without the loss matrix
+        """
+        insured = self.output.insured_curves is not None
+        curves, averages, stddevs = [], [], []
+        insured_curves, insured_averages, insured_stddevs = [], [], []
+        for start in range(0, len(self.assets), block_size):
+            stop = min(start + block_size, len(self.assets))
+            for asset, losses in itertools.izip(
+                    self.assets[start:stop], self.read(start, stop)):
+                curve = self.curve(losses, params)
+                curves.append(curve)
+                averages.append(scientific.average_loss(*curve))
+                stddevs.append(numpy.std(losses))
+                if insured:
+                    insured_losses = scientific.insured_losses(
+                        losses, asset.deductible(loss_type),
+                        asset.insurance_limit(loss_type))
+                    curve = self.curve(insured_losses, params)
+                    insured_curves.append(curve)
+                    insured_averages.append(scientific.average_loss(*curve))
+                    insured_stddevs.append(numpy.std(insured_losses))
+
+        loss_maps = numpy.array([
+            [scientific.conditional_loss_ratio(losses, poes, poe)
+             for losses, poes in curves]
+            for poe in params.conditional_loss_poes])
+        return self.output._replace(
+            assets=self.assets,
+            loss_matrix=None,
+            loss_curves=numpy.array(curves),
+            average_losses=numpy.array(averages),
+            stddev_losses=numpy.array(stddevs),
+            insured_curves=numpy.array(insured_curves) if insured else None,
+            average_insured_losses=(
+                numpy.array(insured_averages) if insured else None),
+            stddev_insured_losses=(
+                numpy.array(insured_stddevs) if insured else None),
+            loss_maps=loss_maps,
+            event_loss_table=self.event_loss_table)
+
+    @staticmethod
+    def curve(losses, params):
+        """
+        :returns: the loss curve (losses, poes) of the given losses
+        """
+        return scientific.event_based(
+            losses, tses=params.tses, time_span=params.time_span,
+            curve_resolution=params.loss_curve_resolution)
+
+
+class EventBasedLosses(object):
+    """
+    Accumulate the losses of a calculation unit, chunk of ruptures by
+    chunk of ruptures (see :meth:`EventBasedRiskCalculator.rupture_chunks`):
+    the event loss table, the aggregate losses of the groups of assets,
+    the stored asset losses and the loss fractions are updated as each
+    chunk is done, whereas the loss curves are computed at the end by
+    :class:`OutputLosses`.
+
+    The random numbers are sampled as by the scenario calculator (see
+    :class:`..scenario.core.ScenarioLosses`): the workflow is seeded only
+    for the first chunk of a hazard output and the generator continues
+    from its state at the end of the previous chunk.
+
+    :param unit:
+        a :class:`openquake.risklib.workflows.CalculationUnit`, whose
+        getter supports the method `select_ruptures`
+    :param params:
+        a :class:`..base.CalcParams` instance
+    :param rc_id:
+        if not None, the id of the risk calculation storing the
+        losses of each asset for each rupture
+    """
+    def __init__(self, unit, params, rc_id=None):
+        self.unit = unit
+        self.params = params
+        self.rc_id = rc_id
+        # hazard output id -> OutputLosses, in the order of the getter
+        self.outputs = collections.OrderedDict()
+        self.group_losses = collections.defaultdict(list)
+
+    def update(self, ruptures, profile):
+        """
+        Compute the losses of the given chunk of ruptures.
+
+        :param ruptures:
+            a slice of rupture ids, or None for all the ruptures
+        """
+        getter = self.unit.getter
+        if ruptures is not None:
+            getter = getter.select_ruptures(ruptures)
+        for hid, assets, hazard in list(getter(profile('getting data'))):
+            if hid not in self.outputs:
+                self.outputs[hid] = OutputLosses(self.unit.workflow)
+            if len(assets):
+                self._update(self.outputs[hid], hid, assets, hazard, profile)
+
+    def _update(self, output_losses, hid, assets, hazard, profile):
+        chunk_unit = workflows.CalculationUnit(
+            self.unit.loss_type, output_losses.workflow,
+            hazard_getters.ChunkGetter(
+                self.unit.getter, [(hid, assets, hazard)],
+                output_losses.rng_state))
+        ((_hid, output),), _stats = chunk_unit(
+            profile('getting data'), profile('computing individual risk'))
+        output_losses.rng_state = numpy.random.get_state()
+        if output_losses.workflow is self.unit.workflow:
+            # the following chunks continue the sequence of random numbers
+            output_losses.workflow = copy.copy(self.unit.workflow)
+            output_losses.workflow.seed = None
+        output_losses.add(output)
+
+        # the columns of the loss matrix correspond to the ruptures
+        # sorted by id
+        rupture_ids = numpy.array(
+            sorted(output.event_loss_table), dtype=int)
+
+        if self.params.asset_groups is not None:
+            with profile('aggregating losses by group'):
+                for group, losses in self.params.asset_groups.sum_by_group(
+                        output.assets, self.unit.loss_type,
+                        output.loss_matrix).iteritems():
+                    self.group_losses[group].append((rupture_ids, losses))
+
+        if self.params.sites_disagg:
+            with profile('getting rupture geometries'):
+                geometries = RuptureGeometries(rupture_ids)
             with profile('disaggregating results'):
-                rupture_ids = out.output.event_loss_table.keys()
-                disagg_outputs = disaggregate(out.output, rupture_ids, params)
-        else:
-            disagg_outputs = None
-
-        with profile('saving individual risk'):
-            save_individual_outputs(
-                containers.with_args(hazard_output_id=out.hid),
-                out.output, disagg_outputs, params)
-
-    if stats is not None:
-        with profile('saving risk statistics'):
-            save_statistical_output(
-                containers.with_args(hazard_output_id=None), stats, params)
-        return stats.event_loss_table
-    else:
-        return outputs[0].output.event_loss_table
+                output_losses.add_disagg(disaggregate(
+                    output, rupture_ids, self.params, geometries))
+
+        if self.rc_id is not None:
+            with profile('saving asset losses'):
+                asset_loss.save_asset_losses(
+                    self.rc_id, hid, self.unit.loss_type, output.assets,
+                    output.loss_matrix, rupture_ids)
+
+    def save(self, containers, profile):
+        """
+        Compute and save the loss curves, the loss maps, the loss
+        fractions and the statistics of the unit.
+
+        :returns:
+          the event loss table of the unit and a dictionary group ->
+          list of pairs (rupture_ids, aggregate_losses)
+        """
+        max_size = int(config.get('risk', 'max_loss_matrix_size') or 0)
+        outputs = []
+        for hid, output_losses in self.outputs.iteritems():
+            if not output_losses.assets:
+                continue
+            if max_size:
+                block_size = max(1, max_size // output_losses.num_ruptures)
+            else:
+                block_size = len(output_losses.assets)
+            with profile('computing loss curves'):
+                output = output_losses.get_output(
+                    self.unit.loss_type, self.params, block_size)
+            output_losses.losses_file.close()
+            if self.params.sites_disagg:
+                disagg_outputs = output_losses.disagg_outputs()
+            else:
+                disagg_outputs = None
+            with profile('saving individual risk'):
+                save_individual_outputs(
+                    containers.with_args(hazard_output_id=hid),
+                    output, disagg_outputs, self.params)
+            outputs.append((hid, output))
+
+        if not outputs:
+            logs.LOG.info("Exit from task as no asset could be processed")
+            return collections.Counter(), {}
+
+        event_loss_table = collections.Counter()
+        for _hid, output in outputs:
+            event_loss_table.update(output.event_loss_table)
+
+        if len(outputs) > 1:
+            stats_unit = workflows.CalculationUnit(
+                self.unit.loss_type, _PrecomputedWorkflow(self.unit.workflow),
+                hazard_getters.ChunkGetter(
+                    self.unit.getter,
+                    [(hid, output.assets, output) for hid, output in outputs],
+                    None))
+            _outputs, stats = stats_unit(
+                profile('getting data'), profile('computing risk statistics'),
+                post_processing, self.params.quantiles)
+            with profile('saving risk statistics'):
+                save_statistical_output(
+                    containers.with_args(hazard_output_id=None),
+                    stats, self.params)
+        return event_loss_table, self.group_losses
 
 
 def save_individual_outputs(containers, outputs, disagg_outputs, params):
@@ -214,6 +632,44 @@ def save_statistical_output(containers, stats, params):
             output_type="loss_curve", statistics="quantile", insured=True)
 
 
+class EventLossTable(object):
+    """
+    The aggregate losses of a loss type for each rupture, stored in a
+    dense array indexed by the ordinal of the rupture.
+
+    :param rupture_ids:
+        a sorted array with the ids of all the ruptures considered
+    """
+    def __init__(self, rupture_ids):
+        self.rupture_ids = rupture_ids
+        self.losses = numpy.zeros(len(rupture_ids))
+        # True for the ruptures contributing to the table, even if
+        # the loss is zero
+        self.affected = numpy.zeros(len(rupture_ids), dtype=bool)
+
+    def add(self, rupture_ids, losses):
+        """
+        Sum the given losses to the table.
+
+        :param rupture_ids: an array of distinct rupture ids
+        :param losses: an array with the aggregate loss of each rupture
+        """
+        ordinals = self.rupture_ids.searchsorted(rupture_ids)
+        self.losses[ordinals] += losses
+        self.affected[ordinals] = True
+
+    def get(self, rupture_ids):
+        """
+        :param rupture_ids: a sorted array of rupture ids
+        :returns:
+            a pair of arrays (rupture_ids, aggregate_losses) for the
+            ruptures in `rupture_ids` contributing to the table
+        """
+        ordinals = self.rupture_ids.searchsorted(rupture_ids)
+        affected = self.affected[ordinals]
+        return rupture_ids[affected], self.losses[ordinals][affected]
+
+
 class DisaggregationOutputs(object):
     def __init__(self, assets_disagg, magnitude_distance,
                  coordinate, fractions):
@@ -223,7 +679,77 @@ class DisaggregationOutputs(object):
         self.fractions = fractions
 
 
-def disaggregate(outputs, rupture_ids, params):
+class RuptureGeometries(object):
+    """
+    Cache of the magnitudes and of the surfaces of the ruptures
+    considered by the disaggregation, read with a single query.
+
+    :param rupture_ids:
+      the ids of the :class:`openquake.engine.db.models.SESRupture`
+      to be read
+    """
+    def __init__(self, rupture_ids):
+        rupture_ids = sorted(set(rupture_ids))
+        ruptures = hazard_getters.get_ruptures(rupture_ids)
+        self.magnitudes = dict(
+            (rupture_id, rupture.mag)
+            for rupture_id, rupture in itertools.izip(rupture_ids, ruptures))
+        self.surfaces = dict(
+            (rupture_id, rupture.surface)
+            for rupture_id, rupture in itertools.izip(rupture_ids, ruptures))
+
+    def bins(self, rupture_ids, sites, params):
+        """
+        :param list rupture_ids:
+          R ids of ruptures held by the cache
+        :param list sites:
+          S points where to disaggregate
+        :param params:
+          an instance of :class:`..base.CalcParams`
+        :returns:
+          an integer array of shape (R, S, 4) holding the magnitude,
+          distance, longitude and latitude bins of each rupture for
+          each site
+        """
+        sites_mesh = mesh.Mesh(numpy.array([site.x for site in sites]),
+                               numpy.array([site.y for site in sites]), None)
+        bins = numpy.zeros((len(rupture_ids), len(sites), 4), dtype=int)
+        for i, rupture_id in enumerate(rupture_ids):
+            surface = self.surfaces[rupture_id]
+            closest_points = surface.get_closest_points(sites_mesh)
+            # the assignment to an integer array truncates the values
+            bins[i, :, 0] = numpy.floor(
+                self.magnitudes[rupture_id] / params.mag_bin_width)
+            bins[i, :, 1] = numpy.floor(
+                surface.get_joyner_boore_distance(sites_mesh)
+            ) / params.distance_bin_width
+            bins[i, :, 2] = (
+                closest_points.lons / params.coordinate_bin_width)
+            bins[i, :, 3] = (
+                closest_points.lats / params.coordinate_bin_width)
+        return bins
+
+
+def sum_by_bin(bins, fractions):
+    """
+    :param bins:
+      an integer array of shape (N, K) with the bins of N losses
+    :param fractions:
+      an array with the N losses
+    :returns:
+      a pair (distinct_bins, sums) with the M distinct rows of `bins`,
+      as an array of shape (M, K), and the sum of the losses falling
+      in each of them
+    """
+    bins = numpy.ascontiguousarray(bins)
+    n, k = bins.shape
+    rows = bins.view([('f%d' % i, bins.dtype) for i in range(k)]).reshape(n)
+    distinct, inverse = numpy.unique(rows, return_inverse=True)
+    return (distinct.view(bins.dtype).reshape(len(distinct), k),
+            numpy.bincount(inverse, weights=fractions))
+
+
+def disaggregate(outputs, rupture_ids, params, geometries):
     """
     Compute disaggregation outputs given the individual `outputs` and `params`
 
@@ -232,47 +758,54 @@ def disaggregate(outputs, rupture_ids, params):
       :class:`openquake.risklib.workflows.ProbabilisticEventBased.Output`
     :param params:
       an instance of :class:`..base.CalcParams`
-    :param list rupture_ids:
-      a list of :class:`openquake.engine.db.models.SESRupture` IDs
+    :param rupture_ids:
+      an array with the sorted ids of the
+      :class:`openquake.engine.db.models.SESRupture` objects
+      corresponding to the columns of the loss matrix
+    :param geometries:
+      a :class:`RuptureGeometries` instance holding the ruptures
     :returns:
       an instance of :class:`DisaggregationOutputs`
     """
-    def disaggregate_site(site, loss_ratios):
-        for fraction, rupture_id in zip(loss_ratios, rupture_ids):
-            rupture = models.SESRupture.objects.get(pk=rupture_id)
-            s = rupture.surface
-            m = mesh.Mesh(numpy.array([site.x]), numpy.array([site.y]), None)
-
-            mag = numpy.floor(rupture.magnitude / params.mag_bin_width)
-            dist = numpy.floor(
-                s.get_joyner_boore_distance(m))[0] / params.distance_bin_width
-
-            closest_point = iter(s.get_closest_points(m)).next()
-            lon = closest_point.longitude / params.coordinate_bin_width
-            lat = closest_point.latitude / params.coordinate_bin_width
-
-            yield "%d,%d" % (mag, dist), "%d,%d" % (lon, lat), fraction
+    assets_losses = [
+        (asset, losses)
+        for asset, losses in itertools.izip(
+            outputs.assets, outputs.loss_matrix)
+        if asset.site in params.sites_disagg]
+
+    if not assets_losses or not len(rupture_ids):
+        return DisaggregationOutputs([], [], [], [])
+
+    # the distinct disaggregation sites
+    site_index = {}
+    sites = []
+    for asset, _losses in assets_losses:
+        if asset.site.coords not in site_index:
+            site_index[asset.site.coords] = len(sites)
+            sites.append(asset.site)
+    bins = geometries.bins(rupture_ids, sites, params)
 
     assets_disagg = []
-    disagg_matrix = []
-
-    for asset, losses in zip(outputs.assets, outputs.loss_matrix):
-        if asset.site in params.sites_disagg:
-            disagg_matrix.extend(list(disaggregate_site(asset.site, losses)))
-
-            # FIXME. the functions in
-            # openquake.engine.calculators.risk.writers requires an
-            # asset per each row in the disaggregation matrix. To this
-            # aim, we repeat the assets that will be passed to such
-            # functions
-            assets_disagg = itertools.chain(
-                assets_disagg,
-                itertools.repeat(asset, len(rupture_ids)))
-
-    if assets_disagg:
-        magnitudes, coordinates, fractions = zip(*disagg_matrix)
-    else:
-        magnitudes, coordinates, fractions = [], [], []
+    magnitudes = []
+    coordinates = []
+    fractions = []
+    for asset, losses in assets_losses:
+        assert len(losses) == len(rupture_ids), (
+            'Got %d losses for %d ruptures' % (len(losses), len(rupture_ids)))
+        asset_bins, asset_fractions = sum_by_bin(
+            bins[:, site_index[asset.site.coords]], losses)
+
+        # FIXME. the functions in
+        # openquake.engine.calculators.risk.writers requires an
+        # asset per each row in the disaggregation matrix. To this
+        # aim, we repeat the assets that will be passed to such
+        # functions
+        assets_disagg.extend([asset] * len(asset_bins))
+        magnitudes.extend("%d,%d" % (mag, dist)
+                          for mag, dist in asset_bins[:, :2])
+        coordinates.extend("%d,%d" % (lon, lat)
+                           for lon, lat in asset_bins[:, 2:])
+        fractions.extend(asset_fractions)
 
     return DisaggregationOutputs(
         assets_disagg, magnitudes, coordinates, fractions)
@@ -296,9 +829,17 @@ class EventBasedRiskCalculator(base.RiskCalculator):
     output_builders = [writers.EventLossCurveMapBuilder,
                        writers.LossFractionBuilder]
 
+    associate_assets_to_sites = True
+
     def __init__(self, job):
         super(EventBasedRiskCalculator, self).__init__(job)
-        self.event_loss_tables = collections.defaultdict(collections.Counter)
+        # loss type -> EventLossTable, initialized in pre_execute
+        self.event_loss_tables = {}
+        # hazard output id -> sorted array of rupture ids
+        self.rupture_ids = {}
+        # (loss type, group) -> EventLossTable, initialized on demand
+        self.group_loss_tables = {}
+        self.all_rupture_ids = None
         self.rnd = random.Random()
         self.rnd.seed(self.rc.master_seed)
 
@@ -314,14 +855,109 @@ class EventBasedRiskCalculator(base.RiskCalculator):
         self.hazard_seeds = [rnd.randint(0, models.MAX_SINT_32)
                              for _ in self.rc.hazard_outputs()]
 
+    def pre_execute(self):
+        """
+        In addition to the base pre_execute, when the hazard outputs are
+        stochastic event sets, compute in parallel the ground motion
+        values on the hazard sites associated to the assets, once for all
+        the risk tasks. Initialize also the event loss tables.
+        """
+        super(EventBasedRiskCalculator, self).pre_execute()
+
+        for hazard_output in self.rc.hazard_outputs():
+            self.rupture_ids[hazard_output.id] = numpy.array(sorted(
+                models.SESRupture.objects.filter(
+                    ses__ses_collection__lt_realization=
+                    hazard_output.output_container.lt_realization
+                ).values_list('id', flat=True)), dtype=int)
+        self.all_rupture_ids = numpy.unique(numpy.concatenate(
+            [numpy.array([], dtype=int)] + self.rupture_ids.values()))
+        for loss_type in models.loss_types(self.risk_models):
+            self.event_loss_tables[loss_type] = EventLossTable(
+                self.all_rupture_ids)
+
+        if self.rc.hazard_outputs()[0].output_type == "ses":
+            self.parallelize(event_based_gmfs,
+                             self.event_based_gmfs_arg_gen(),
+                             self.log_percent)
+
+    def rupture_chunks(self):
+        """
+        The ruptures are processed by the tasks in chunks, so that the
+        loss matrix of a task (assets x ruptures) has at most
+        `max_loss_matrix_size` elements, as set in openquake.cfg.
+
+        :returns:
+            a list of slices of rupture ids, with integer bounds, or None
+            if all the ruptures fit in a single chunk
+        """
+        max_size = int(config.get('risk', 'max_loss_matrix_size') or 0)
+        chunk_size = max(1, max_size // self.block_size())
+        if not max_size or len(self.all_rupture_ids) <= chunk_size:
+            return None
+        starts = self.all_rupture_ids[::chunk_size].tolist()
+        stops = starts[1:] + [int(self.all_rupture_ids[-1]) + 1]
+        return [slice(start, stop) for start, stop in zip(starts, stops)]
+
+    def event_based_gmfs_arg_gen(self):
+        """
+        Argument generator for the task event_based_gmfs. For each
+        hazard output, it splits the ruptures (ordered by tag) in blocks
+        and yields a tuple of the form (job_id, hazard_output_id, gsims,
+        imts, site_ids, rupture_ids, rupture_seeds).
+        """
+        site_ids = sorted(set(models.AssetSite.objects.filter(
+            risk_calculation=self.rc).values_list('site', flat=True)))
+        imts = sorted(models.required_imts(self.risk_models))
+        ltp = logictree.LogicTreeProcessor.from_hc(self.rc)
+
+        for hazard_output, seed in zip(
+                self.rc.hazard_outputs(), self.hazard_seeds):
+            ses_coll = hazard_output.output_container
+            gsims = ltp.parse_gmpe_logictree_path(
+                ses_coll.lt_realization.gsim_lt_path)
+
+            # check that the ruptures have been computed by a sufficiently
+            # new version of openquake
+            queryset = models.SESRupture.objects.filter(
+                ses__ses_collection=ses_coll).order_by('tag')
+            if queryset.filter(rupture="not computed").exists():
+                msg = ("The stochastic event set has been computed with "
+                       " a version of openquake engine too old. "
+                       "Please, re-run your hazard")
+                logs.LOG.error(msg)
+                raise RuntimeError(msg)
+            rupture_ids = list(queryset.values_list('id', flat=True))
+            if not rupture_ids:
+                continue
+
+            # the rupture seeds are generated as in
+            # GroundMotionValuesGetter.compute_gmvs
+            numpy.random.seed(seed)
+            rupture_seeds = numpy.random.randint(
+                0, models.MAX_SINT_32, len(rupture_ids)).tolist()
+
+            preferred_block_size = int(
+                math.ceil(float(len(rupture_ids)) / self.concurrent_tasks()))
+            for rupts, seeds in zip(
+                    block_splitter(rupture_ids, preferred_block_size),
+                    block_splitter(rupture_seeds, preferred_block_size)):
+                yield (self.job.id, hazard_output.id, gsims, imts, site_ids,
+                       rupts, seeds)
+
     def task_completed(self, event_loss_tables):
         """
         Updates the event loss table
         """
         self.log_percent(event_loss_tables)
-        for loss_type in models.loss_types(self.risk_models):
-            task_loss_table = event_loss_tables[loss_type]
-            self.event_loss_tables[loss_type] += task_loss_table
+        event_loss_tables, group_loss_tables = event_loss_tables
+        for loss_type, (rupture_ids, losses) in event_loss_tables.iteritems():
+            self.event_loss_tables[loss_type].add(rupture_ids, losses)
+        for key, (rupture_ids, losses) in group_loss_tables.iteritems():
+            if key not in self.group_loss_tables:
+                self.group_loss_tables[key] = EventLossTable(
+                    self.all_rupture_ids)
+            self.group_loss_tables[key].add(rupture_ids, losses)
 
     def post_process(self):
         """
@@ -329,7 +965,6 @@ class EventBasedRiskCalculator(base.RiskCalculator):
         """
         with EnginePerformanceMonitor('post processing', self.job.id):
 
-            time_span, tses = self.hazard_times()
             for loss_type, event_loss_table in self.event_loss_tables.items():
                 for hazard_output in self.rc.hazard_outputs():
 
@@ -341,52 +976,61 @@ class EventBasedRiskCalculator(base.RiskCalculator):
                             "event_loss"),
                         loss_type=loss_type,
                         hazard_output=hazard_output)
-                    inserter = writer.CacheInserter(models.EventLossData, 9999)
-
-                    rupture_ids = models.SESRupture.objects.filter(
-                        ses__ses_collection__lt_realization=
-                        hazard_output.output_container.lt_realization
-                    ).values_list('id', flat=True)
-
-                    for rupture_id in rupture_ids:
-                        if rupture_id in event_loss_table:
-                            inserter.add(
-                                models.EventLossData(
-                                    event_loss_id=event_loss.id,
-                                    rupture_id=rupture_id,
-                                    aggregate_loss=event_loss_table[
-                                        rupture_id]))
-                    inserter.flush()
-
-                    aggregate_losses = [
-                        event_loss_table[rupture_id]
-                        for rupture_id in rupture_ids
-                        if rupture_id in event_loss_table]
-
-                    if aggregate_losses:
-                        aggregate_loss_losses, aggregate_loss_poes = (
-                            scientific.event_based(
-                                aggregate_losses, tses=tses,
-                                time_span=time_span,
-                                curve_resolution=self.rc.loss_curve_resolution
-                            ))
-
-                        models.AggregateLossCurveData.objects.create(
-                            loss_curve=models.LossCurve.objects.create(
-                                aggregate=True, insured=False,
-                                hazard_output=hazard_output,
-                                loss_type=loss_type,
-                                output=models.Output.objects.create_output(
-                                    self.job,
-                                    "aggregate loss curves. "
-                                    "loss_type=%s hazard=%s" % (
-                                        loss_type, hazard_output),
-                                    "agg_loss_curve")),
-                            losses=aggregate_loss_losses,
-                            poes=aggregate_loss_poes,
-                            average_loss=scientific.average_loss(
-                                aggregate_loss_losses, aggregate_loss_poes),
-                            stddev_loss=numpy.std(aggregate_losses))
+                    rupture_ids, aggregate_losses = event_loss_table.get(
+                        self.rupture_ids[hazard_output.id])
+
+                    if len(rupture_ids):
+                        writer.CacheInserter.saveall([
+                            models.EventLossData(
+                                event_loss_id=event_loss.id,
+                                rupture_id=rupture_id,
+                                aggregate_loss=aggregate_loss)
+                            for rupture_id, aggregate_loss in itertools.izip(
+                                rupture_ids.tolist(),
+                                aggregate_losses.tolist())])
+
+                    self.save_aggregate_loss_curve(
+                        loss_type, hazard_output, aggregate_losses)
+
+            for (loss_type, group), group_loss_table in sorted(
+                    self.group_loss_tables.items()):
+                for hazard_output in self.rc.hazard_outputs():
+                    _rupture_ids, aggregate_losses = group_loss_table.get(
+                        self.rupture_ids[hazard_output.id])
+                    self.save_aggregate_loss_curve(
+                        loss_type, hazard_output, aggregate_losses, group)
+
+    def save_aggregate_loss_curve(self, loss_type, hazard_output,
+                                  aggregate_losses, group=None):
+        """
+        Compute and save the aggregate loss curve of the given losses,
+        if any. `group` is the taxonomy or the region of the assets the
+        losses refer to, None for the whole exposure.
+        """
+        if not len(aggregate_losses):
+            return
+        time_span, tses = self.hazard_times()
+        aggregate_loss_losses, aggregate_loss_poes = scientific.event_based(
+            aggregate_losses, tses=tses, time_span=time_span,
+            curve_resolution=self.rc.loss_curve_resolution)
+
+        name = "aggregate loss curves. loss_type=%s hazard=%s" % (
+            loss_type, hazard_output)
+        if group is not None:
+            name += " %s=%s" % (self.rc.aggregate_by, group)
+        models.AggregateLossCurveData.objects.create(
+            loss_curve=models.LossCurve.objects.create(
+                aggregate=True, insured=False,
+                hazard_output=hazard_output,
+                loss_type=loss_type,
+                aggregation_group=group,
+                output=models.Output.objects.create_output(
+                    self.job, name, "agg_loss_curve")),
+            losses=aggregate_loss_losses,
+            poes=aggregate_loss_poes,
+            average_loss=scientific.average_loss(
+                aggregate_loss_losses, aggregate_loss_poes),
+            stddev_loss=numpy.std(aggregate_losses))
 
     def calculation_unit(self, loss_type, assets):
         """
@@ -424,7 +1068,8 @@ class EventBasedRiskCalculator(base.RiskCalculator):
                 self.rc.best_maximum_distance,
                 risk_model.imt,
                 self.hazard_seeds,
-                ltp))
+                ltp,
+                risk_calculation_id=self.rc.id))
 
     def hazard_times(self):
         """
@@ -441,6 +1086,7 @@ class EventBasedRiskCalculator(base.RiskCalculator):
         Calculator specific parameters
         """
 
+        time_span, tses = self.hazard_times()
         return base.make_calc_params(
             conditional_loss_poes=self.rc.conditional_loss_poes or [],
             quantiles=self.rc.quantile_loss_curves or [],
@@ -448,4 +1094,10 @@ class EventBasedRiskCalculator(base.RiskCalculator):
             sites_disagg=self.rc.sites_disagg or [],
             mag_bin_width=self.rc.mag_bin_width,
             distance_bin_width=self.rc.distance_bin_width,
-            coordinate_bin_width=self.rc.coordinate_bin_width)
+            coordinate_bin_width=self.rc.coordinate_bin_width,
+            asset_loss_table=self.rc.asset_loss_table,
+            asset_groups=self.get_asset_groups(),
+            rupture_chunks=self.rupture_chunks(),
+            time_span=time_span,
+            tses=tses,
+            loss_curve_resolution=self.rc.loss_curve_resolution)
@@ -119,16 +119,22 @@ class EventBasedBCRRiskCalculator(event_based.EventBasedRiskCalculator):
                 self.rc.interest_rate,
                 self.rc.asset_life_expectancy),
             hazard_getters.BCRGetter(
-                hazard_getters.GroundMotionValuesGetter(
-                    self.rc.hazard_outputs(),
-                    assets,
-                    self.rc.best_maximum_distance,
-                    model_orig.imt),
-                hazard_getters.GroundMotionValuesGetter(
-                    self.rc.hazard_outputs(),
-                    assets,
-                    self.rc.best_maximum_distance,
-                    model_retro.imt)))
+                self.hazard_getter(assets, model_orig.imt),
+                None if model_retro.imt == model_orig.imt
+                else self.hazard_getter(assets, model_retro.imt)))
+
+    def hazard_getter(self, assets, imt):
+        """
+        :returns:
+            a :class:`openquake.engine.calculators.risk.hazard_getters.
+            GroundMotionValuesGetter` for the given assets and IMT
+        """
+        return hazard_getters.GroundMotionValuesGetter(
+            self.rc.hazard_outputs(),
+            assets,
+            self.rc.best_maximum_distance,
+            imt,
+            risk_calculation_id=self.rc.id)
 
     def post_process(self):
         """
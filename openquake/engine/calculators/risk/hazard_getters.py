@@ -22,6 +22,7 @@ A HazardGetter is responsible fo getting hazard outputs needed by a risk
 calculation.
 """
 
+import copy
 import itertools
 import collections
 import numpy
@@ -38,11 +39,67 @@ from openquake.engine import logs
 from openquake.engine.db import models
 from openquake.engine.performance import DummyMonitor, LightMonitor
 from openquake.engine.calculators.hazard import general
+from openquake.engine.utils.general import block_splitter
 
 #: Scaling constant do adapt to the postgis functions (that work with
 #: meters)
 KILOMETERS_TO_METERS = 1000
 
+#: Maximum number of random variates (ruptures x sites) generated in a
+#: single batch when computing the epsilons
+EPSILONS_BLOCK_SIZE = 10 ** 6
+
+#: SQL expression selecting the elements of an array of a GmfCache or
+#: GmfData row (gmvs or rupture_ids) referring to the ruptures with
+#: ids in the range [%s, %s)
+RUPTURE_CHUNK = """ARRAY(
+SELECT %s[i] FROM generate_subscripts(rupture_ids, 1) AS i
+WHERE rupture_ids[i] >= %%s AND rupture_ids[i] < %%s ORDER BY i)"""
+
+
+def get_ruptures(rupture_ids):
+    """
+    :param rupture_ids:
+        a sequence of ids of :class:`openquake.engine.db.models.SESRupture`
+        objects
+    :returns:
+        the list of the corresponding unpickled
+        :class:`openquake.hazardlib.source.rupture.Rupture` instances,
+        in the same order of `rupture_ids`, read with a single query
+    """
+    cursor = models.getcursor('job_init')
+    cursor.execute("""
+    SELECT id, rupture FROM hzrdr.ses_rupture WHERE id = ANY(%s)""",
+                   (list(rupture_ids),))
+    ruptures = dict((r_id, pickle.loads(str(rupture_data)))
+                    for r_id, rupture_data in cursor.fetchall())
+    return [ruptures[r_id] for r_id in rupture_ids]
+
+
+def unique_data(data, keys):
+    """
+    Find the distinct hazard data in a list of per-asset data, i.e.
+    the data of the distinct hazard sites.
+
+    :param data: a list of N hazard data, one per asset
+    :param keys:
+        a list of N hashable keys identifying the hazard data, e.g.
+        the ids of the hazard sites associated to the assets
+    :returns:
+        a pair (unique, inverse) where unique is the list of the distinct
+        hazard data and inverse an array of N indices such that
+        `unique[inverse[i]]` is the datum with key `keys[i]`
+    """
+    unique = []
+    indices = {}
+    inverse = numpy.zeros(len(data), dtype=int)
+    for i, (key, datum) in enumerate(zip(keys, data)):
+        if key not in indices:
+            indices[key] = len(unique)
+            unique.append(datum)
+        inverse[i] = indices[key]
+    return unique, inverse
+
 
 class HazardGetter(object):
     """
@@ -71,6 +128,13 @@ class HazardGetter(object):
         self.max_distance = max_distance
         self.imt = imt
         self.imt_type, self.sa_period, self.sa_damping = from_string(imt)
+        self._set_assets(assets)
+
+    def _set_assets(self, assets):
+        """
+        Set the assets of the getter and the attributes depending on them
+        """
+        self.assets = assets
         # FIXME(lp). It is better to directly store the convex hull
         # instead of the mesh. We are not doing it because
         # hazardlib.Polygon is not (yet) pickeable
@@ -79,6 +143,22 @@ class HazardGetter(object):
             for asset in self.assets])
         self.asset_dict = dict((asset.id, asset) for asset in self.assets)
 
+    def clone(self, assets):
+        """
+        :returns: a copy of the getter working on the given `assets`
+        """
+        new = copy.copy(self)
+        new._set_assets(assets)
+        return new
+
+    def filter_data(self, data, indices):
+        """
+        :param data: the hazard data returned by :meth:`get_data`
+        :param indices: the indices of the assets to keep
+        :returns: the hazard data of the assets at the given indices
+        """
+        return [data[i] for i in indices]
+
     def __repr__(self):
         return "<%s max_distance=%s assets=%s>" % (
             self.__class__.__name__, self.max_distance,
@@ -158,13 +238,20 @@ class HazardCurveGetterPerAsset(HazardGetter):
         with monitor.copy('getting closest hazard curves'):
             assets = []
             curves = []
+            # the assets on the same location share the same curve,
+            # which is read only once
+            site_curves = {}
 
             for asset in self.assets:
-                queryset = self.get_by_site(asset.site, hc.id)
-                if queryset is not None:
-                    [poes] = queryset
+                location = (asset.site.x, asset.site.y)
+                if location not in site_curves:
+                    queryset = self.get_by_site(asset.site, hc.id)
+                    site_curves[location] = (
+                        None if queryset is None else zip(imls, queryset[0]))
+                curve = site_curves[location]
+                if curve is not None:
                     assets.append(asset)
-                    curves.append(zip(imls, poes))
+                    curves.append(curve)
 
         return assets, curves
 
@@ -197,16 +284,85 @@ class GroundMotionValuesGetter(HazardGetter):
     """
     Hazard getter for loading ground motion values. It is instantiated
     with a set of assets all of the same taxonomy.
+
+    :attr risk_calculation_id:
+        If given, the id of the risk calculation whose asset -> site
+        association has been stored in the pre_execute phase (see
+        :class:`openquake.engine.db.models.AssetSite`); otherwise the
+        association is computed on the fly with a spatial query.
+
+    :attr realizations:
+        If not None, the slice of the scenario ground motion fields to
+        read, see :meth:`slice`.
+
+    :attr ruptures:
+        If not None, the slice of rupture ids whose ground motion values
+        are read, see :meth:`select_ruptures`.
     """
+    realizations = None
+    ruptures = None
 
     def __init__(
-            self, hazard, assets, max_distance, imt, seeds=None, ltp=None):
+            self, hazard, assets, max_distance, imt, seeds=None, ltp=None,
+            risk_calculation_id=None):
         super(GroundMotionValuesGetter, self).__init__(
             hazard, assets, max_distance, imt)
         assert hazard[0].output_type != "ses" or (
             seeds is not None and ltp is not None)
         self.seeds = seeds or [None] * len(hazard)
         self.logic_tree_processor = ltp
+        self.risk_calculation_id = risk_calculation_id
+
+    def slice(self, realizations):
+        """
+        :param realizations: a slice of the ground motion fields
+        :returns:
+            a copy of the getter reading only the given realizations
+            of the scenario ground motion fields, so that they can be
+            processed in chunks. The slice is performed by the database,
+            since the ground motion values of a scenario are stored in a
+            single array per site and IMT.
+        """
+        new = copy.copy(self)
+        if realizations.start or realizations.stop is not None:
+            new.realizations = realizations
+        return new
+
+    def select_ruptures(self, ruptures):
+        """
+        :param ruptures:
+            a slice(start, stop) of rupture ids, with integer bounds
+        :returns:
+            a copy of the getter reading only the ground motion values of
+            the ruptures with start <= id < stop, so that the ruptures of
+            an event based calculation can be processed in chunks. The
+            assets of the sites without ground motion values in the chunk
+            are not returned and not reported as missing.
+        """
+        new = copy.copy(self)
+        new.ruptures = ruptures
+        return new
+
+    def get_assets_data(self, hazard_output, monitor=None):
+        """
+        Override base method to not report the assets without ground
+        motion values in a chunk of ruptures, since they can have values
+        in other chunks
+        """
+        if self.ruptures is None:
+            return super(GroundMotionValuesGetter, self).get_assets_data(
+                hazard_output, monitor)
+        return self.get_data(hazard_output, monitor or DummyMonitor())
+
+    def filter_data(self, data, indices):
+        """
+        Override base method to manage the event based case, where the
+        data is a pair (GMVs, rupture_ids)
+        """
+        if isinstance(data, tuple):  # event based
+            gmvs, ruptures = data
+            return [gmvs[i] for i in indices], ruptures
+        return [data[i] for i in indices]
 
     def __call__(self, monitor=None):
         """
@@ -221,6 +377,54 @@ class GroundMotionValuesGetter(HazardGetter):
         """
         Iterator yielding site_id, assets.
         """
+        if self.risk_calculation_id is not None:
+            sites_assets = self._stored_sites_assets()
+        else:
+            sites_assets = self._closest_sites_assets(hazard_output)
+        if not sites_assets:
+            logs.LOG.warn('No close site found for %d assets of taxonomy %s',
+                          len(self.assets), self.assets[0].taxonomy)
+        for site_id, asset_ids in sites_assets:
+            assets = [self.asset_dict[i] for i in asset_ids
+                      if i in self.asset_dict]
+            # notice the "if i in self.asset_dict": in principle, it should
+            # not be necessary; in practice, the query may returns spurious
+            # assets not in the initial set; this is why we are filtering
+            # the spurious assets; it is a mysterious behaviour of PostGIS
+            if assets:
+                yield site_id, assets
+
+    def asset_sites(self):
+        """
+        :returns:
+            a dictionary asset_id -> site_id with the hazard sites
+            associated to the assets of the getter
+        """
+        hazard_output = self.hazard_outputs[0].output_container
+        return dict((asset.id, site_id)
+                    for site_id, assets in self.assets_gen(hazard_output)
+                    for asset in assets)
+
+    def _stored_sites_assets(self):
+        """
+        :returns: a list of pairs (site_id, asset_ids) read from the
+        asset -> site association precomputed for the risk calculation
+        """
+        cursor = models.getcursor('job_init')
+        query = """
+SELECT site_id, array_agg(asset_id ORDER BY asset_id) AS asset_ids
+FROM riskr.asset_site
+WHERE risk_calculation_id = %s AND asset_id = ANY(%s)
+GROUP BY site_id ORDER BY site_id"""
+        cursor.execute(query, (self.risk_calculation_id,
+                               sorted(self.asset_dict)))
+        return cursor.fetchall()
+
+    def _closest_sites_assets(self, hazard_output):
+        """
+        :returns: a list of pairs (site_id, asset_ids) computed with a
+        spatial query associating each asset to the closest hazard site
+        """
         cursor = models.getcursor('job_init')
         # NB: the ``distinct ON (exposure_data.id)`` combined with the
         # ``ORDER BY ST_Distance`` does the job to select the closest site.
@@ -244,37 +448,70 @@ GROUP BY site_id ORDER BY site_id;
                 self.assets[0].exposure_model_id,
                 self._assets_mesh.get_convex_hull().wkt)
         cursor.execute(query, args)
-        sites_assets = cursor.fetchall()
-        if not sites_assets:
-            logs.LOG.warn('No close site found for %d assets of taxonomy %s',
-                          len(self.assets), self.assets[0].taxonomy)
-        for site_id, asset_ids in sites_assets:
-            assets = [self.asset_dict[i] for i in asset_ids
-                      if i in self.asset_dict]
-            # notice the "if i in self.asset_dict": in principle, it should
-            # not be necessary; in practice, the query may returns spurious
-            # assets not in the initial set; this is why we are filtering
-            # the spurious assets; it is a mysterious behaviour of PostGIS
-            if assets:
-                yield site_id, assets
+        return cursor.fetchall()
 
-    def get_gmvs_ruptures(self, gmf, site_id):
+    def get_gmvs_ruptures(self, queryset, site_ids):
         """
-        :returns: gmvs and ruptures for the given site and IMT
-        """
-        gmvs = []
-        ruptures = []
+        Fetch with a single query the ground motion values of all the
+        given sites.
 
-        for gmf in models.GmfData.objects.filter(
-                gmf=gmf,
-                site=site_id, imt=self.imt_type, sa_period=self.sa_period,
-                sa_damping=self.sa_damping):
-            gmvs.extend(gmf.gmvs)
-            if gmf.rupture_ids:
-                ruptures.extend(gmf.rupture_ids)
-        if not gmvs:
-            logs.LOG.warn('No gmvs for site %s, IMT=%s', site_id, self.imt)
-        return gmvs, ruptures
+        :param queryset:
+            a queryset over :class:`openquake.engine.db.models.GmfData`
+            or :class:`openquake.engine.db.models.GmfCache` objects
+            already filtered by output and IMT
+        :returns:
+            a dictionary site_id -> (gmvs, rupture_ids), where gmvs and
+            rupture_ids are numpy arrays (rupture_ids is empty for
+            scenario calculations)
+        """
+        gmvs = collections.defaultdict(list)
+        ruptures = collections.defaultdict(list)
+
+        queryset = queryset.filter(site__in=site_ids)
+        gmvs_field, ruptures_field = 'gmvs', 'rupture_ids'
+        if self.realizations is not None:
+            # the PostgreSQL arrays are 1-based and the slices include
+            # the upper bound
+            gmvs_field = 'gmvs_slice'
+            queryset = queryset.extra(
+                select={gmvs_field: 'gmvs[%s:%s]'},
+                select_params=(self.realizations.start + 1,
+                               self.realizations.stop))
+        if self.ruptures is not None:
+            # keep the elements of the arrays referring to the ruptures
+            # of the chunk, in the same order
+            gmvs_field, ruptures_field = 'gmvs_chunk', 'rupture_ids_chunk'
+            bounds = (self.ruptures.start, self.ruptures.stop)
+            queryset = queryset.extra(
+                select=collections.OrderedDict(
+                    (field, RUPTURE_CHUNK % array) for field, array in [
+                        (gmvs_field, 'gmvs'),
+                        (ruptures_field, 'rupture_ids')]),
+                select_params=bounds * 2)
+        rows = queryset.values_list(
+            'site', gmvs_field, ruptures_field).order_by('site', 'id')
+        # NB: .iterator() only avoids filling the queryset cache; psycopg2
+        # still transfers the whole result set to the client, so the rows
+        # of the block are in memory at once (this is not a server-side
+        # cursor)
+        for site_id, site_gmvs, site_ruptures in rows.iterator():
+            if self.ruptures is not None and not site_ruptures:
+                continue
+            gmvs[site_id].extend(site_gmvs)
+            if site_ruptures:
+                ruptures[site_id].extend(site_ruptures)
+
+        site_data = {}
+        for site_id in site_ids:
+            if site_id not in gmvs:
+                if self.ruptures is None:
+                    logs.LOG.warn(
+                        'No gmvs for site %s, IMT=%s', site_id, self.imt)
+                continue
+            site_data[site_id] = (numpy.array(gmvs.pop(site_id)),
+                                  numpy.array(ruptures.pop(site_id, []),
+                                              dtype=int))
+        return site_data
 
     def get_data(self, hazard_output, monitor):
         """
@@ -284,43 +521,61 @@ GROUP BY site_id ORDER BY site_id;
         with the GMVs; for event based computations the data is
         a pair (GMVs, rupture_ids).
         """
-
-        all_ruptures = set()
         all_assets = []
         all_gmvs = []
-        site_gmv = collections.OrderedDict()
-        # dictionary site -> ({rupture_id: gmv}, n_assets)
-        # the ordering is there only to have repeatable runs
         with monitor.copy('associating assets->site'):
             site_assets = list(self.assets_gen(hazard_output))
 
         if hazard_output.output.output_type == 'ses':
-            logs.LOG.info('Compute Ground motion field values on the fly')
-            return self.compute_gmvs(hazard_output, site_assets, monitor)
+            if self.risk_calculation_id is None:
+                assert self.ruptures is None, (
+                    'The ground motion values computed on the fly cannot '
+                    'be read in chunks of ruptures')
+                logs.LOG.info('Compute Ground motion field values on the fly')
+                return self.compute_gmvs(hazard_output, site_assets, monitor)
+            # the ground motion values have been computed in the
+            # pre_execute phase of the risk calculation
+            queryset = models.GmfCache.objects.filter(
+                risk_calculation=self.risk_calculation_id,
+                hazard_output=hazard_output.output, imt=self.imt)
+        else:
+            queryset = models.GmfData.objects.filter(
+                gmf=hazard_output, imt=self.imt_type,
+                sa_period=self.sa_period, sa_damping=self.sa_damping)
 
         with monitor.copy('getting gmvs and ruptures'):
+            site_data = self.get_gmvs_ruptures(
+                queryset, [site_id for site_id, _ in site_assets])
+            event_based = any(len(ruptures)
+                              for _gmvs, ruptures in site_data.itervalues())
+
+        if not site_data:
+            return all_assets, (all_gmvs, [])
+
+        if not event_based:  # scenario
             for site_id, assets in site_assets:
-                n_assets = len(assets)
-                all_assets.extend(assets)
-                gmvs, ruptures = self.get_gmvs_ruptures(hazard_output, site_id)
-                if ruptures:  # event based
-                    site_gmv[site_id] = dict(zip(ruptures, gmvs)), n_assets
-                    for r in ruptures:
-                        all_ruptures.add(r)
-                elif gmvs:  # scenario
-                    array = numpy.array(gmvs)
-                    all_gmvs.extend([array] * n_assets)
-        if all_assets and not all_ruptures:  # scenario
+                if site_id in site_data:
+                    gmvs, _ruptures = site_data[site_id]
+                    all_assets.extend(assets)
+                    all_gmvs.extend([gmvs] * len(assets))
             return all_assets, all_gmvs
 
-        # second pass for event based, filling with zeros
+        # event based: build a dense matrix sites x ruptures, where the
+        # missing ground motion values are filled with zeros; the assets
+        # of the sites without ground motion values are discarded and
+        # reported as missing by get_assets_data
         with monitor.copy('filling gmvs with zeros'):
-            all_ruptures = sorted(all_ruptures)
-            for site_id, (gmv, n_assets) in site_gmv.iteritems():
-                array = numpy.array([gmv.get(r, 0.) for r in all_ruptures])
-                gmv.clear()  # save memory
-                all_gmvs.extend([array] * n_assets)
-        return all_assets, (all_gmvs, all_ruptures)
+            all_ruptures = numpy.unique(numpy.concatenate(
+                [ruptures for _gmvs, ruptures in site_data.itervalues()]))
+            site_assets = [(site_id, assets) for site_id, assets in site_assets
+                           if site_id in site_data]
+            matrix = numpy.zeros((len(site_assets), len(all_ruptures)))
+            for i, (site_id, assets) in enumerate(site_assets):
+                gmvs, ruptures = site_data.pop(site_id)
+                matrix[i, all_ruptures.searchsorted(ruptures)] = gmvs
+                all_assets.extend(assets)
+                all_gmvs.extend([matrix[i]] * len(assets))
+        return all_assets, (all_gmvs, all_ruptures.tolist())
 
     def compute_gmvs(self, hazard_output, site_assets, monitor):
         """
@@ -373,7 +628,7 @@ GROUP BY site_id ORDER BY site_id;
 
         calc_getter = GroundMotionValuesCalcGetter(
             self.imt, hc.site_collection, site_assets,
-            truncation_level, gsims, model)
+            truncation_level, gsims, model, hc.id)
 
         with monitor.copy('computing gmvs'):
             all_assets, gmvs = calc_getter.compute(
@@ -382,14 +637,223 @@ GROUP BY site_id ORDER BY site_id;
         return all_assets, (gmvs, r_ids)
 
 
+class SharedHazardGetter(object):
+    """
+    Wraps a hazard getter working on the assets of several calculation
+    units and caches the hazard data, so that it is read only once per
+    task. The units get the data through :class:`HazardGetterView`
+    objects; when all of the views have been consumed the cache is
+    cleared, to save memory.
+
+    :attr getter:
+        a :class:`HazardGetter` instance working on all the assets
+    """
+    def __init__(self, getter):
+        self.getter = getter
+        self.views = 0
+        self.released = 0
+        self._cache = None
+        self._selection = None
+
+    def view(self, assets):
+        """
+        :returns: a :class:`HazardGetterView` on the given `assets`
+        """
+        self.views += 1
+        return HazardGetterView(self, assets)
+
+    def get(self, monitor=None, realizations=None, ruptures=None):
+        """
+        :param realizations:
+            if given, a slice of the scenario ground motion fields
+        :param ruptures:
+            if given, a slice of rupture ids, see
+            :meth:`GroundMotionValuesGetter.select_ruptures`
+        :returns: a list of triples (hazard_output_id, assets, data);
+            only the data of the last requested slice is cached
+        """
+        selection = (realizations, ruptures)
+        if self._cache is None or self._selection != selection:
+            getter = self.getter
+            if realizations is not None:
+                getter = getter.slice(realizations)
+            if ruptures is not None:
+                getter = getter.select_ruptures(ruptures)
+            self._cache = list(getter(monitor))
+            self._selection = selection
+        return self._cache
+
+    def release(self):
+        """
+        Called by a view when it does not need the data anymore
+        """
+        self.released += 1
+        if self.released == self.views:
+            self._cache = None
+
+
+class HazardGetterView(object):
+    """
+    A getter returning the hazard data of a subset of the assets of a
+    :class:`SharedHazardGetter`. It has the same interface of a
+    :class:`HazardGetter`.
+    """
+    def __init__(self, shared, assets, realizations=None, ruptures=None):
+        self.shared = shared
+        self.assets = assets
+        self.asset_ids = set(asset.id for asset in assets)
+        self.realizations = realizations
+        self.ruptures = ruptures
+        # the views on a slice of the realizations or of the ruptures do
+        # not release the cache, which is replaced when another slice is
+        # requested
+        self._released = realizations is not None or ruptures is not None
+
+    def __repr__(self):
+        return "<%s %s assets=%s>" % (
+            self.__class__.__name__, self.shared.getter.__class__.__name__,
+            [a.id for a in self.assets])
+
+    def slice(self, realizations):
+        """
+        :returns:
+            a view on the given slice of the scenario ground motion
+            fields, see :meth:`GroundMotionValuesGetter.slice`
+        """
+        return self.__class__(self.shared, self.assets, realizations)
+
+    def select_ruptures(self, ruptures):
+        """
+        :returns:
+            a view on the ground motion values of the given slice of
+            rupture ids, see :meth:`GroundMotionValuesGetter.select_ruptures`
+        """
+        return self.__class__(self.shared, self.assets, ruptures=ruptures)
+
+    def __call__(self, monitor=None):
+        try:
+            for hid, assets, data in self.shared.get(
+                    monitor, self.realizations, self.ruptures):
+                indices = [i for i, asset in enumerate(assets)
+                           if asset.id in self.asset_ids]
+                yield (hid, [assets[i] for i in indices],
+                       self.shared.getter.filter_data(data, indices))
+        finally:
+            if not self._released:
+                self._released = True
+                self.shared.release()
+
+    def asset_sites(self):
+        """
+        See :meth:`GroundMotionValuesGetter.asset_sites`
+        """
+        return self.shared.getter.asset_sites()
+
+    def weights(self):
+        return self.shared.getter.weights()
+
+
+class ChunkGetter(object):
+    """
+    A getter returning the hazard data of a chunk (of realizations or
+    of ruptures) already read by another getter. It has the same
+    interface of a :class:`HazardGetter`.
+
+    :param getter: the getter which read the data
+    :param data: a list of triples (hazard_output_id, assets, data)
+    :param rng_state:
+        if not None, the state of the numpy random number generator to
+        restore before returning the data
+    """
+    def __init__(self, getter, data, rng_state):
+        self.getter = getter
+        self.assets = getter.assets
+        self.data = data
+        self.rng_state = rng_state
+
+    def __call__(self, monitor=None):
+        if self.rng_state is not None:
+            numpy.random.set_state(self.rng_state)
+        return iter(self.data)
+
+    def weights(self):
+        return self.getter.weights()
+
+
+def share_getters(getters):
+    """
+    Group the given hazard getters by (class, IMT, hazard outputs) and
+    replace the getters of each group with views on a single
+    :class:`SharedHazardGetter` working on all the assets of the group.
+    The getters wrapped by a :class:`BCRGetter` are shared as well.
+    Other getters are returned unchanged.
+
+    :returns: a list of getters, in the same order of `getters`
+    """
+    # the getters actually reading the hazard, as a list of lists
+    leaves = [[getter.getter_orig, getter.getter_retro]
+              if isinstance(getter, BCRGetter) else [getter]
+              for getter in getters]
+
+    groups = collections.OrderedDict()
+    for i, getter_leaves in enumerate(leaves):
+        for j, getter in enumerate(getter_leaves):
+            if isinstance(getter, HazardGetter):
+                key = (getter.__class__, getter.imt,
+                       tuple(h.id for h in getter.hazard_outputs))
+                groups.setdefault(key, []).append((i, j))
+
+    shared_leaves = [list(getter_leaves) for getter_leaves in leaves]
+    for indices in groups.itervalues():
+        if len(indices) == 1:
+            continue
+        group = [leaves[i][j] for i, j in indices]
+        assets = []
+        asset_ids = set()
+        for getter in group:
+            for asset in getter.assets:
+                if asset.id not in asset_ids:
+                    asset_ids.add(asset.id)
+                    assets.append(asset)
+        if len(assets) == len(group[0].assets):
+            # e.g. getters of different loss types on the same assets
+            shared = SharedHazardGetter(group[0])
+        else:
+            shared = SharedHazardGetter(group[0].clone(assets))
+        for (i, j), getter in zip(indices, group):
+            shared_leaves[i][j] = shared.view(getter.assets)
+
+    return [BCRGetter(*getter_leaves)
+            if isinstance(getter, BCRGetter) else getter_leaves[0]
+            for getter, getter_leaves in zip(getters, shared_leaves)]
+
+
 class BCRGetter(object):
-    def __init__(self, getter_orig, getter_retro):
+    """
+    Hazard getter for the BCR calculators, yielding for each hazard
+    output the hazard data for the original and for the retrofitted
+    vulnerability model.
+
+    :param getter_orig:
+        the getter for the IMT of the original vulnerability model
+    :param getter_retro:
+        the getter for the IMT of the retrofitted vulnerability model,
+        or None if the two models use the same IMT. In that case the
+        hazard is fetched (or computed) only once per hazard output
+        and the same arrays are used for both models.
+    """
+    def __init__(self, getter_orig, getter_retro=None):
         self.assets = getter_orig.assets
         self.getter_orig = getter_orig
         self.getter_retro = getter_retro
 
     def __call__(self, monitor):
         orig_gen = self.getter_orig(monitor)
+        if self.getter_retro is None:
+            for hid, assets, data in orig_gen:
+                yield hid, assets, (data, data)
+            return
+
         retro_gen = self.getter_retro(monitor)
 
         try:
@@ -407,8 +871,15 @@ class GroundMotionValuesCalcGetter(object):
     based calculation, given a set of ruptures computed by an hazard
     calculation
     """
+    # (hazard_calculation_id, imt) -> correlation matrix; the lower
+    # triangle correlation matrix of the whole site collection is computed
+    # only once per hazard calculation and process. Only the matrices of
+    # the last hazard calculation are kept, to bound the memory
+    correlation_cache = {}
+
     def __init__(self, imt, site_collection, sites_assets,
-                 truncation_level, gsims, correlation_model):
+                 truncation_level, gsims, correlation_model,
+                 hazard_calculation_id=None):
         """
         :param str imt:
             the intensity measure type considered
@@ -432,10 +903,14 @@ class GroundMotionValuesCalcGetter(object):
             :mod:`openquake.hazardlib.correlation`. Can be ``None``, in which
             case non-correlated ground motion fields are calculated.
             Correlation model is not used if ``truncation_level`` is zero.
+        :param int hazard_calculation_id:
+            the id of the hazard calculation owning `site_collection`;
+            if given, the correlation matrix is cached
         """
 
         self.imt = from_string(imt)
         self.site_collection = site_collection
+        self.hazard_calculation_id = hazard_calculation_id
         self.sites_assets = sites_assets
         self.truncation_level = truncation_level
         self.sites = models.SiteCollection(
@@ -446,6 +921,11 @@ class GroundMotionValuesCalcGetter(object):
         self.sites_dict = dict((all_site_id, i)
                                for i, all_site_id in enumerate(all_site_ids))
 
+        # indices of the sites of interest in the whole site collection
+        # and the inverse mapping index -> row in the correlation matrix
+        indices = [self.sites_dict[s.id] for s in self.sites]
+        self.rows = dict((index, row) for row, index in enumerate(indices))
+
         self.generate_epsilons = truncation_level != 0
         self.correlation_matrix = None
         if self.generate_epsilons:
@@ -456,12 +936,35 @@ class GroundMotionValuesCalcGetter(object):
                     -truncation_level, truncation_level)
 
             if correlation_model is not None:
-                c = correlation_model.get_lower_triangle_correlation_matrix(
-                    site_collection, self.imt)
-                self.correlation_matrix = c
+                # only the rows of the sites of interest are needed
+                c = self.get_correlation_matrix(imt, correlation_model)
+                self.correlation_matrix = c[indices]
 
         self.gsims = gsims
 
+    def get_correlation_matrix(self, imt, correlation_model):
+        """
+        :returns:
+            the lower triangle correlation matrix of the whole site
+            collection for the given `imt`, as a numpy array. If the
+            hazard calculation id is known, it is computed once and then
+            read from `correlation_cache`.
+        """
+        if self.hazard_calculation_id is None:
+            return numpy.asarray(
+                correlation_model.get_lower_triangle_correlation_matrix(
+                    self.site_collection, self.imt))
+        key = (self.hazard_calculation_id, imt)
+        if key not in self.correlation_cache:
+            # discard the matrices of the other hazard calculations
+            for other_key in self.correlation_cache.keys():
+                if other_key[0] != self.hazard_calculation_id:
+                    del self.correlation_cache[other_key]
+            self.correlation_cache[key] = numpy.asarray(
+                correlation_model.get_lower_triangle_correlation_matrix(
+                    self.site_collection, self.imt))
+        return self.correlation_cache[key]
+
     def sites_of_interest(self, rupture, maximum_distance):
         """
         :param openquake.hazardlib.source.rupture.Rupture rupture:
@@ -508,23 +1011,48 @@ class GroundMotionValuesCalcGetter(object):
         """
         if not self.generate_epsilons:
             return None, None, None
+        [epsilons] = self.epsilons_batch(
+            [rupture_seed], [mask], [total_residual])
+        return epsilons
 
-        # we seet the rupture_seed such that in every task we
-        # always get the same numbers for a given rupture
-        numpy.random.seed(rupture_seed)
+    def epsilons_batch(self, rupture_seeds, masks, total_residuals):
+        """
+        Vectorized version of :meth:`epsilons` working on R ruptures at
+        once: the random variates are drawn rupture by rupture (so that
+        the numbers depend only on the rupture seed), whereas the
+        correlation is applied with a single matrix product.
 
-        if total_residual:
-            total_residual_epsilons = self.distribution.rvs(
-                size=len(self.site_collection))[mask]
-            return total_residual_epsilons, None, None
-        else:
-            inter_residual_epsilons = self.distribution.rvs(size=1)
-            all_intra = self.distribution.rvs(size=len(self.site_collection))
-            if self.correlation_matrix is not None:
-                all_intra = numpy.array(
-                    numpy.dot(self.correlation_matrix, all_intra))[0]
-            intra_residual_epsilons = all_intra[mask]
-            return None, inter_residual_epsilons, intra_residual_epsilons
+        :returns: a list of R triples (total, inter, intra)
+        """
+        n_sites = len(self.site_collection)
+        inters = []
+        variates = numpy.zeros((len(rupture_seeds), n_sites))
+        for i, (rupture_seed, total_residual) in enumerate(
+                itertools.izip(rupture_seeds, total_residuals)):
+            # we seet the rupture_seed such that in every task we
+            # always get the same numbers for a given rupture
+            numpy.random.seed(rupture_seed)
+            if total_residual:
+                inters.append(None)
+            else:
+                inters.append(self.distribution.rvs(size=1))
+            variates[i] = self.distribution.rvs(size=n_sites)
+
+        if self.correlation_matrix is not None:
+            # R x sites of interest
+            correlated = numpy.dot(variates, self.correlation_matrix.T)
+
+        epsilons = []
+        for i, (mask, total_residual) in enumerate(
+                itertools.izip(masks, total_residuals)):
+            if total_residual:
+                epsilons.append((variates[i][mask], None, None))
+            elif self.correlation_matrix is not None:
+                rows = [self.rows[index] for index in mask]
+                epsilons.append((None, inters[i], correlated[i][rows]))
+            else:
+                epsilons.append((None, inters[i], variates[i][mask]))
+        return epsilons
 
     def gsim(self, rupture):
         """
@@ -561,40 +1089,8 @@ class GroundMotionValuesCalcGetter(object):
         all_gmvs = []
         all_assets = []
 
-        site_gmv = collections.defaultdict(dict)
-        performance_dict = collections.Counter()
-
-        for rupture, rupture_seed, rupture_id in itertools.izip(
-                ruptures, rupture_seeds, rupture_ids):
-
-            gsim, tstddev = self.gsim(rupture)
-
-            with LightMonitor(performance_dict, 'filtering sites'):
-                sites_of_interest, mask = self.sites_of_interest(
-                    rupture, maximum_distance)
-
-            if not sites_of_interest:
-                continue
-
-            with LightMonitor(performance_dict, 'generating epsilons'):
-                (total, inter, intra) = self.epsilons(
-                    rupture_seed, mask, tstddev)
-
-            with LightMonitor(
-                    performance_dict, 'compute ground motion fields'):
-                gmf = ground_motion_field_with_residuals(
-                    rupture, sites_of_interest,
-                    self.imt, gsim, self.truncation_level,
-                    total_residual_epsilons=total,
-                    intra_residual_epsilons=intra,
-                    inter_residual_epsilons=inter)
-
-            with LightMonitor(performance_dict, 'collecting gmvs'):
-                for site, gmv in itertools.izip(sites_of_interest, gmf):
-                    site_gmv[site.id][rupture_id] = gmv
-
-        logs.LOG.debug('Disaggregation of the time spent in the loop %s' % (
-            performance_dict))
+        site_gmv = self.compute_site_gmvs(
+            ruptures, rupture_seeds, rupture_ids, maximum_distance)
 
         for site_id, assets in self.sites_assets:
             n_assets = len(assets)
@@ -602,9 +1098,72 @@ class GroundMotionValuesCalcGetter(object):
                 gmvs = [site_gmv[site_id].get(r, 0) for r in rupture_ids]
             else:
                 gmvs = numpy.zeros(len(rupture_ids))
-            del site_gmv[site_id]
+            site_gmv.pop(site_id, None)
 
             all_gmvs.extend([gmvs] * n_assets)
             all_assets.extend(assets)
 
         return all_assets, all_gmvs
+
+    def compute_site_gmvs(self, ruptures, rupture_seeds, rupture_ids,
+                          maximum_distance):
+        """
+        Compute ground motion values radiated from `ruptures` on the
+        sites of interest. See :meth:`compute` for a description of the
+        parameters.
+
+        :returns:
+            a dictionary site_id -> {rupture_id: gmv}, containing only
+            the ruptures within the `maximum_distance` from the site
+        """
+        site_gmv = collections.defaultdict(dict)
+        performance_dict = collections.Counter()
+
+        # the ruptures are processed in blocks, to generate the epsilons
+        # in a vectorized way without using too much memory
+        block_size = max(1, EPSILONS_BLOCK_SIZE // len(self.site_collection))
+        for block in block_splitter(itertools.izip(
+                ruptures, rupture_seeds, rupture_ids), block_size):
+
+            data = []
+            for rupture, rupture_seed, rupture_id in block:
+                gsim, tstddev = self.gsim(rupture)
+
+                with LightMonitor(performance_dict, 'filtering sites'):
+                    sites_of_interest, mask = self.sites_of_interest(
+                        rupture, maximum_distance)
+
+                if sites_of_interest:
+                    data.append((rupture, rupture_seed, rupture_id,
+                                 gsim, tstddev, sites_of_interest, mask))
+
+            if not data:
+                continue
+
+            with LightMonitor(performance_dict, 'generating epsilons'):
+                if self.generate_epsilons:
+                    epsilons = self.epsilons_batch(
+                        [d[1] for d in data], [d[6] for d in data],
+                        [d[4] for d in data])
+                else:
+                    epsilons = [(None, None, None)] * len(data)
+
+            for (rupture, _seed, rupture_id, gsim, _tstddev,
+                 sites_of_interest, _mask), (total, inter, intra) in \
+                    itertools.izip(data, epsilons):
+                with LightMonitor(
+                        performance_dict, 'compute ground motion fields'):
+                    gmf = ground_motion_field_with_residuals(
+                        rupture, sites_of_interest,
+                        self.imt, gsim, self.truncation_level,
+                        total_residual_epsilons=total,
+                        intra_residual_epsilons=intra,
+                        inter_residual_epsilons=inter)
+
+                with LightMonitor(performance_dict, 'collecting gmvs'):
+                    for site, gmv in itertools.izip(sites_of_interest, gmf):
+                        site_gmv[site.id][rupture_id] = gmv
+
+        logs.LOG.debug('Disaggregation of the time spent in the loop %s' % (
+            performance_dict))
+        return site_gmv
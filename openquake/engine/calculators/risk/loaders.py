@@ -25,19 +25,30 @@ import collections
 from openquake.risklib import scientific
 
 from openquake.nrmllib.risk import parsers
-from openquake.engine.input.exposure import ExposureDBWriter
-from openquake.engine.db.models import RiskModel, DmgState
+from openquake.engine import logs
+from openquake.engine.input.exposure import (
+    ExposureDBWriter, exposure_parser, checksum)
+from openquake.engine.db.models import (
+    RiskModel, DmgState, ExposureModel)
 
 
 def exposure(job, exposure_model_input):
     """
-    Load exposure assets and write them to database.
+    Load exposure assets and write them to database. If an exposure
+    model has already been stored from a file with the same content
+    (i.e. with the same checksum) it is returned instead.
 
     :param exposure_model_input:
-        the pathname to an exposure file
+        the pathname to an exposure file, in NRML or CSV format
     """
-    return ExposureDBWriter(job).serialize(
-        parsers.ExposureModelParser(exposure_model_input))
+    digest = checksum(exposure_model_input)
+    for stored in ExposureModel.objects.filter(
+            checksum=digest).order_by('-id')[:1]:
+        logs.LOG.info('Reusing the exposure model %d stored by job %d',
+                      stored.id, stored.job_id)
+        return stored
+    return ExposureDBWriter(job, digest).serialize(
+        exposure_parser(exposure_model_input))
 
 
 def vulnerability(vulnerability_file):
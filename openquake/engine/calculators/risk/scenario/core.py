@@ -17,12 +17,15 @@
 """
 Core functionality for the scenario risk calculator.
 """
+import copy
 import random
 import itertools
+import collections
 import numpy
 from django import db
 
 from openquake.risklib import workflows
+from openquake.engine.calculators import post_processing
 from openquake.engine.calculators.risk import (
     base, hazard_getters, validation, writers)
 from openquake.engine.db import models
@@ -31,7 +34,7 @@ from openquake.engine.utils import tasks
 
 
 @tasks.oqtask
-def scenario(job_id, units, containers, _params):
+def scenario(job_id, units, containers, params):
     """
     Celery task for the scenario risk calculator.
 
@@ -45,51 +48,163 @@ def scenario(job_id, units, containers, _params):
     :param params:
       An instance of :class:`..base.CalcParams` used to compute
       derived outputs
+    :returns:
+      three dictionaries with the aggregate losses, the insured
+      aggregate losses (keyed by loss type) and the aggregate losses of
+      the groups of assets (keyed by (loss type, group)), as arrays
+      with one value for each ground motion field
     """
     monitor = EnginePerformanceMonitor(None, job_id, scenario, tracing=True)
 
-    agg = dict()
-    insured = dict()
     with db.transaction.commit_on_success(using='job_init'):
-        for unit in units:
-            agg[unit.loss_type], insured[unit.loss_type] = do_scenario(
-                unit,
-                containers.with_args(
-                    loss_type=unit.loss_type,
-                    output_type="loss_map"),
-                monitor.copy)
-    return agg, insured
+        return do_scenario(units, containers, params, monitor.copy)
+
+
+def _sum(total, losses):
+    """
+    Sum two arrays of losses, any of which can be None
+    """
+    if total is None:
+        return losses
+    elif losses is None:
+        return total
+    return total + losses
 
 
-def do_scenario(unit, containers, profile):
+class ScenarioLosses(object):
     """
-    See `scenario` for a description of the input parameters
+    Accumulate the losses of a calculation unit, chunk of realizations
+    by chunk of realizations: the means and the standard deviations of
+    the losses of each asset are updated incrementally, whereas the
+    aggregate losses (one value per realization) are concatenated.
+
+    The random numbers are sampled as if there were a single chunk: the
+    workflow is seeded only for the first chunk and the generator
+    continues from its state at the end of the previous chunk of the
+    unit, so that the results do not depend on `gmf_block_size`.
+
+    :param unit:
+        a :class:`openquake.risklib.workflows.CalculationUnit`, whose
+        getter supports the method `slice`
     """
+    def __init__(self, unit):
+        self.unit = unit
+        self.hid = None
+        self.assets = []
+        self.loss_stats = post_processing.MeanStd(axis=1)
+        self.insured_stats = post_processing.MeanStd(axis=1)
+        self.aggregate_losses = []
+        self.insured_losses = []
+        self.group_losses = collections.defaultdict(list)
+        self.workflow = unit.workflow
+        self.rng_state = None
 
-    ((hid, outputs),), _stats = unit(profile('getting data'),
-                                     profile('computing risk'))
+    def update(self, realizations, params, profile):
+        """
+        Compute the losses of the given chunk of realizations.
 
-    (assets, loss_ratio_matrix, aggregate_losses,
-     insured_loss_matrix, insured_losses) = outputs
+        :returns: the number of realizations in the chunk
+        """
+        data = list(self.unit.getter.slice(realizations)(
+            profile('getting data')))
+        [(hid, assets, ground_motion_values)] = data
+        if not len(assets) or not len(ground_motion_values[0]):
+            return 0
 
-    with profile('saving risk outputs'):
-        containers.write(
-            assets,
-            loss_ratio_matrix.mean(axis=1),
-            loss_ratio_matrix.std(ddof=1, axis=1),
-            hazard_output_id=hid,
-            insured=False)
+        chunk_unit = workflows.CalculationUnit(
+            self.unit.loss_type, self.workflow,
+            hazard_getters.ChunkGetter(
+                self.unit.getter, data, self.rng_state))
+        ((_hid, outputs),), _stats = chunk_unit(
+            profile('getting data'), profile('computing risk'))
+        self.rng_state = numpy.random.get_state()
+        if self.workflow is self.unit.workflow:
+            # the following chunks continue the sequence of random numbers
+            self.workflow = copy.copy(self.unit.workflow)
+            self.workflow.seed = None
 
+        (_assets, loss_ratio_matrix, aggregate_losses,
+         insured_loss_matrix, insured_losses) = outputs
+        self.hid, self.assets = hid, assets
+        self.loss_stats.update(loss_ratio_matrix)
+        self.aggregate_losses.append(aggregate_losses)
         if insured_loss_matrix is not None:
+            self.insured_stats.update(insured_loss_matrix)
+            self.insured_losses.append(insured_losses)
+
+        if params.asset_groups is not None:
+            with profile('aggregating losses by group'):
+                for group, losses in params.asset_groups.sum_by_group(
+                        assets, self.unit.loss_type,
+                        loss_ratio_matrix).iteritems():
+                    self.group_losses[group].append(losses)
+        return len(ground_motion_values[0])
+
+    def save(self, containers, profile):
+        """
+        Save the loss maps of the assets.
+
+        :returns:
+            the aggregate losses, the insured aggregate losses and a
+            dictionary group -> aggregate losses, as arrays with one
+            value for each realization
+        """
+        if not self.assets:
+            return None, None, {}
+
+        with profile('saving risk outputs'):
+            means, stddevs = self.loss_stats.get()
             containers.write(
-                assets,
-                insured_loss_matrix.mean(axis=1),
-                insured_loss_matrix.std(ddof=1, axis=1),
-                itertools.cycle([True]),
-                hazard_output_id=hid,
-                insured=True)
+                self.assets, means, stddevs,
+                hazard_output_id=self.hid, insured=False)
+
+            if self.insured_losses:
+                means, stddevs = self.insured_stats.get()
+                containers.write(
+                    self.assets, means, stddevs,
+                    itertools.cycle([True]),
+                    hazard_output_id=self.hid,
+                    insured=True)
 
-    return aggregate_losses, insured_losses
+        return (numpy.concatenate(self.aggregate_losses),
+                numpy.concatenate(self.insured_losses)
+                if self.insured_losses else None,
+                dict((group, numpy.concatenate(losses))
+                     for group, losses in self.group_losses.iteritems()))
+
+
+def do_scenario(units, containers, params, profile):
+    """
+    See `scenario` for a description of the input parameters.
+
+    The ground motion fields are read and processed in chunks (see
+    :func:`..base.realization_slices`), one chunk at the time for all
+    the units, so that the memory does not depend on the number of
+    ground motion fields and the hazard shared by several units is read
+    once per chunk. The losses are accumulated by :class:`ScenarioLosses`.
+    """
+    unit_losses = [ScenarioLosses(unit) for unit in units]
+    for realizations in base.realization_slices():
+        num_realizations = [losses.update(realizations, params, profile)
+                            for losses in unit_losses]
+        if base.is_last_chunk(realizations, max(num_realizations or [0])):
+            break
+
+    agg = dict()
+    insured = dict()
+    groups = dict()
+    for losses in unit_losses:
+        loss_type = losses.unit.loss_type
+        unit_agg, unit_insured, unit_groups = losses.save(
+            containers.with_args(loss_type=loss_type,
+                                 output_type="loss_map"), profile)
+        # there can be several units per loss type (one per taxonomy)
+        agg[loss_type] = _sum(agg.get(loss_type), unit_agg)
+        insured[loss_type] = _sum(insured.get(loss_type), unit_insured)
+        for group, group_losses in unit_groups.iteritems():
+            key = (loss_type, group)
+            groups[key] = _sum(groups.get(key), group_losses)
+    return agg, insured, groups
 
 
 class ScenarioRiskCalculator(base.RiskCalculator):
@@ -107,16 +222,21 @@ class ScenarioRiskCalculator(base.RiskCalculator):
 
     output_builders = [writers.LossMapBuilder]
 
+    associate_assets_to_sites = True
+
     def __init__(self, job):
         super(ScenarioRiskCalculator, self).__init__(job)
         self.aggregate_losses = dict()
         self.insured_losses = dict()
+        # (loss type, group) -> aggregate losses
+        self.group_losses = dict()
         self.rnd = random.Random()
         self.rnd.seed(self.rc.master_seed)
 
     def task_completed(self, task_result):
         self.log_percent(task_result)
-        aggregate_losses_dict, insured_losses_dict = task_result
+        aggregate_losses_dict, insured_losses_dict, group_losses_dict = (
+            task_result)
 
         for loss_type in models.loss_types(self.risk_models):
             aggregate_losses = aggregate_losses_dict.get(loss_type)
@@ -137,6 +257,10 @@ class ScenarioRiskCalculator(base.RiskCalculator):
                             insured_losses.shape)
                     self.insured_losses[loss_type] += insured_losses
 
+        for key, group_losses in group_losses_dict.iteritems():
+            self.group_losses[key] = _sum(
+                self.group_losses.get(key), group_losses)
+
     def post_process(self):
         for loss_type, aggregate_losses in self.aggregate_losses.items():
             with db.transaction.commit_on_success(using='job_init'):
@@ -161,6 +285,27 @@ class ScenarioRiskCalculator(base.RiskCalculator):
                         mean=numpy.mean(insured_losses),
                         std_dev=numpy.std(insured_losses, ddof=1))
 
+        with db.transaction.commit_on_success(using='job_init'):
+            for (loss_type, group), group_losses in sorted(
+                    self.group_losses.items()):
+                models.AggregateLoss.objects.create(
+                    output=models.Output.objects.create_output(
+                        self.job,
+                        "aggregate loss. type=%s %s=%s" % (
+                            loss_type, self.rc.aggregate_by, group),
+                        "aggregate_loss"),
+                    loss_type=loss_type,
+                    aggregation_group=group,
+                    mean=numpy.mean(group_losses),
+                    std_dev=numpy.std(group_losses, ddof=1))
+
+    @property
+    def calculator_parameters(self):
+        """
+        Calculator specific parameters
+        """
+        return base.make_calc_params(asset_groups=self.get_asset_groups())
+
     def calculation_unit(self, loss_type, assets):
         """
         :returns:
@@ -183,4 +328,5 @@ class ScenarioRiskCalculator(base.RiskCalculator):
                 self.rc.hazard_outputs(),
                 assets,
                 self.rc.best_maximum_distance,
-                model.imt))
+                model.imt,
+                risk_calculation_id=self.rc.id))
@@ -26,8 +26,9 @@ from django import db
 
 from openquake.risklib import workflows, calculators
 
+from openquake.engine.calculators import post_processing
 from openquake.engine.calculators.risk import (
-    base, hazard_getters, writers, validation, loaders)
+    base, hazard_getters, writers, validation, loaders, workflow_cache)
 from openquake.engine.performance import EnginePerformanceMonitor
 from openquake.engine.utils import tasks
 from openquake.engine.db import models
@@ -49,46 +50,127 @@ def scenario_damage(job_id, units, containers, params):
       An instance of :class:`..base.CalcParams` used to compute
       derived outputs
    :returns:
-      A matrix of fractions and a taxonomy string
+      A dictionary taxonomy -> matrix of fractions
     """
     monitor = EnginePerformanceMonitor(
         None, job_id, scenario_damage, tracing=True)
 
-    # in scenario damage calculation we have only ONE calculation unit
-    [unit] = units
-
-    # and NO containes
+    # in scenario damage calculation we have ONE calculation unit per
+    # taxonomy and NO containers
     assert len(containers) == 0
 
     with db.transaction.commit_on_success(using='job_init'):
-        return do_scenario_damage(unit, params, monitor.copy)
+        with workflow_cache.caching(job_id, units):
+            return do_scenario_damage(units, params, monitor.copy)
+
+
+class ScenarioDamage(object):
+    """
+    Accumulate the damage of the assets of a calculation unit, chunk of
+    realizations by chunk of realizations: the means and the standard
+    deviations of the damage of each asset are updated incrementally,
+    whereas the aggregate damage fractions (one matrix per realization)
+    are concatenated.
+
+    :param unit:
+        a :class:`openquake.risklib.workflows.CalculationUnit`, whose
+        getter supports the methods `slice` and `asset_sites`
+    """
+    def __init__(self, unit):
+        self.unit = unit
+        self.assets = []
+        self.asset_sites = None
+        self.stats = post_processing.MeanStd(axis=1)
+        self.aggfractions = []
+
+    def update(self, realizations, profile):
+        """
+        Compute the damage of the given chunk of realizations.
+
+        :returns: the number of realizations in the chunk
+        """
+        with profile('getting hazard'):
+            _hid, assets, ground_motion_values = self.unit.getter.slice(
+                realizations)().next()
+
+        if not len(assets):
+            return 0
+
+        elif not len(ground_motion_values):
+            # NB: (MS) this should not happen, but I saw it happens;
+            # should it happen again, to debug this situation you should
+            # run the query in GroundMotionValuesGetter.assets_gen and see
+            # how it is possible that sites without gmvs are returned
+            raise RuntimeError("No GMVs for assets %s" % assets)
+
+        num_realizations = len(ground_motion_values[0])
+        if not num_realizations:
+            return 0
+
+        # the assets of a unit have the same taxonomy, so the damage
+        # fractions are computed once per hazard site and broadcast to
+        # the assets of the site; the association asset -> site does
+        # not depend on the chunk and it is read only once
+        if self.asset_sites is None:
+            with profile('associating assets->site'):
+                self.asset_sites = self.unit.getter.asset_sites()
+        site_gmvs, site_indices = hazard_getters.unique_data(
+            ground_motion_values,
+            [self.asset_sites[asset.id] for asset in assets])
+        number_of_units = numpy.array(
+            [asset.number_of_units for asset in assets]).reshape(
+            len(assets), 1, 1)
+        with profile('computing risk'):
+            site_fractions = numpy.array(self.unit.workflow(site_gmvs))
+            fraction_matrix = site_fractions[site_indices] * number_of_units
+            self.stats.update(fraction_matrix)
+            self.aggfractions.append(fraction_matrix.sum(axis=0))
+        self.assets = assets
+        return num_realizations
+
+    def save(self, params, profile):
+        """
+        Save the damage distribution of the assets.
 
+        :returns: the aggregate damage fractions, or None
+        """
+        if not self.assets:
+            logs.LOG.warn("No asset could be processed")
+            return None
 
-def do_scenario_damage(unit, params, profile):
-    with profile('getting hazard'):
-        _hid, assets, ground_motion_values = unit.getter().next()
+        with profile('saving damage per assets'):
+            means, stddevs = self.stats.get()
+            writers.damage_distribution(
+                self.assets, means, stddevs, params.damage_state_ids)
 
-    if not len(assets):
-        logs.LOG.warn("Exit from task as no asset could be processed")
-        return None, None
+        return numpy.concatenate(self.aggfractions)
 
-    elif not len(ground_motion_values):
-        # NB: (MS) this should not happen, but I saw it happens;
-        # should it happen again, to debug this situation you should run
-        # the query in GroundMotionValuesGetter.assets_gen and see
-        # how it is possible that sites without gmvs are returned
-        raise RuntimeError("No GMVs for assets %s" % assets)
 
-    with profile('computing risk'):
-        fraction_matrix = unit.workflow(ground_motion_values)
-        aggfractions = sum(fraction_matrix[i] * asset.number_of_units
-                           for i, asset in enumerate(assets))
+def do_scenario_damage(units, params, profile):
+    """
+    See `scenario_damage` for a description of the input parameters.
 
-    with profile('saving damage per assets'):
-        writers.damage_distribution(
-            assets, fraction_matrix, params.damage_state_ids)
+    The ground motion fields are read and processed in chunks (see
+    :func:`..base.realization_slices`), one chunk at the time for all
+    the units, so that the memory does not depend on the number of
+    ground motion fields and the hazard shared by several units is read
+    once per chunk.
 
-    return aggfractions, assets[0].taxonomy
+    :returns: a dictionary taxonomy -> aggregate damage fractions
+    """
+    unit_damages = [ScenarioDamage(unit) for unit in units]
+    for realizations in base.realization_slices():
+        num_realizations = [damage.update(realizations, profile)
+                            for damage in unit_damages]
+        if base.is_last_chunk(realizations, max(num_realizations or [0])):
+            break
+
+    fractions = {}
+    for damage in unit_damages:
+        aggfractions = damage.save(params, profile)
+        if aggfractions is not None:
+            fractions[damage.assets[0].taxonomy] = aggfractions
+    return fractions
 
 
 class ScenarioDamageRiskCalculator(base.RiskCalculator):
@@ -113,6 +195,8 @@ class ScenarioDamageRiskCalculator(base.RiskCalculator):
     # FIXME. scenario damage calculator does not use output builders
     output_builders = []
 
+    associate_assets_to_sites = True
+
     def __init__(self, job):
         super(ScenarioDamageRiskCalculator, self).__init__(job)
         # let's define a dictionary taxonomy -> fractions
@@ -139,7 +223,8 @@ class ScenarioDamageRiskCalculator(base.RiskCalculator):
                 self.rc.hazard_outputs(),
                 assets,
                 self.rc.best_maximum_distance,
-                model.imt))
+                model.imt,
+                risk_calculation_id=self.rc.id))
         return ret
 
     def task_completed(self, task_result):
@@ -149,12 +234,11 @@ class ScenarioDamageRiskCalculator(base.RiskCalculator):
         taxonomy. Fractions and taxonomy are extracted from task_result
 
         :param task_result:
-            A pair (fractions, taxonomy)
+            A dictionary taxonomy -> fractions
         """
         self.log_percent(task_result)
-        fractions, taxonomy = task_result
 
-        if fractions is not None:
+        for taxonomy, fractions in task_result.iteritems():
             if taxonomy not in self.ddpt:
                 self.ddpt[taxonomy] = numpy.zeros(fractions.shape)
             self.ddpt[taxonomy] += fractions
@@ -0,0 +1,146 @@
+# Copyright (c) 2010-2013, GEM Foundation.
+#
+# OpenQuake is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# OpenQuake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with OpenQuake.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+A per-process cache of the workflows of the risk calculation units.
+
+The workflows of the classical and scenario damage calculators depend
+only on the job, the taxonomy and the loss type, but they are sent to
+the workers with every task, so the quantities they compute lazily
+(e.g. the loss ratio exceedance matrices of the vulnerability functions
+or the PoEs of the fragility functions) would be computed again in each
+task. By replacing the workflow of a unit with the one cached by a
+previous task of the same job, the worker reuses them.
+"""
+
+import contextlib
+import collections
+import cPickle as pickle
+
+from openquake.engine.utils import config
+
+
+def sizeof(obj):
+    """
+    :returns: the size in bytes of the pickled object, used as an
+              estimate of the memory it occupies
+    """
+    return len(pickle.dumps(obj, pickle.HIGHEST_PROTOCOL))
+
+
+class WorkflowCache(object):
+    """
+    A LRU cache of workflows keyed by (job_id, taxonomy, loss_type),
+    holding at most `max_size` bytes (no limit if `max_size` is 0).
+    """
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self._data = collections.OrderedDict()  # key -> (workflow, size)
+
+    def __len__(self):
+        return len(self._data)
+
+    @staticmethod
+    def key(job_id, unit):
+        """
+        :returns: the cache key of a calculation unit
+        """
+        return job_id, unit.getter.assets[0].taxonomy, unit.loss_type
+
+    def lookup(self, job_id, unit):
+        """
+        Replace the workflow of `unit` with the cached one, if any.
+
+        :returns: True if the workflow was in the cache, False otherwise
+        """
+        key = self.key(job_id, unit)
+        cached = self._data.pop(key, None)
+        if cached is None:
+            return False
+        self._data[key] = cached  # move to the most recently used place
+        unit.workflow = cached[0]
+        return True
+
+    def store(self, job_id, unit):
+        """
+        Cache the workflow of `unit`, if not already cached, and evict
+        the least recently used workflows exceeding the maximum size.
+        It is meant to be called after the unit has been computed, so
+        that the size includes the quantities computed lazily.
+        """
+        key = self.key(job_id, unit)
+        if key in self._data:
+            return
+        size = sizeof(unit.workflow)
+        if self.max_size and size > self.max_size:
+            return
+        self._data[key] = (unit.workflow, size)
+        self.size += size
+        while self.max_size and self.size > self.max_size:
+            _key, (_workflow, evicted_size) = self._data.popitem(last=False)
+            self.size -= evicted_size
+
+
+#: The cache of the current process, instantiated by :func:`get_cache`
+_cache = None
+
+
+def get_cache():
+    """
+    :returns:
+        the :class:`WorkflowCache` of the current process, with the
+        maximum size set by the parameter `workflow_cache_size` (in MB)
+        of openquake.cfg; None if the parameter is missing or 0
+    """
+    global _cache
+    if _cache is None:
+        max_mb = int(config.get('risk', 'workflow_cache_size') or 0)
+        if max_mb:
+            _cache = WorkflowCache(max_mb * 1024 * 1024)
+    return _cache
+
+
+def cached(job_id, units):
+    """
+    Iterate over the given calculation units, replacing their workflows
+    with the cached ones and caching the workflows of the units after
+    they have been computed.
+    """
+    cache = get_cache()
+    for unit in units:
+        if cache is not None:
+            cache.lookup(job_id, unit)
+        yield unit
+        if cache is not None:
+            cache.store(job_id, unit)
+
+
+@contextlib.contextmanager
+def caching(job_id, units):
+    """
+    Replace the workflows of the given calculation units with the
+    cached ones and cache the workflows of the units when leaving the
+    context. Unlike :func:`cached`, it is meant for units computed
+    together, e.g. chunk by chunk.
+    """
+    cache = get_cache()
+    if cache is not None:
+        for unit in units:
+            cache.lookup(job_id, unit)
+    yield
+    if cache is not None:
+        for unit in units:
+            cache.store(job_id, unit)
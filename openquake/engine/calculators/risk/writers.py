@@ -21,6 +21,22 @@ import collections
 import itertools
 from openquake.risklib import scientific
 from openquake.engine.db import models
+from openquake.engine import writer
+
+
+def save(objects):
+    """
+    Save a list of unsaved instances of the same model with a single
+    COPY FROM, in the current transaction. The ids of the saved rows
+    are set on the instances, as `objects.create` would do.
+
+    :param objects: a list of Django model instances
+    :returns: the list of ids
+    """
+    if not objects:
+        return []
+    return writer.CacheInserter(
+        objects[0].__class__, len(objects)).copy(objects)
 
 
 def loss_map(
@@ -40,6 +56,7 @@ def loss_map(
         False if the provided losses are loss ratios
     """
 
+    data = []
     for i, asset in enumerate(assets):
         loss = losses[i]
         if std_devs is not None:
@@ -52,12 +69,13 @@ def loss_map(
             if std_devs is not None:
                 std_dev *= asset.value(loss_type)
 
-        models.LossMapData.objects.create(
+        data.append(models.LossMapData(
             loss_map_id=loss_map_id,
             asset_ref=asset.asset_ref,
             value=loss,
             std_dev=std_dev,
-            location=asset.site)
+            location=asset.site))
+    save(data)
 
 
 def bcr_distribution(loss_type, bcr_distribution_id, assets, bcr_data):
@@ -78,15 +96,16 @@ def bcr_distribution(loss_type, bcr_distribution_id, assets, bcr_data):
       2) eal_retrofitted: expected annual loss in the retrofitted model
       3) bcr: Benefit Cost Ratio parameter.
     """
-    for asset, (eal_original, eal_retrofitted, bcr) in zip(assets, bcr_data):
-        models.BCRDistributionData.objects.create(
-            bcr_distribution_id=bcr_distribution_id,
-            asset_ref=asset.asset_ref,
-            average_annual_loss_original=eal_original * asset.value(loss_type),
-            average_annual_loss_retrofitted=(eal_retrofitted *
-                                             asset.value(loss_type)),
-            bcr=bcr,
-            location=asset.site)
+    save([models.BCRDistributionData(
+        bcr_distribution_id=bcr_distribution_id,
+        asset_ref=asset.asset_ref,
+        average_annual_loss_original=eal_original * asset.value(loss_type),
+        average_annual_loss_retrofitted=(eal_retrofitted *
+                                         asset.value(loss_type)),
+        bcr=bcr,
+        location=asset.site)
+        for asset, (eal_original, eal_retrofitted, bcr) in zip(
+            assets, bcr_data)])
 
 
 def loss_curve(loss_type, loss_curve_id, assets, curve_data):
@@ -109,17 +128,17 @@ def loss_curve(loss_type, loss_curve_id, assets, curve_data):
     """
 
     curves, averages = curve_data
-    for asset, (losses, poes), average in itertools.izip(
-            assets, curves, averages):
-        models.LossCurveData.objects.create(
-            loss_curve_id=loss_curve_id,
-            asset_ref=asset.asset_ref,
-            location=asset.site,
-            poes=poes,
-            loss_ratios=losses,
-            asset_value=asset.value(loss_type),
-            average_loss_ratio=average,
-            stddev_loss_ratio=None)
+    save([models.LossCurveData(
+        loss_curve_id=loss_curve_id,
+        asset_ref=asset.asset_ref,
+        location=asset.site,
+        poes=poes,
+        loss_ratios=losses,
+        asset_value=asset.value(loss_type),
+        average_loss_ratio=average,
+        stddev_loss_ratio=None)
+        for asset, (losses, poes), average in itertools.izip(
+            assets, curves, averages)])
 
 
 def event_loss_curve(loss_type, loss_curve_id, assets, curve_data):
@@ -142,17 +161,17 @@ def event_loss_curve(loss_type, loss_curve_id, assets, curve_data):
     """
 
     curves, averages, stddevs = curve_data
-    for asset, (losses, poes), average, stddev in itertools.izip(
-            assets, curves, averages, stddevs):
-        models.LossCurveData.objects.create(
-            loss_curve_id=loss_curve_id,
-            asset_ref=asset.asset_ref,
-            location=asset.site,
-            poes=poes,
-            loss_ratios=losses,
-            asset_value=asset.value(loss_type),
-            average_loss_ratio=average,
-            stddev_loss_ratio=stddev)
+    save([models.LossCurveData(
+        loss_curve_id=loss_curve_id,
+        asset_ref=asset.asset_ref,
+        location=asset.site,
+        poes=poes,
+        loss_ratios=losses,
+        asset_value=asset.value(loss_type),
+        average_loss_ratio=average,
+        stddev_loss_ratio=stddev)
+        for asset, (losses, poes), average, stddev in itertools.izip(
+            assets, curves, averages, stddevs)])
 
 
 def loss_fraction(loss_type, loss_fraction_id, assets, values, fractions):
@@ -170,37 +189,43 @@ def loss_fraction(loss_type, loss_fraction_id, assets, values, fractions):
     :param absolute_losses:
        the absolute loss contributions of `values` in `assets`
     """
-    for asset, value, fraction in itertools.izip(assets, values, fractions):
-        models.LossFractionData.objects.create(
-            loss_fraction_id=loss_fraction_id,
-            value=value,
-            location=asset.site,
-            absolute_loss=fraction * asset.value(loss_type))
+    save([models.LossFractionData(
+        loss_fraction_id=loss_fraction_id,
+        value=value,
+        location=asset.site,
+        absolute_loss=fraction * asset.value(loss_type))
+        for asset, value, fraction in itertools.izip(
+            assets, values, fractions)])
 
 
 ###
 ### Damage Distributions
 ###
 
-def damage_distribution(assets, fraction_matrix, dmg_state_ids):
+def damage_distribution(assets, means, stddevs, dmg_state_ids):
     """
-    Save the damage distribution for a given asset.
+    Save the damage distribution for a given asset, given the mean and
+    the standard deviation of the number of units in each damage state.
+
     :param assets:
        a list of ExposureData instances
-    :param fraction_matrix:
-       numpy array with the damage fractions for each asset
+    :param means:
+       a sequence with the means for each damage state, one per asset
+    :param stddevs:
+       a sequence with the standard deviations for each damage state,
+       one per asset
     :param dmg_state_ids:
        a list of  IDs of instances of
        :class:`openquake.engine.db.models.DmgState` ordered by `lsi`
     """
-    for fractions, asset in zip(fraction_matrix, assets):
-        fractions *= asset.number_of_units
-        means, stds = scientific.mean_std(fractions)
-
-        for mean, std, dmg_state_id in zip(means, stds, dmg_state_ids):
-            models.DmgDistPerAsset.objects.create(
+    data = []
+    for asset, asset_means, asset_stddevs in zip(assets, means, stddevs):
+        for mean, std, dmg_state_id in zip(
+                asset_means, asset_stddevs, dmg_state_ids):
+            data.append(models.DmgDistPerAsset(
                 dmg_state_id=dmg_state_id,
-                mean=mean, stddev=std, exposure_data=asset)
+                mean=mean, stddev=std, exposure_data=asset))
+    save(data)
 
 
 def damage_distribution_per_taxonomy(fractions, dmg_state_ids, taxonomy):
@@ -135,6 +135,13 @@ class FloatArrayField(djm.Field):
         return super(FloatArrayField, self).formfield(**defaults)
 
 
+class RealArrayField(FloatArrayField):
+    """This field models a postgres single precision `real` array."""
+
+    def db_type(self, connection):
+        return 'real[]'
+
+
 class IntArrayField(djm.Field):
     """This field models a postgresql `int` array"""
 
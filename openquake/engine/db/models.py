@@ -27,6 +27,7 @@ Model representations of the OpenQuake DB tables.
 
 import collections
 import operator
+from cStringIO import StringIO
 from datetime import datetime
 
 
@@ -45,6 +46,7 @@ from openquake.hazardlib import source as hazardlib_source
 import openquake.hazardlib.site
 
 from openquake.engine.db import fields
+from openquake.engine.input.sites import read_sites_csv
 from openquake.engine import writer
 
 
@@ -94,6 +96,10 @@ RISK_RTOL = 0.05
 #: absolute tolerance to consider two risk outputs (almost) equal
 RISK_ATOL = 0.01
 
+#: Kilometers per degree of latitude, used to build the grid of the
+#: hazard sites of an exposure (see :func:`grid_cells`)
+KM_PER_DEGREE = 111.2
+
 # TODO: these want to be dictionaries
 INPUT_TYPE_CHOICES = (
     (u'unknown', u'Unknown'),
@@ -104,6 +110,8 @@ INPUT_TYPE_CHOICES = (
     (u'fragility', u'Fragility'),
     (u'site_model', u'Site Model'),
     (u'rupture_model', u'Rupture Model'),
+    (u'regions', u'Regions'),
+    (u'sites', u'Sites'),
 
     # vulnerability models
     (u'structural_vulnerability', u'Structural Vulnerability'),
@@ -206,6 +214,64 @@ def queryset_iter(queryset, chunk_size):
             offset += chunk_size
 
 
+def grid_cells(lons, lats, spacing):
+    """
+    Find the cells containing the given locations, in a grid with cells
+    of about `spacing` km per side: the rows of the grid are bands of
+    latitude, and the width in longitude of the cells of a row depends
+    on the latitude of the row.
+
+    :param lons: an array of longitudes
+    :param lats: an array of latitudes
+    :param float spacing: the size of the cells, in km
+    :returns: two integer arrays (rows, cols) with the cell of each location
+    """
+    dlat = spacing / KM_PER_DEGREE
+    rows = numpy.floor(numpy.asarray(lats, dtype=float) / dlat).astype(int)
+    cols = numpy.floor(numpy.asarray(lons, dtype=float) /
+                       _cell_widths(rows, dlat)).astype(int)
+    return rows, cols
+
+
+def cell_centers(rows, cols, spacing):
+    """
+    :returns:
+        two arrays (lons, lats) with the centers of the given cells of
+        the grid described in :func:`grid_cells`
+    """
+    dlat = spacing / KM_PER_DEGREE
+    rows = numpy.asarray(rows)
+    return ((numpy.asarray(cols) + 0.5) * _cell_widths(rows, dlat),
+            (rows + 0.5) * dlat)
+
+
+def _cell_widths(rows, dlat):
+    # the width in degrees of the cells of the given rows, computed
+    # at the latitude of the center of the rows
+    return numpy.minimum(
+        dlat / numpy.cos(numpy.radians((rows + 0.5) * dlat)), 360.)
+
+
+def snap_to_grid(lons, lats, spacing):
+    """
+    :param lons: an array of longitudes
+    :param lats: an array of latitudes
+    :param float spacing: the size of the cells of the grid, in km
+    :returns:
+        two arrays (lons, lats) with the distinct centers of the cells
+        of the grid described in :func:`grid_cells` containing the
+        given locations, sorted by longitude and latitude
+    """
+    rows, cols = grid_cells(lons, lats, spacing)
+    order = numpy.lexsort((cols, rows))
+    rows, cols = rows[order], cols[order]
+    distinct = numpy.ones(len(rows), dtype=bool)
+    distinct[1:] = (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1])
+    lons, lats = cell_centers(rows[distinct], cols[distinct], spacing)
+    order = numpy.lexsort((lats, lons))
+    return lons[order], lats[order]
+
+
 # FIXME (ms): this is needed until we fix SiteCollection in hazardlib;
 # the issue is the reset of the depts; we need QA tests for that
 class SiteCollection(openquake.hazardlib.site.SiteCollection):
@@ -359,6 +425,8 @@ class Performance(djm.Model):
     duration = djm.FloatField(null=True)
     pymemory = djm.IntegerField(null=True)
     pgmemory = djm.IntegerField(null=True)
+    hostname = djm.TextField(null=True)
+    pid = djm.IntegerField(null=True)
 
     class Meta:
         db_table = 'uiapi\".\"performance'
@@ -442,6 +510,10 @@ class HazardCalculation(djm.Model):
     region_grid_spacing = djm.FloatField(null=True, blank=True)
     # The points of interest for a calculation.
     sites = djm.MultiPointField(srid=DEFAULT_SRID, null=True, blank=True)
+    # If given, the hazard sites of an exposure are the centers of the
+    # cells, of this size, of a grid containing the assets, instead of
+    # the asset locations. Units in km.
+    exposure_site_spacing = djm.FloatField(null=True, blank=True)
 
     ########################
     # Logic Tree parameters:
@@ -752,7 +824,8 @@ class HazardCalculation(djm.Model):
 
         The mesh can be calculated given a `region` polygon and
         `region_grid_spacing` (the discretization parameter), or from a list of
-        `sites`.
+        `sites`, or from the locations of the assets of an exposure (snapped
+        to a grid if `exposure_site_spacing` is given).
 
         .. note::
             This mesh is cached for efficiency when dealing with large numbers
@@ -762,15 +835,14 @@ class HazardCalculation(djm.Model):
         """
         if self._points_to_compute is None:
             if self.pk and 'exposure' in self.inputs:
-                assets = self.oqjob.exposuremodel.exposuredata_set.all(
-                    ).order_by('asset_ref')
-
                 # the points here must be sorted
-                lons, lats = zip(*sorted(set((asset.site.x, asset.site.y)
-                                             for asset in assets)))
+                lons, lats = self.exposure_locations()
+                if self.exposure_site_spacing:
+                    lons, lats = snap_to_grid(
+                        lons, lats, self.exposure_site_spacing)
                 # Cache the mesh:
                 self._points_to_compute = hazardlib_geo.Mesh(
-                    numpy.array(lons), numpy.array(lats), depths=None
+                    lons, lats, depths=None
                 )
             elif self.region and self.region_grid_spacing:
                 # assume that the polygon is a single linear ring
@@ -781,19 +853,54 @@ class HazardCalculation(djm.Model):
                 self._points_to_compute = poly.discretize(
                     self.region_grid_spacing
                 )
+            elif 'sites' in self.inputs:
+                # the sites are read in chunks from the `sites_csv` file
+                # and stored while reading
+                all_lons, all_lats = [], []
+                with transaction.commit_on_success(using='job_init'):
+                    for lons, lats in read_sites_csv(self.inputs['sites']):
+                        if save_sites:
+                            self.copy_sites(lons, lats)
+                        all_lons.append(lons)
+                        all_lats.append(lats)
+                save_sites = False
+                # Cache the mesh:
+                self._points_to_compute = hazardlib_geo.Mesh(
+                    numpy.concatenate(all_lons), numpy.concatenate(all_lats),
+                    depths=None
+                )
             elif self.sites is not None:
                 lons, lats = zip(*self.sites.coords)
                 # Cache the mesh:
                 self._points_to_compute = hazardlib_geo.Mesh(
                     numpy.array(lons), numpy.array(lats), depths=None
                 )
-            # store the sites
+            # store the sites with a COPY FROM of the coordinates
             if save_sites and self._points_to_compute:
-                self.save_sites([(pt.longitude, pt.latitude)
-                                 for pt in self._points_to_compute])
+                with transaction.commit_on_success(using='job_init'):
+                    self.copy_sites(self._points_to_compute.lons,
+                                    self._points_to_compute.lats)
 
         return self._points_to_compute
 
+    def exposure_locations(self):
+        """
+        Extract the distinct locations of the assets of the exposure of
+        the calculation with a single query, without instantiating the
+        assets.
+
+        :returns:
+            two arrays (lons, lats), sorted by longitude and latitude
+        """
+        cursor = getcursor('job_init')
+        cursor.execute("""
+        SELECT DISTINCT
+            ST_X(site::geometry) AS lon, ST_Y(site::geometry) AS lat
+        FROM riski.exposure_data WHERE exposure_model_id = %s
+        ORDER BY lon, lat""", (self.oqjob.exposuremodel.id,))
+        coords = numpy.array(cursor.fetchall(), dtype=float).reshape(-1, 2)
+        return coords[:, 0], coords[:, 1]
+
     @property
     def site_collection(self):
         """
@@ -868,6 +975,25 @@ class HazardCalculation(djm.Model):
                  for coord in coordinates]
         return writer.CacheInserter.saveall(sites)
 
+    def copy_sites(self, lons, lats):
+        """
+        Save the given sites on the hzrdi.hazard_site table with a COPY
+        FROM, without instantiating :class:`HazardSite` objects and
+        without committing the current transaction.
+
+        :param lons: an array of longitudes
+        :param lats: an array of latitudes
+        """
+        stringio = StringIO()
+        for lon, lat in zip(lons, lats):
+            stringio.write('%d\tPOINT(%r %r)\n' % (
+                self.id, float(lon), float(lat)))
+        stringio.reset()
+        getcursor('job_init').copy_from(
+            stringio, 'hzrdi.hazard_site',
+            columns=['hazard_calculation_id', 'location'])
+        stringio.close()
+
     def total_investigation_time(self):
         """
         Helper method to compute the total investigation time for a
@@ -1012,6 +1138,18 @@ class RiskCalculation(djm.Model):
     loss_curve_resolution = djm.IntegerField(
         null=False, blank=True, default=DEFAULT_LOSS_CURVE_RESOLUTION)
     insured_losses = djm.NullBooleanField(null=True, blank=True, default=False)
+    # if true, store the losses of each asset for each rupture
+    asset_loss_table = djm.NullBooleanField(
+        null=True, blank=True, default=False)
+
+    ##########################################
+    # Event-Based and Scenario parameters:
+    ##########################################
+    # compute also the aggregate losses of the groups of assets with
+    # the same taxonomy or in the same region (see the regions file)
+    aggregate_by = djm.TextField(
+        null=True, blank=True,
+        choices=(('taxonomy', 'Taxonomy'), ('region', 'Region')))
 
     # The points of interest for disaggregation
     sites_disagg = djm.MultiPointField(
@@ -1115,9 +1253,10 @@ class RiskCalculation(djm.Model):
 
         # if we are computing hazard at exact location we set the
         # maximum_distance to a very small number in order to help the
-        # query to find the results.
+        # query to find the results; if the asset locations have been
+        # snapped to a grid, the site of an asset is within a cell size
         if 'exposure' in hc.inputs:
-            dist = 0.001
+            dist = hc.exposure_site_spacing or 0.001
         return dist
 
     @property
@@ -2425,6 +2564,8 @@ class LossMapData(djm.Model):
 class AggregateLoss(djm.Model):
     output = djm.OneToOneField("Output", related_name="aggregate_loss")
     insured = djm.BooleanField(default=False)
+    # the taxonomy or region of the assets, None for all the assets
+    aggregation_group = djm.TextField(null=True)
     mean = djm.FloatField()
     std_dev = djm.FloatField()
     loss_type = djm.TextField(choices=zip(LOSS_TYPES, LOSS_TYPES))
@@ -2466,6 +2607,9 @@ class LossCurve(djm.Model):
     hazard_output = djm.ForeignKey("Output", related_name="risk_loss_curves")
     aggregate = djm.BooleanField(default=False)
     insured = djm.BooleanField(default=False)
+    # the taxonomy or region of the assets of an aggregate curve, None
+    # for all the assets
+    aggregation_group = djm.TextField(null=True)
 
     # If the curve is a result of an aggregation over different
     # hazard_output the following fields must be set
@@ -2793,6 +2937,57 @@ class DmgDistTotal(djm.Model):
             self, data, operator.attrgetter('mean', 'stddev'))
 
 
+class AssetSite(djm.Model):
+    """
+    Associates each asset considered by a risk calculation with the
+    closest hazard site (within the maximum distance) of the hazard
+    calculation it depends on. It is populated once in the pre_execute
+    phase and then read by the hazard getters.
+    """
+    risk_calculation = djm.ForeignKey('RiskCalculation')
+    asset = djm.ForeignKey('ExposureData')
+    site = djm.ForeignKey('HazardSite')
+
+    class Meta:
+        db_table = 'riskr\".\"asset_site'
+
+
+class GmfCache(djm.Model):
+    """
+    Ground motion values computed by an event based risk calculation
+    from the ruptures of a stochastic event set collection. They are
+    computed once, only on the hazard sites associated to the assets,
+    and then read by all the risk tasks.
+    """
+    risk_calculation = djm.ForeignKey('RiskCalculation')
+    # the output of type ses from which the ruptures are taken
+    hazard_output = djm.ForeignKey('Output')
+    imt = djm.TextField()
+    site = djm.ForeignKey('HazardSite')
+    gmvs = fields.FloatArrayField()
+    rupture_ids = fields.IntArrayField()
+
+    class Meta:
+        db_table = 'riskr\".\"gmf_cache'
+
+
+class AssetLoss(djm.Model):
+    """
+    The non-zero losses of a block of assets for each rupture of a
+    hazard output, stored in sparse form: the i-th loss is suffered by
+    the asset asset_ids[i] because of the rupture rupture_ids[i].
+    """
+    risk_calculation = djm.ForeignKey('RiskCalculation')
+    hazard_output = djm.ForeignKey('Output')
+    loss_type = djm.TextField(choices=zip(LOSS_TYPES, LOSS_TYPES))
+    asset_ids = fields.IntArrayField()
+    rupture_ids = fields.IntArrayField()
+    losses = fields.RealArrayField()
+
+    class Meta:
+        db_table = 'riskr\".\"asset_loss'
+
+
 ## Tables in the 'riski' schema.
 
 
@@ -2815,6 +3010,8 @@ class ExposureModel(djm.Model):
     area_unit = djm.TextField(null=True)
     deductible_absolute = djm.BooleanField(default=True)
     insurance_limit_absolute = djm.BooleanField(default=True)
+    checksum = djm.TextField(
+        null=True, help_text="SHA1 digest of the content of the exposure file")
 
     class Meta:
         db_table = 'riski\".\"exposure_model'
@@ -2935,6 +3132,112 @@ class AssetManager(djm.GeoManager):
             rc, taxonomy, offset, size)
         return list(self.raw(query, args))
 
+    def get_asset_blocks(self, rc, taxonomy, block_size):
+        """
+        Generator over the assets of `taxonomy` contained in the region
+        constraint of `rc`, in blocks of `block_size` assets. The assets
+        are the same (with the same ordering and annotations) returned
+        by :meth:`get_asset_chunk`, but they are read in a single pass
+        with a server-side cursor, instead of running a query with a
+        different OFFSET for each block.
+
+        :returns:
+           an iterator over lists of instances of
+           :class:`openquake.engine.db.models.ExposureData`
+        """
+        # LIMIT NULL is the same as omitting the LIMIT clause
+        query, args = self._get_asset_chunk_query_args(rc, taxonomy, 0, None)
+        return self._iter_asset_blocks(query, args, block_size)
+
+    def get_asset_blocks_by_site(self, rc, taxonomies, block_size):
+        """
+        Generator over the assets of the given `taxonomies` contained
+        in the region constraint of `rc`, in blocks of `block_size`
+        assets. The assets are ordered by the hazard site associated
+        to them in :class:`AssetSite` (the assets without a site come
+        last), so that a block contains the assets of all the
+        taxonomies sharing the same hazard sites. The id of the
+        hazard site is available as the annotation `hazard_site_id`.
+
+        :returns:
+           an iterator over lists of instances of
+           :class:`openquake.engine.db.models.ExposureData`
+        """
+        people_field, occupants_cond, occupancy_join, occupants_args = (
+            self._get_people_query_helper(
+                rc.exposure_model.category, rc.time_event))
+
+        cost_type_fields, cost_type_joins = self._get_cost_types_query_helper(
+            rc.exposure_model.costtype_set.all())
+
+        args = (rc.id, rc.exposure_model.id, list(taxonomies),
+                "SRID=4326; %s" % rc.region_constraint.wkt) + occupants_args
+
+        query = """
+            SELECT riski.exposure_data.*,
+                   {people_field} AS people,
+                   riskr.asset_site.site_id AS hazard_site_id,
+                   {costs}
+            FROM riski.exposure_data
+            {occupancy_join}
+            ON riski.exposure_data.id = riski.occupancy.exposure_data_id
+            {costs_join}
+            LEFT JOIN riskr.asset_site
+            ON riskr.asset_site.asset_id = riski.exposure_data.id AND
+               riskr.asset_site.risk_calculation_id = %s
+            WHERE exposure_model_id = %s AND
+                  taxonomy = ANY(%s) AND
+                  ST_COVERS(ST_GeographyFromText(%s), site) AND
+                  {occupants_cond}
+            GROUP BY riski.exposure_data.id, riskr.asset_site.site_id
+            ORDER BY riskr.asset_site.site_id NULLS LAST,
+                     riski.exposure_data.id
+            """.format(people_field=people_field,
+                       occupants_cond=occupants_cond,
+                       costs=cost_type_fields,
+                       costs_join=cost_type_joins,
+                       occupancy_join=occupancy_join)
+
+        return self._iter_asset_blocks(query, args, block_size)
+
+    def _iter_asset_blocks(self, query, args, block_size):
+        """
+        Run `query` with a server-side cursor and yield the resulting
+        assets in blocks of `block_size`. The columns which are not
+        fields of the model are set as annotations.
+        """
+        model_fields = set(f.attname for f in self.model._meta.fields)
+
+        connection = connections['job_init']
+        connection.cursor()  # make sure the connection is open
+        # a cursor WITH HOLD survives to the commits possibly performed
+        # by the consumer of the generator
+        cursor = connection.connection.cursor(
+            'asset_blocks', withhold=True)
+        try:
+            cursor.itersize = block_size
+            cursor.execute(query, args)
+            names = None
+            while True:
+                rows = cursor.fetchmany(block_size)
+                if not rows:
+                    break
+                if names is None:
+                    names = [d[0] for d in cursor.description]
+                assets = []
+                for row in rows:
+                    values = dict(zip(names, row))
+                    asset = self.model(**dict(
+                        (name, values.pop(name)) for name in names
+                        if name in model_fields))
+                    # the remaining values are the annotations
+                    for name, value in values.iteritems():
+                        setattr(asset, name, value)
+                    assets.append(asset)
+                yield assets
+        finally:
+            cursor.close()
+
     def _get_asset_chunk_query_args(self, rc, taxonomy, offset, size):
         """
         Build a parametric query string and the corresponding args for
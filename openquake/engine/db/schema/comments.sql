@@ -73,6 +73,7 @@ COMMENT ON TABLE riski.exposure_model IS 'A risk exposure model';
 COMMENT ON COLUMN riski.exposure_model.area_type IS 'area type. one of: aggregated or per_asset';
 COMMENT ON COLUMN riski.exposure_model.area_unit IS 'area unit of measure e.g. sqm';
 COMMENT ON COLUMN riski.exposure_model.category IS 'The risk category modelled';
+COMMENT ON COLUMN riski.exposure_model.checksum IS 'SHA1 digest of the content of the exposure file, used to reuse the stored exposure models';
 COMMENT ON COLUMN riski.exposure_model.description IS 'An optional description of the risk exposure model at hand';
 
 COMMENT ON COLUMN riski.exposure_model.name IS 'The exposure model name';
@@ -102,6 +103,7 @@ COMMENT ON COLUMN riskr.loss_map_data.std_dev IS 'The standard deviation of the
 COMMENT ON TABLE riskr.loss_curve IS 'Holds the parameters common to a set of loss curves.';
 COMMENT ON COLUMN riskr.loss_curve.output_id IS 'The foreign key to the output record that represents the corresponding loss curve.';
 COMMENT ON COLUMN riskr.loss_curve.aggregate IS 'Is the curve an aggregate curve?';
+COMMENT ON COLUMN riskr.loss_curve.aggregation_group IS 'The taxonomy or region of the assets of an aggregate curve, NULL for the whole exposure';
 
 
 COMMENT ON TABLE riskr.loss_curve_data IS 'Holds the probabilities of exceedance for a given loss curve.';
@@ -130,6 +132,27 @@ COMMENT ON COLUMN riskr.bcr_distribution_data.bcr IS 'The actual benefit-cost ra
 
 COMMENT ON TABLE riskr.dmg_state IS 'Holds the damage_states associated to a given output';
 
+COMMENT ON TABLE riskr.asset_site IS 'Associates each asset of a risk calculation with the closest hazard site';
+COMMENT ON COLUMN riskr.asset_site.risk_calculation_id IS 'The foreign key to the risk calculation';
+COMMENT ON COLUMN riskr.asset_site.asset_id IS 'The foreign key to the asset';
+COMMENT ON COLUMN riskr.asset_site.site_id IS 'The foreign key to the closest hazard site';
+
+COMMENT ON TABLE riskr.gmf_cache IS 'Ground motion values computed by an event based risk calculation from a stochastic event set collection';
+COMMENT ON COLUMN riskr.gmf_cache.risk_calculation_id IS 'The foreign key to the risk calculation';
+COMMENT ON COLUMN riskr.gmf_cache.hazard_output_id IS 'The foreign key to the output of type ses holding the ruptures';
+COMMENT ON COLUMN riskr.gmf_cache.imt IS 'The intensity measure type (in long form, e.g. SA(0.1))';
+COMMENT ON COLUMN riskr.gmf_cache.site_id IS 'The foreign key to the hazard site';
+COMMENT ON COLUMN riskr.gmf_cache.gmvs IS 'Ground motion values, one per rupture';
+COMMENT ON COLUMN riskr.gmf_cache.rupture_ids IS 'The ids of the ruptures generating the ground motion values';
+
+COMMENT ON TABLE riskr.asset_loss IS 'Non-zero losses per asset and per rupture computed by an event based risk calculation, one row per block of assets';
+COMMENT ON COLUMN riskr.asset_loss.risk_calculation_id IS 'The foreign key to the risk calculation';
+COMMENT ON COLUMN riskr.asset_loss.hazard_output_id IS 'The foreign key to the hazard output the losses are computed from';
+COMMENT ON COLUMN riskr.asset_loss.loss_type IS 'The loss type (e.g. structural)';
+COMMENT ON COLUMN riskr.asset_loss.asset_ids IS 'The ids of the assets, one per loss';
+COMMENT ON COLUMN riskr.asset_loss.rupture_ids IS 'The ids of the ruptures, one per loss';
+COMMENT ON COLUMN riskr.asset_loss.losses IS 'The absolute losses, in single precision';
+
 -- uiapi schema tables ------------------------------------------
 
 COMMENT ON TABLE uiapi.oq_job IS 'Date related to an OpenQuake job that was created in the UI.';
@@ -142,6 +165,8 @@ COMMENT ON TABLE uiapi.performance IS 'Tracks task performance';
 COMMENT ON COLUMN uiapi.performance.duration IS 'Duration of the operation in seconds';
 COMMENT ON COLUMN uiapi.performance.pymemory IS 'Memory occupation in Python (Mbytes)';
 COMMENT ON COLUMN uiapi.performance.pgmemory IS 'Memory occupation in Postgres (Mbytes)';
+COMMENT ON COLUMN uiapi.performance.hostname IS 'Name of the host running the operation';
+COMMENT ON COLUMN uiapi.performance.pid IS 'ID of the process running the operation';
 
 
 COMMENT ON TABLE uiapi.job_stats IS 'Tracks various job statistics';
@@ -82,10 +82,14 @@ CREATE INDEX riskr_bcr_distribution_data_bcr_distribution_id_idx on riskr.bcr_di
 
 CREATE INDEX riskr_dmg_state_rc_id_idx on riskr.dmg_state(risk_calculation_id);
 CREATE INDEX riskr_dmg_state_lsi_idx on riskr.dmg_state(lsi);
+CREATE INDEX riskr_asset_site_risk_calculation_asset_idx on riskr.asset_site(risk_calculation_id, asset_id);
+CREATE INDEX riskr_gmf_cache_idx on riskr.gmf_cache(risk_calculation_id, hazard_output_id, imt, site_id);
+CREATE INDEX riskr_asset_loss_idx on riskr.asset_loss(risk_calculation_id, hazard_output_id, loss_type);
 
 -- riski indexes
 CREATE INDEX riski_exposure_data_site_idx ON riski.exposure_data USING gist(site);
 CREATE INDEX riski_exposure_model_job_id_idx ON riski.exposure_model(job_id);
+CREATE INDEX riski_exposure_model_checksum_idx ON riski.exposure_model(checksum);
 CREATE INDEX riski_exposure_data_taxonomy_idx ON riski.exposure_data(taxonomy);
 CREATE INDEX riski_exposure_data_exposure_model_id_idx on riski.exposure_data(exposure_model_id);
 CREATE INDEX riski_exposure_data_site_stx_idx ON riski.exposure_data(ST_X(geometry(site)));
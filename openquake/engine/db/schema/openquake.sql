@@ -116,7 +116,9 @@ CREATE TABLE uiapi.performance (
     operation VARCHAR NOT NULL,
     duration FLOAT,
     pymemory BIGINT,
-    pgmemory BIGINT
+    pgmemory BIGINT,
+    hostname VARCHAR,
+    pid INTEGER
 )  TABLESPACE uiapi_ts;
 
 
@@ -152,6 +154,8 @@ CREATE TABLE uiapi.hazard_calculation (
         )),
     inputs BYTEA,  -- stored as a pickled Python `dict`
     region_grid_spacing float,
+    exposure_site_spacing float CONSTRAINT exposure_site_spacing_value
+        CHECK(exposure_site_spacing IS NULL OR exposure_site_spacing > 0),
     -- logic tree parameters:
     random_seed INTEGER,
     number_of_logic_tree_samples INTEGER,
@@ -251,6 +255,12 @@ CREATE TABLE uiapi.risk_calculation (
         CONSTRAINT loss_curve_resolution_is_set
         CHECK  (loss_curve_resolution >= 1),
     insured_losses BOOLEAN DEFAULT false,
+    asset_loss_table BOOLEAN DEFAULT false,
+
+    -- event-based and scenario parameters:
+    aggregate_by VARCHAR CONSTRAINT aggregate_by_value
+        CHECK(aggregate_by IS NULL OR
+              aggregate_by IN ('taxonomy', 'region')),
 
     -- BCR (Benefit-Cost Ratio) parameters:
     interest_rate float,
@@ -622,6 +632,8 @@ CREATE TABLE riskr.aggregate_loss (
     output_id INTEGER NOT NULL, -- FK to output.id
     loss_type VARCHAR NOT NULL,
     insured BOOLEAN NOT NULL DEFAULT false,
+    -- the group of assets (NULL for all the assets)
+    aggregation_group VARCHAR,
     mean float NOT NULL,
     std_dev float NULL
 ) TABLESPACE riskr_ts;
@@ -649,6 +661,40 @@ CREATE TABLE riskr.event_loss_data (
 ) TABLESPACE riskr_ts;
 
 
+-- Asset -> hazard site association, computed once per risk calculation
+CREATE TABLE riskr.asset_site (
+    id SERIAL PRIMARY KEY,
+    risk_calculation_id INTEGER NOT NULL, -- FK to uiapi.risk_calculation.id
+    asset_id INTEGER NOT NULL, -- FK to riski.exposure_data.id
+    site_id INTEGER NOT NULL -- FK to hzrdi.hazard_site.id
+) TABLESPACE riskr_ts;
+
+
+-- Ground motion values computed on the fly from a SES collection
+CREATE TABLE riskr.gmf_cache (
+    id SERIAL PRIMARY KEY,
+    risk_calculation_id INTEGER NOT NULL, -- FK to uiapi.risk_calculation.id
+    hazard_output_id INTEGER NOT NULL, -- FK to uiapi.output.id
+    imt VARCHAR NOT NULL,
+    site_id INTEGER NOT NULL, -- FK to hzrdi.hazard_site.id
+    gmvs float[] NOT NULL,
+    rupture_ids int[] NOT NULL
+) TABLESPACE riskr_ts;
+
+
+-- Losses per asset and per rupture of an event based risk calculation,
+-- stored in sparse form, one row per block of assets
+CREATE TABLE riskr.asset_loss (
+    id SERIAL PRIMARY KEY,
+    risk_calculation_id INTEGER NOT NULL, -- FK to uiapi.risk_calculation.id
+    hazard_output_id INTEGER NOT NULL, -- FK to uiapi.output.id
+    loss_type VARCHAR NOT NULL,
+    asset_ids int[] NOT NULL,
+    rupture_ids int[] NOT NULL,
+    losses real[] NOT NULL
+) TABLESPACE riskr_ts;
+
+
 -- Loss curve.
 CREATE TABLE riskr.loss_curve (
     id SERIAL PRIMARY KEY,
@@ -657,6 +703,8 @@ CREATE TABLE riskr.loss_curve (
     hazard_output_id INTEGER NULL,
     aggregate BOOLEAN NOT NULL DEFAULT false,
     insured BOOLEAN NOT NULL DEFAULT false,
+    -- the group of assets of an aggregate curve (NULL for all the assets)
+    aggregation_group VARCHAR,
 
     statistics VARCHAR CONSTRAINT loss_curve_statistics
         CHECK(statistics IS NULL OR
@@ -792,7 +840,10 @@ CREATE TABLE riski.exposure_model (
     area_unit VARCHAR,
 
     deductible_absolute BOOLEAN DEFAULT TRUE,
-    insurance_limit_absolute BOOLEAN DEFAULT TRUE
+    insurance_limit_absolute BOOLEAN DEFAULT TRUE,
+
+    -- SHA1 digest of the content of the exposure file
+    checksum VARCHAR
 
 ) TABLESPACE riski_ts;
 
@@ -1069,6 +1120,50 @@ ADD CONSTRAINT riskr_dmg_dist_per_asset_exposure_data_fk
 FOREIGN KEY (exposure_data_id) REFERENCES riski.exposure_data(id) ON DELETE RESTRICT;
 
 
+-- Asset -> hazard site association
+
+ALTER TABLE riskr.asset_site
+ADD CONSTRAINT riskr_asset_site_risk_calculation_fk
+FOREIGN KEY (risk_calculation_id) REFERENCES uiapi.risk_calculation(id)
+ON DELETE CASCADE;
+
+ALTER TABLE riskr.asset_site
+ADD CONSTRAINT riskr_asset_site_exposure_data_fk
+FOREIGN KEY (asset_id) REFERENCES riski.exposure_data(id) ON DELETE CASCADE;
+
+ALTER TABLE riskr.asset_site
+ADD CONSTRAINT riskr_asset_site_hazard_site_fk
+FOREIGN KEY (site_id) REFERENCES hzrdi.hazard_site(id) ON DELETE CASCADE;
+
+
+-- Ground motion values computed on the fly
+
+ALTER TABLE riskr.gmf_cache
+ADD CONSTRAINT riskr_gmf_cache_risk_calculation_fk
+FOREIGN KEY (risk_calculation_id) REFERENCES uiapi.risk_calculation(id)
+ON DELETE CASCADE;
+
+ALTER TABLE riskr.gmf_cache
+ADD CONSTRAINT riskr_gmf_cache_output_fk
+FOREIGN KEY (hazard_output_id) REFERENCES uiapi.output(id) ON DELETE CASCADE;
+
+ALTER TABLE riskr.gmf_cache
+ADD CONSTRAINT riskr_gmf_cache_hazard_site_fk
+FOREIGN KEY (site_id) REFERENCES hzrdi.hazard_site(id) ON DELETE CASCADE;
+
+
+-- Losses per asset and per rupture
+
+ALTER TABLE riskr.asset_loss
+ADD CONSTRAINT riskr_asset_loss_risk_calculation_fk
+FOREIGN KEY (risk_calculation_id) REFERENCES uiapi.risk_calculation(id)
+ON DELETE CASCADE;
+
+ALTER TABLE riskr.asset_loss
+ADD CONSTRAINT riskr_asset_loss_output_fk
+FOREIGN KEY (hazard_output_id) REFERENCES uiapi.output(id) ON DELETE CASCADE;
+
+
 ALTER TABLE riski.exposure_data ADD CONSTRAINT
 riski_exposure_data_exposure_model_fk FOREIGN KEY (exposure_model_id)
 REFERENCES riski.exposure_model(id) ON DELETE CASCADE;
@@ -106,6 +106,9 @@ GRANT SELECT,INSERT,UPDATE ON riskr.dmg_dist_per_taxonomy     TO oq_job_init;
 GRANT SELECT,INSERT,UPDATE ON riskr.dmg_dist_total            TO oq_job_init;
 GRANT SELECT,INSERT,UPDATE ON riskr.event_loss                TO oq_job_init;
 GRANT SELECT,INSERT,UPDATE ON riskr.event_loss_data           TO oq_job_init;
+GRANT SELECT,INSERT        ON riskr.asset_site                TO oq_job_init;
+GRANT SELECT,INSERT        ON riskr.gmf_cache                 TO oq_job_init;
+GRANT SELECT,INSERT        ON riskr.asset_loss                TO oq_job_init;
 
 -- uiapi schema
 GRANT SELECT,INSERT,UPDATE ON uiapi.oq_job             TO oq_job_init;
@@ -113,7 +116,7 @@ GRANT SELECT,INSERT,UPDATE ON uiapi.oq_job             TO oq_job_init;
 GRANT SELECT,INSERT,UPDATE ON uiapi.job_stats          TO oq_job_init;
 GRANT SELECT,INSERT,UPDATE ON uiapi.job_stats          TO oq_job_init;
 GRANT SELECT,INSERT,UPDATE ON uiapi.hazard_calculation TO oq_job_init;
-GRANT SELECT,INSERT        ON uiapi.risk_calculation   TO oq_job_init;
+GRANT SELECT,INSERT,UPDATE ON uiapi.risk_calculation   TO oq_job_init;
 -- what nodes became available/unavailable at what time?
 GRANT SELECT,INSERT,UPDATE ON uiapi.cnode_stats        TO oq_job_init;
 GRANT SELECT,INSERT,UPDATE ON uiapi.output             TO oq_job_init;
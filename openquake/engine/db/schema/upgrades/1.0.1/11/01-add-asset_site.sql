@@ -0,0 +1,26 @@
+CREATE TABLE riskr.asset_site (
+    id SERIAL PRIMARY KEY,
+    risk_calculation_id INTEGER NOT NULL, -- FK to uiapi.risk_calculation.id
+    asset_id INTEGER NOT NULL, -- FK to riski.exposure_data.id
+    site_id INTEGER NOT NULL -- FK to hzrdi.hazard_site.id
+) TABLESPACE riskr_ts;
+
+ALTER TABLE riskr.asset_site
+ADD CONSTRAINT riskr_asset_site_risk_calculation_fk
+FOREIGN KEY (risk_calculation_id) REFERENCES uiapi.risk_calculation(id)
+ON DELETE CASCADE;
+
+ALTER TABLE riskr.asset_site
+ADD CONSTRAINT riskr_asset_site_exposure_data_fk
+FOREIGN KEY (asset_id) REFERENCES riski.exposure_data(id) ON DELETE CASCADE;
+
+ALTER TABLE riskr.asset_site
+ADD CONSTRAINT riskr_asset_site_hazard_site_fk
+FOREIGN KEY (site_id) REFERENCES hzrdi.hazard_site(id) ON DELETE CASCADE;
+
+CREATE INDEX riskr_asset_site_risk_calculation_asset_idx on riskr.asset_site(risk_calculation_id, asset_id);
+
+GRANT SELECT ON riskr.asset_site TO GROUP openquake;
+GRANT INSERT,UPDATE,DELETE ON riskr.asset_site TO oq_admin;
+GRANT SELECT,INSERT ON riskr.asset_site TO oq_job_init;
+GRANT ALL ON SEQUENCE riskr.asset_site_id_seq TO GROUP openquake;
@@ -0,0 +1,29 @@
+CREATE TABLE riskr.gmf_cache (
+    id SERIAL PRIMARY KEY,
+    risk_calculation_id INTEGER NOT NULL, -- FK to uiapi.risk_calculation.id
+    hazard_output_id INTEGER NOT NULL, -- FK to uiapi.output.id
+    imt VARCHAR NOT NULL,
+    site_id INTEGER NOT NULL, -- FK to hzrdi.hazard_site.id
+    gmvs float[] NOT NULL,
+    rupture_ids int[] NOT NULL
+) TABLESPACE riskr_ts;
+
+ALTER TABLE riskr.gmf_cache
+ADD CONSTRAINT riskr_gmf_cache_risk_calculation_fk
+FOREIGN KEY (risk_calculation_id) REFERENCES uiapi.risk_calculation(id)
+ON DELETE CASCADE;
+
+ALTER TABLE riskr.gmf_cache
+ADD CONSTRAINT riskr_gmf_cache_output_fk
+FOREIGN KEY (hazard_output_id) REFERENCES uiapi.output(id) ON DELETE CASCADE;
+
+ALTER TABLE riskr.gmf_cache
+ADD CONSTRAINT riskr_gmf_cache_hazard_site_fk
+FOREIGN KEY (site_id) REFERENCES hzrdi.hazard_site(id) ON DELETE CASCADE;
+
+CREATE INDEX riskr_gmf_cache_idx on riskr.gmf_cache(risk_calculation_id, hazard_output_id, imt, site_id);
+
+GRANT SELECT ON riskr.gmf_cache TO GROUP openquake;
+GRANT INSERT,UPDATE,DELETE ON riskr.gmf_cache TO oq_admin;
+GRANT SELECT,INSERT ON riskr.gmf_cache TO oq_job_init;
+GRANT ALL ON SEQUENCE riskr.gmf_cache_id_seq TO GROUP openquake;
@@ -0,0 +1,5 @@
+ALTER TABLE riski.exposure_model ADD COLUMN checksum VARCHAR;
+
+CREATE INDEX riski_exposure_model_checksum_idx ON riski.exposure_model(checksum);
+
+GRANT UPDATE ON uiapi.risk_calculation TO oq_job_init;
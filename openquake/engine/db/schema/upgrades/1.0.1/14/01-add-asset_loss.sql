@@ -0,0 +1,27 @@
+ALTER TABLE uiapi.risk_calculation ADD COLUMN asset_loss_table BOOLEAN DEFAULT false;
+
+CREATE TABLE riskr.asset_loss (
+    id SERIAL PRIMARY KEY,
+    risk_calculation_id INTEGER NOT NULL, -- FK to uiapi.risk_calculation.id
+    hazard_output_id INTEGER NOT NULL, -- FK to uiapi.output.id
+    loss_type VARCHAR NOT NULL,
+    asset_ids int[] NOT NULL,
+    rupture_ids int[] NOT NULL,
+    losses real[] NOT NULL
+) TABLESPACE riskr_ts;
+
+ALTER TABLE riskr.asset_loss
+ADD CONSTRAINT riskr_asset_loss_risk_calculation_fk
+FOREIGN KEY (risk_calculation_id) REFERENCES uiapi.risk_calculation(id)
+ON DELETE CASCADE;
+
+ALTER TABLE riskr.asset_loss
+ADD CONSTRAINT riskr_asset_loss_output_fk
+FOREIGN KEY (hazard_output_id) REFERENCES uiapi.output(id) ON DELETE CASCADE;
+
+CREATE INDEX riskr_asset_loss_idx on riskr.asset_loss(risk_calculation_id, hazard_output_id, loss_type);
+
+GRANT SELECT ON riskr.asset_loss TO GROUP openquake;
+GRANT INSERT,UPDATE,DELETE ON riskr.asset_loss TO oq_admin;
+GRANT SELECT,INSERT ON riskr.asset_loss TO oq_job_init;
+GRANT ALL ON SEQUENCE riskr.asset_loss_id_seq TO GROUP openquake;
@@ -0,0 +1,8 @@
+ALTER TABLE uiapi.risk_calculation ADD COLUMN aggregate_by VARCHAR
+    CONSTRAINT aggregate_by_value
+        CHECK(aggregate_by IS NULL OR
+              aggregate_by IN ('taxonomy', 'region'));
+
+ALTER TABLE riskr.loss_curve ADD COLUMN aggregation_group VARCHAR;
+
+ALTER TABLE riskr.aggregate_loss ADD COLUMN aggregation_group VARCHAR;
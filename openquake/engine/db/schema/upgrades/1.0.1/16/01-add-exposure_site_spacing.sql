@@ -0,0 +1,3 @@
+ALTER TABLE uiapi.hazard_calculation ADD COLUMN exposure_site_spacing float
+    CONSTRAINT exposure_site_spacing_value
+        CHECK(exposure_site_spacing IS NULL OR exposure_site_spacing > 0);
@@ -0,0 +1,2 @@
+ALTER TABLE uiapi.performance ADD COLUMN hostname VARCHAR;
+ALTER TABLE uiapi.performance ADD COLUMN pid INTEGER;
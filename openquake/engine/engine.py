@@ -17,7 +17,6 @@
 calculations."""
 
 import ConfigParser
-import csv
 import getpass
 import os
 import sys
@@ -33,6 +32,7 @@ import openquake.engine
 
 from django.core import exceptions
 from django import db as django_db
+from django.db.models import Q
 from lxml import etree
 
 from openquake.engine import logs
@@ -41,6 +41,8 @@ from openquake.engine.job.validation import validate
 from openquake.engine.utils import (
     config, monitor, get_calculator_class, general)
 from openquake.engine.writer import CacheInserter
+from openquake.engine.performance import (
+    EnginePerformanceMonitor, JOB_PHASE_PREFIX)
 from openquake.engine.settings import DATABASES
 from openquake.engine.db.models import JobStats
 from openquake.engine.db.models import OqJob
@@ -282,13 +284,14 @@ def parse_config(source):
     for sect in cp.sections():
         for key, value in cp.items(sect):
             if key == 'sites_csv':
-                # Parse site coordinates from the csv file,
-                # return as MULTIPOINT WKT:
+                # the site coordinates are read from the csv file in
+                # chunks and stored directly in the hazard_site table
+                # (see HazardCalculation.points_to_compute)
                 path = value
                 if not os.path.isabs(path):
                     # It's a relative path
                     path = os.path.join(base_path, path)
-                params['sites'] = _parse_sites_csv(open(path, 'r'))
+                params['inputs']['sites'] = path
             elif key.endswith('_file'):
                 input_type = key[:-5]
                 if not input_type in INPUT_TYPES:
@@ -319,25 +322,6 @@ def parse_config(source):
     return params
 
 
-def _parse_sites_csv(fh):
-    """
-    Get sites of interest from a csv file. The csv file (``fh``) is expected to
-    have 2 columns: lon,lat.
-
-    :param fh:
-        File-like containing lon,lat coordinates in csv format.
-
-    :returns:
-        MULTIPOINT WKT representing all of the sites in the csv file.
-    """
-    reader = csv.reader(fh)
-    coords = []
-    for lon, lat in reader:
-        coords.append('%s %s' % (lon, lat))
-
-    return 'MULTIPOINT(%s)' % ', '.join(coords)
-
-
 def create_calculation(model, params):
     """
     Given a params `dict` parsed from the config file, create a
@@ -482,6 +466,10 @@ def _switch_to_job_phase(job, ctype, status):
     job.status = status
     job.save()
     logs.LOG.progress("%s (%s)", status, ctype)
+    # record the time of the transition, used by the timeline trace
+    with EnginePerformanceMonitor(
+            JOB_PHASE_PREFIX + status, job.id, flush=True):
+        pass
     if status == "executing" and not openquake.engine.no_distribute():
         # Record the compute nodes that were available at the beginning of the
         # execute phase so we can detect failed nodes later.
@@ -597,6 +585,15 @@ def del_risk_calc(rc_id):
                            'ID=%s does not exist' % rc_id)
 
     if rc.oqjob.user_name == getpass.getuser():
+        # check for other risk calculations reusing the exposure model
+        # stored by this one
+        assoc_calcs = models.RiskCalculation.objects.filter(
+            preloaded_exposure_model__job=rc.oqjob).exclude(id=rc.id)
+        if assoc_calcs.count() > 0:
+            raise RuntimeError(
+                UNABLE_TO_DEL_RC_FMT % 'The exposure model is used by the '
+                'following risk calculations: %s' % ', '.join(
+                    [str(x.id) for x in assoc_calcs]))
         # we are allowed to delete this
         rc.delete(using='admin')
     else:
@@ -605,6 +602,61 @@ def del_risk_calc(rc_id):
                            'Access denied')
 
 
+def prune_exposures():
+    """
+    Delete the stored exposure models which are duplicates of a more
+    recent exposure model with the same checksum. The risk calculations
+    using a deleted exposure model are moved to the most recent one,
+    which has the same content. Exposure models still referenced by
+    some outputs (e.g. damage distributions per asset), belonging to
+    a running job, used by the risk calculation of a running job or
+    used by risk calculations which stored asset ids (in
+    riskr.asset_site or riskr.asset_loss) are kept, since the ids of
+    the assets of the most recent copy are different.
+
+    :returns: the ids of the deleted exposure models
+    """
+    deleted = []
+    cursor = models.getcursor('admin')
+    checksums = models.ExposureModel.objects.filter(
+        checksum__isnull=False).values_list(
+        'checksum', flat=True).distinct()
+    for checksum in checksums:
+        exposure_models = list(models.ExposureModel.objects.filter(
+            checksum=checksum).order_by('-id'))
+        latest = exposure_models[0]
+        for exposure_model in exposure_models[1:]:
+            if models.OqJob.objects.filter(
+                    id=exposure_model.job_id, is_running=True).exists():
+                continue
+            risk_calculations = models.RiskCalculation.objects.using(
+                'admin').filter(Q(preloaded_exposure_model=exposure_model) |
+                                Q(oqjob__id=exposure_model.job_id))
+            rc_ids = list(risk_calculations.values_list('id', flat=True))
+            # a running job reusing the exposure model may be processing
+            # its assets, even if it did not store their ids
+            if models.OqJob.objects.filter(
+                    risk_calculation__in=rc_ids, is_running=True).exists():
+                continue
+            if (models.AssetSite.objects.filter(
+                    risk_calculation__in=rc_ids).exists() or
+                    models.AssetLoss.objects.filter(
+                        risk_calculation__in=rc_ids).exists()):
+                continue
+            try:
+                with django_db.transaction.commit_on_success(using='admin'):
+                    risk_calculations.update(preloaded_exposure_model=latest)
+                    # the assets, costs and occupancies are deleted by
+                    # the database with a cascade
+                    cursor.execute(
+                        'DELETE FROM riski.exposure_model WHERE id = %s',
+                        [exposure_model.id])
+            except django_db.IntegrityError:
+                continue
+            deleted.append(exposure_model.id)
+    return deleted
+
+
 def run_hazard(cfg_file, log_level, log_file, exports):
     """
     Run a hazard calculation using the specified config file and other options.
@@ -20,22 +20,209 @@
 Serializer and related functions to save exposure data to the database.
 """
 
-from openquake.engine.db import models
+import os
+import csv
+import hashlib
+import collections
+
 from django.db import router
 from django.db import transaction
+from django.contrib.gis.geos.point import Point
+
+from openquake.nrmllib.risk import parsers
+
+from openquake.engine.db import models
+from openquake.engine.writer import CacheInserter
+
+
+# the records produced by ExposureCSVParser; they have the same
+# attributes of the ones produced by the NRML ExposureModelParser
+ExposureMetadata = collections.namedtuple(
+    'ExposureMetadata',
+    'exposure_id taxonomy_source asset_category description conversions')
+Conversions = collections.namedtuple(
+    'Conversions',
+    'cost_types area_type area_unit deductible_is_absolute '
+    'insurance_limit_is_absolute')
+CostType = collections.namedtuple(
+    'CostType',
+    'name conversion_type unit retrofitted_type retrofitted_unit')
+Site = collections.namedtuple('Site', 'longitude latitude')
+Cost = collections.namedtuple(
+    'Cost', 'cost_type value retrofitted deductible limit')
+OccupancyData = collections.namedtuple('OccupancyData', 'occupants period')
+AssetData = collections.namedtuple(
+    'AssetData',
+    'exposure_metadata site asset_ref taxonomy area number costs occupancy')
+
+
+def exposure_parser(path):
+    """
+    :param path: the pathname of an exposure file
+    :returns:
+        an :class:`ExposureCSVParser` if the file has the .csv
+        extension, otherwise a NRML
+        :class:`openquake.nrmllib.risk.parsers.ExposureModelParser`
+    """
+    if os.path.splitext(path)[1].lower() == '.csv':
+        return ExposureCSVParser(path)
+    return parsers.ExposureModelParser(path)
+
+
+def checksum(path):
+    """
+    :param path: the pathname of a file
+    :returns: the SHA1 hex digest of the content of the file
+    """
+    sha1 = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), ''):
+            sha1.update(chunk)
+    return sha1.hexdigest()
+
+
+def _float(value):
+    """
+    Convert a CSV field into a float; an empty field means None
+    """
+    return float(value) if value.strip() else None
+
+
+class ExposureCSVParser(object):
+    """
+    Parser for exposure models in CSV format, which is much faster to
+    read than NRML for big portfolios. The metadata are given in the
+    comment lines at the top of the file, in the form `# name = value`;
+    the cost types are given one per line, as `# cost_type = name
+    conversion unit [retrofitted_conversion retrofitted_unit]`.
+    Then there is a header and one row per asset, i.e.::
+
+        # exposure_id = ep
+        # category = buildings
+        # description = Exposure model for buildings
+        # area_type = per_asset
+        # area_unit = square meters
+        # cost_type = structural per_area EUR
+        asset_ref,lon,lat,taxonomy,number,area,structural,occupants_day
+        a0,81.2985,29.1098,RM,3,10,100,5
+
+    For each cost type `name` the column `name` holds the cost and the
+    optional columns `retrofitted_name`, `deductible_name` and
+    `insurance_limit_name` hold the other values. The columns
+    `occupants_period` hold the occupants for each period. Empty
+    fields are read as missing values.
+
+    :param source: the pathname of the file or a file-like object
+    """
+
+    METADATA = dict(exposure_id=None, taxonomy_source=None,
+                    category=None, description=None,
+                    area_type=None, area_unit=None,
+                    deductible_is_absolute='true',
+                    insurance_limit_is_absolute='true')
+
+    def __init__(self, source):
+        self.source = source
+
+    def __iter__(self):
+        if hasattr(self.source, 'read'):
+            return self._parse(self.source)
+        return self._parse_file()
+
+    def _parse_file(self):
+        with open(self.source) as f:
+            for asset_data in self._parse(f):
+                yield asset_data
+
+    def _parse(self, f):
+        metadata = dict(self.METADATA)
+        cost_types = []
+        for line in f:
+            if not line.startswith('#'):
+                break
+            name, _, value = line[1:].partition('=')
+            name, value = name.strip(), value.strip()
+            if name == 'cost_type':
+                fields = value.split()
+                cost_types.append(CostType(*(fields + [None] * (
+                    len(CostType._fields) - len(fields)))))
+            elif name in metadata:
+                metadata[name] = value
+            elif name:
+                raise ValueError(
+                    'Invalid metadata %r in the exposure file' % name)
+        else:  # no header
+            return
+
+        exposure_metadata = ExposureMetadata(
+            metadata['exposure_id'], metadata['taxonomy_source'],
+            metadata['category'], metadata['description'],
+            Conversions(
+                cost_types, metadata['area_type'], metadata['area_unit'],
+                metadata['deductible_is_absolute'].lower() == 'true',
+                metadata['insurance_limit_is_absolute'].lower() == 'true'))
+
+        header = next(csv.reader([line]))
+        idx = dict((name.strip(), i) for i, name in enumerate(header))
+        for name in ('asset_ref', 'lon', 'lat', 'taxonomy'):
+            if name not in idx:
+                raise ValueError(
+                    'Missing column %s in the exposure file' % name)
+
+        # the indices of the columns of the costs and occupancies,
+        # computed once
+        cost_cols = [
+            (ct.name, idx.get(ct.name), idx.get('retrofitted_' + ct.name),
+             idx.get('deductible_' + ct.name),
+             idx.get('insurance_limit_' + ct.name))
+            for ct in cost_types]
+        occupancy_cols = [(name[len('occupants_'):], i)
+                          for i, name in enumerate(header)
+                          if name.startswith('occupants_')]
+        number_col = idx.get('number')
+        area_col = idx.get('area')
+
+        def get(row, i):
+            return None if i is None else _float(row[i])
+
+        for row in csv.reader(f):
+            if not row:
+                continue
+            costs = [
+                Cost(name, _float(row[value]), get(row, retrofitted),
+                     get(row, deductible), get(row, limit))
+                for name, value, retrofitted, deductible, limit in cost_cols
+                if value is not None and row[value].strip()]
+            occupancy = [OccupancyData(_float(row[i]), period)
+                         for period, i in occupancy_cols if row[i].strip()]
+            yield AssetData(
+                exposure_metadata,
+                Site(float(row[idx['lon']]), float(row[idx['lat']])),
+                row[idx['asset_ref']], row[idx['taxonomy']],
+                get(row, area_col), get(row, number_col), costs, occupancy)
 
 
 class ExposureDBWriter(object):
     """
-    Serialize the exposure model to database
+    Serialize the exposure model to database. The assets are streamed
+    from the parser and saved in blocks, with a COPY FROM for each of
+    the tables exposure_data, cost and occupancy, so that the memory
+    occupation is bounded by the block size.
 
     :attr job:
         an instance of :class:`openquake.engine.db.models.OqJob`
+    :attr checksum:
+        the checksum of the exposure file, stored in the exposure model
+        to reuse it in other calculations (None if not given)
     """
 
-    def __init__(self, job):
+    #: the number of assets saved with a single COPY FROM
+    BLOCK_SIZE = 10000
+
+    def __init__(self, job, checksum=None):
         """Create a new serializer"""
         self.job = job
+        self.checksum = checksum
         self.model = None
         self.cost_types = {}
 
@@ -45,11 +232,17 @@ class ExposureDBWriter(object):
         Serialize a list of values produced by iterating over an instance of
         :class:`openquake.nrmllib.risk.parsers.ExposureParser`
         """
+        block = []
         for asset_data in iterator:
             if not self.model:
                 self.model, self.cost_types = (
                     self.insert_model(asset_data.exposure_metadata))
-            self.insert_datum(asset_data)
+            block.append(asset_data)
+            if len(block) == self.BLOCK_SIZE:
+                self.insert_data(block)
+                block = []
+        if block:
+            self.insert_data(block)
         return self.model
 
     def insert_model(self, model):
@@ -75,7 +268,8 @@ class ExposureDBWriter(object):
             area_unit=model.conversions.area_unit,
             deductible_absolute=model.conversions.deductible_is_absolute,
             insurance_limit_absolute=(
-                model.conversions.insurance_limit_is_absolute))
+                model.conversions.insurance_limit_is_absolute),
+            checksum=self.checksum)
 
         cost_types = {}
         for cost_type in model.conversions.cost_types:
@@ -89,6 +283,31 @@ class ExposureDBWriter(object):
 
         return exposure_model, cost_types
 
+    def insert_data(self, block):
+        """
+        Insert a block of asset entries, together with their costs
+        and occupancies.
+
+        :param block:
+            a list of instances of
+            :class:`openquake.nrmllib.risk.parsers.AssetData`
+        """
+        assets = [self.make_asset(asset_data) for asset_data in block]
+        # the ids of the assets are needed by the costs and occupancies
+        CacheInserter(models.ExposureData, len(assets)).copy(assets)
+
+        costs = []
+        occupancies = []
+        for asset, asset_data in zip(assets, block):
+            costs.extend(self.make_costs(asset, asset_data))
+            occupancies.extend(
+                models.Occupancy(exposure_data_id=asset.id,
+                                 occupants=odata.occupants,
+                                 period=odata.period)
+                for odata in asset_data.occupancy)
+        CacheInserter(models.Cost, len(costs)).copy(costs)
+        CacheInserter(models.Occupancy, len(occupancies)).copy(occupancies)
+
     def insert_datum(self, asset_data):
         """
         Insert a single asset entry.
@@ -96,14 +315,23 @@ class ExposureDBWriter(object):
         :param asset_data:
             an instance of :class:`openquake.nrmllib.risk.parsers.AssetData`
         """
-        asset = models.ExposureData.objects.create(
+        self.insert_data([asset_data])
+
+    def make_asset(self, asset_data):
+        """
+        :param asset_data:
+            an instance of :class:`openquake.nrmllib.risk.parsers.AssetData`
+        :returns:
+            an unsaved instance of
+            :class:`openquake.engine.db.models.ExposureData`
+        """
+        asset = models.ExposureData(
             exposure_model=self.model,
             asset_ref=asset_data.asset_ref,
             taxonomy=asset_data.taxonomy,
             area=asset_data.area,
             number_of_units=asset_data.number,
-            site="POINT(%s %s)" % (asset_data.site.longitude,
-                                   asset_data.site.latitude))
+            site=Point(asset_data.site.longitude, asset_data.site.latitude))
 
         for cost_type in self.cost_types:
             if not any([cost_type == cost.cost_type
@@ -111,12 +339,26 @@ class ExposureDBWriter(object):
                 raise ValueError("Invalid Exposure. "
                                  "Missing cost %s for asset %s" % (
                                      cost_type, asset.asset_ref))
+        return asset
 
+    def make_costs(self, asset, asset_data):
+        """
+        :param asset:
+            a saved instance of
+            :class:`openquake.engine.db.models.ExposureData`
+        :param asset_data:
+            an instance of :class:`openquake.nrmllib.risk.parsers.AssetData`
+        :returns:
+            a list of unsaved instances of
+            :class:`openquake.engine.db.models.Cost`, with the costs
+            converted to per-asset values
+        """
         model = asset_data.exposure_metadata
         deductible_is_absolute = model.conversions.deductible_is_absolute
         insurance_limit_is_absolute = (
             model.conversions.insurance_limit_is_absolute)
 
+        costs = []
         for cost in asset_data.costs:
             cost_type = self.cost_types.get(cost.cost_type, None)
 
@@ -141,8 +383,8 @@ class ExposureDBWriter(object):
                 asset_data.number,
                 model.asset_category)
 
-            models.Cost.objects.create(
-                exposure_data=asset,
+            costs.append(models.Cost(
+                exposure_data_id=asset.id,
                 cost_type=cost_type,
                 converted_cost=converted_cost,
                 converted_retrofitted_cost=retrofitted,
@@ -153,9 +395,5 @@ class ExposureDBWriter(object):
                 insurance_limit_absolute=models.make_absolute(
                     cost.limit,
                     converted_cost,
-                    insurance_limit_is_absolute))
-
-        for odata in asset_data.occupancy:
-            models.Occupancy.objects.create(exposure_data=asset,
-                                            occupants=odata.occupants,
-                                            period=odata.period)
+                    insurance_limit_is_absolute)))
+        return costs
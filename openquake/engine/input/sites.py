@@ -0,0 +1,54 @@
+# -*- coding: utf-8 -*-
+# vim: tabstop=4 shiftwidth=4 softtabstop=4
+
+# Copyright (c) 2010-2013, GEM Foundation.
+#
+# OpenQuake is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# OpenQuake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with OpenQuake.  If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Streaming reader of the site files given with the `sites_csv` parameter
+of a hazard calculation.
+"""
+
+import itertools
+
+import numpy
+
+#: The number of sites read (and stored) at once
+CHUNK_SIZE = 100000
+
+
+def read_sites_csv(path, chunk_size=CHUNK_SIZE):
+    """
+    Read a CSV file with two columns lon,lat in chunks, so that large
+    site files never need to be held in memory as text.
+
+    :param str path: the path to the CSV file
+    :param int chunk_size: the maximum number of lines per chunk
+    :returns: an iterator over pairs of arrays (lons, lats)
+    :raises: `ValueError` if a line does not contain two numbers
+    """
+    with open(path) as sites_file:
+        while True:
+            lines = list(itertools.islice(sites_file, chunk_size))
+            if not lines:
+                break
+            lines = [line for line in lines if line.strip()]
+            if not lines:
+                continue
+            coords = numpy.loadtxt(lines, delimiter=',', ndmin=2)
+            if coords.shape[1] != 2:
+                raise ValueError('Expected two columns lon,lat in %s, got %d'
+                                 % (path, coords.shape[1]))
+            yield coords[:, 0], coords[:, 1]
@@ -20,10 +20,13 @@ profile validation.
 import re
 import warnings
 
+import numpy
+
 from django.forms import ModelForm
 
 import openquake.hazardlib
 from openquake.engine.db import models
+from openquake.engine.input.sites import read_sites_csv
 from openquake.engine.utils import get_calculator_class
 
 
@@ -241,14 +244,17 @@ class BaseHazardModelForm(BaseOQModelForm):
         hc = self.instance
         # Now do checks which require more context.
 
+        # the sites can be given inline or with a `sites_csv` file
+        has_sites = hc.sites is not None or 'sites' in self.files
+
         # Cannot specify region AND sites
-        if (hc.region is not None and hc.sites is not None):
+        if (hc.region is not None and has_sites):
             all_valid = False
             err = 'Cannot specify `region` and `sites`. Choose one.'
             self._add_error('region', err)
         # At least one must be specified (region OR sites)
         elif not (hc.region is not None or
-                  hc.sites is not None or 'exposure' in self.files):
+                  has_sites or 'exposure' in self.files):
             all_valid = False
             err = 'Must specify either `region`, `sites` or `exposure_file`.'
             self._add_error('region', err)
@@ -274,6 +280,10 @@ class BaseHazardModelForm(BaseOQModelForm):
             valid, errs = sites_is_valid(hc)
             all_valid &= valid
             self._add_error('sites', errs)
+        elif 'sites' in self.files:
+            valid, errs = sites_csv_is_valid(hc)
+            all_valid &= valid
+            self._add_error('sites', errs)
 
         if 'site_model' not in self.files:
             # make sure the reference parameters are defined and valid
@@ -301,6 +311,7 @@ class ClassicalHazardForm(BaseHazardModelForm):
             'description',
             'region',
             'region_grid_spacing',
+            'exposure_site_spacing',
             'sites',
             'random_seed',
             'intensity_measure_types_and_levels',
@@ -351,6 +362,7 @@ class EventBasedHazardForm(BaseHazardModelForm):
             'description',
             'region',
             'region_grid_spacing',
+            'exposure_site_spacing',
             'sites',
             'random_seed',
             'number_of_logic_tree_samples',
@@ -454,6 +466,7 @@ class DisaggHazardForm(BaseHazardModelForm):
             'description',
             'region',
             'region_grid_spacing',
+            'exposure_site_spacing',
             'sites',
             'random_seed',
             'intensity_measure_types_and_levels',
@@ -502,6 +515,7 @@ class ScenarioHazardForm(BaseHazardModelForm):
             'description',
             'region',
             'region_grid_spacing',
+            'exposure_site_spacing',
             'sites',
             'random_seed',
             'intensity_measure_types',
@@ -603,6 +617,8 @@ class EventBasedRiskForm(BaseOQModelForm):
             'loss_curve_resolution',
             'conditional_loss_poes',
             'insured_losses',
+            'asset_loss_table',
+            'aggregate_by',
             'master_seed',
             'asset_correlation',
             'quantile_loss_curves',
@@ -655,6 +671,7 @@ class ScenarioRiskForm(BaseOQModelForm):
             'master_seed',
             'asset_correlation',
             'insured_losses',
+            'aggregate_by',
             'time_event',
             'export_dir',
             'inputs',
@@ -720,6 +737,13 @@ def region_grid_spacing_is_valid(mdl):
     return True, []
 
 
+def exposure_site_spacing_is_valid(mdl):
+    if (mdl.exposure_site_spacing is not None and
+            not mdl.exposure_site_spacing > 0):
+        return False, ['Exposure site spacing must be > 0']
+    return True, []
+
+
 def sites_is_valid(mdl):
     valid = True
     errors = []
@@ -734,6 +758,21 @@ def sites_is_valid(mdl):
     return valid, errors
 
 
+def sites_csv_is_valid(mdl):
+    """
+    Validate the sites file of the calculation, chunk by chunk
+    """
+    errors = []
+    try:
+        for lons, lats in read_sites_csv(mdl.inputs['sites']):
+            errors = _lons_lats_are_valid(lons, lats)
+            if errors:
+                break
+    except (IOError, ValueError) as exc:
+        errors = ['Invalid sites file: %s' % exc]
+    return not errors, errors
+
+
 def sites_disagg_is_valid(mdl):
     # sites_disagg is optional in risk event based
     if mdl.calculation_mode == 'event_based' and mdl.sites_disagg is None:
@@ -760,9 +799,11 @@ def _lons_lats_are_valid(lons, lats):
     """
     errors = []
 
-    if not all([-180 <= x <= 180 for x in lons]):
+    lons = numpy.asarray(lons, dtype=float)
+    lats = numpy.asarray(lats, dtype=float)
+    if not ((lons >= -180) & (lons <= 180)).all():
         errors.append('Longitude values must in the range [-180, 180]')
-    if not all([-90 <= x <= 90 for x in lats]):
+    if not ((lats >= -90) & (lats <= 90)).all():
         errors.append('Latitude values must be in the range [-90, 90]')
 
     return errors
@@ -1124,6 +1165,17 @@ def insured_losses_is_valid(_mdl):
     return True, []
 
 
+def asset_loss_table_is_valid(_mdl):
+    # The validation form should normalize the type to a boolean.
+    return True, []
+
+
+def aggregate_by_is_valid(mdl):
+    if mdl.aggregate_by == 'region' and 'regions' not in (mdl.inputs or {}):
+        return False, ['Aggregation by region requires a regions file']
+    return True, []
+
+
 def loss_curve_resolution_is_valid(mdl):
     if mdl.calculation_mode == 'event_based':
         if (mdl.loss_curve_resolution is not None and
@@ -1,5 +1,6 @@
 import os
 import time
+import socket
 import atexit
 from datetime import datetime
 import psutil
@@ -12,6 +13,11 @@ from openquake.engine.db import models
 from openquake.engine.writer import CacheInserter
 
 
+#: The prefix of the operations recording the transitions between the
+#: phases of a job (pre_executing, executing, ...)
+JOB_PHASE_PREFIX = 'job phase: '
+
+
 # this is not thread-safe
 class PerformanceMonitor(object):
     """
@@ -101,6 +107,7 @@ class EnginePerformanceMonitor(PerformanceMonitor):
     cache = CacheInserter(models.Performance, 1000)  # store at most 1k objects
     pgpid = None
     pypid = None
+    hostname = socket.gethostname()
 
     @classmethod
     def store_task_id(cls, job_id, task):
@@ -185,7 +192,9 @@ class EnginePerformanceMonitor(PerformanceMonitor):
                 start_time=self.start_time,
                 duration=self.duration,
                 pymemory=pymemory,
-                pgmemory=pgmemory)
+                pgmemory=pgmemory,
+                hostname=self.hostname,
+                pid=os.getpid())
             self.cache.add(perf)
             if self.flush:
                 self.cache.flush()
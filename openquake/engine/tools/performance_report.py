@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2013, GEM Foundation.
+#
+# OpenQuake is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# OpenQuake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with OpenQuake.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Build a report of the performance of a job from the rows stored by
+:class:`openquake.engine.performance.EnginePerformanceMonitor` in the
+uiapi.performance table, and display it in text, CSV or JSON format.
+
+The report has four sections:
+
+ * `phases`: the phases of the job (pre_executing, executing, ...), in
+   order of execution; a phase lasts from the row marking the change of
+   status of the job to the next one, the last phase up to the end of
+   the last recorded operation
+ * `controller`: the other operations of the controller node (the rows
+   without a task), in order of execution
+ * `operations`: the time and memory statistics of each operation,
+   grouped by task type
+ * `slowest_tasks`: the tasks with the largest total duration
+"""
+
+import sys
+import csv
+import json
+import datetime
+import collections
+
+import numpy
+
+from openquake.engine.db import models
+from openquake.engine.performance import JOB_PHASE_PREFIX
+
+#: The columns of the rows of the report
+COLUMNS = ['section', 'task', 'task_id', 'operation', 'count', 'total_time',
+           'mean_time', 'p50_time', 'p90_time', 'p99_time', 'max_time',
+           'max_pymemory', 'max_pgmemory']
+
+#: The supported output formats
+FORMATS = ('text', 'csv', 'json')
+
+PerformanceRow = collections.namedtuple(
+    'PerformanceRow',
+    'task task_id operation duration pymemory pgmemory start_time')
+
+
+def read_performance(job_id):
+    """
+    :returns:
+        the list of :class:`PerformanceRow` of the given job, in order of
+        start time
+    """
+    rows = models.Performance.objects.filter(oq_job=job_id).order_by(
+        'start_time', 'id').values_list(*PerformanceRow._fields)
+    return [PerformanceRow(*row) for row in rows.iterator()]
+
+
+def _max(values):
+    values = [v for v in values if v is not None]
+    return max(values) if values else None
+
+
+def _stats(section, task, task_id, operation, rows):
+    # NB: the dtype is needed when all the durations are None, otherwise
+    # the statistics would be numpy integers, which are not serializable
+    durations = numpy.array([r.duration or 0 for r in rows], dtype=float)
+    p50, p90, p99 = numpy.percentile(durations, [50, 90, 99])
+    return collections.OrderedDict(zip(COLUMNS, [
+        section, task, task_id, operation, len(rows),
+        durations.sum(), durations.mean(), p50, p90, p99, durations.max(),
+        _max(r.pymemory for r in rows), _max(r.pgmemory for r in rows)]))
+
+
+def _phases(rows):
+    """
+    :param rows: a list of :class:`PerformanceRow` in order of start time
+    :returns:
+        a list of :class:`PerformanceRow`, one per phase of the job, with
+        the duration computed from the rows marking the changes of status
+        of the job (see
+        :data:`openquake.engine.performance.JOB_PHASE_PREFIX`)
+    """
+    markers = [row for row in rows if row.task_id is None
+               and row.operation.startswith(JOB_PHASE_PREFIX)]
+    if not markers:
+        return []
+    end = max(row.start_time + datetime.timedelta(seconds=row.duration or 0)
+              for row in rows)
+    phases = []
+    for marker, next_marker in zip(markers, markers[1:] + [None]):
+        stop = end if next_marker is None else next_marker.start_time
+        phases.append(marker._replace(
+            operation=marker.operation[len(JOB_PHASE_PREFIX):],
+            duration=max((stop - marker.start_time).total_seconds(), 0),
+            pymemory=None, pgmemory=None))
+    return phases
+
+
+def performance_report(rows, slowest=10):
+    """
+    :param rows: a list of :class:`PerformanceRow` instances
+    :param int slowest: the number of slowest tasks to report
+    :returns:
+        a dictionary section -> list of rows, each row being an ordered
+        dictionary with keys :data:`COLUMNS`
+    """
+    phases = [_stats('phases', None, None, row.operation, [row])
+              for row in _phases(rows)]
+    controller = [_stats('controller', None, None, row.operation, [row])
+                  for row in rows if row.task_id is None
+                  and not row.operation.startswith(JOB_PHASE_PREFIX)]
+
+    groups = collections.OrderedDict()
+    for row in rows:
+        if row.task_id is not None:
+            groups.setdefault((row.task, row.operation), []).append(row)
+    operations = [_stats('operations', task, None, operation, group)
+                  for (task, operation), group in sorted(groups.items())]
+
+    totals = [row for row in rows if row.task_id is not None
+              and row.operation == 'total %s' % row.task]
+    totals.sort(key=lambda row: row.duration, reverse=True)
+    slowest_tasks = [
+        _stats('slowest_tasks', row.task, row.task_id, row.operation, [row])
+        for row in totals[:slowest]]
+
+    return collections.OrderedDict([
+        ('phases', phases),
+        ('controller', controller),
+        ('operations', operations),
+        ('slowest_tasks', slowest_tasks)])
+
+
+def _fmt(value):
+    if value is None:
+        return ''
+    elif isinstance(value, float):
+        return '%.3f' % value
+    return str(value)
+
+
+def write_text(report, out):
+    """
+    Write the report as a set of text tables, one per section
+    """
+    for section, rows in report.iteritems():
+        out.write('%s\n' % section.replace('_', ' ').upper())
+        if not rows:
+            out.write('(none)\n\n')
+            continue
+        columns = [col for col in COLUMNS[1:]
+                   if any(row[col] is not None for row in rows)]
+        lines = [columns] + [[_fmt(row[col]) for col in columns]
+                             for row in rows]
+        widths = [max(len(line[i]) for line in lines)
+                  for i in range(len(columns))]
+        for line in lines:
+            out.write('  '.join(
+                cell.ljust(width) for cell, width in zip(line, widths)
+            ).rstrip() + '\n')
+        out.write('\n')
+
+
+def write_csv(report, out):
+    """
+    Write the report as a single CSV table, with a column `section`
+    """
+    writer = csv.writer(out)
+    writer.writerow(COLUMNS)
+    for rows in report.itervalues():
+        for row in rows:
+            writer.writerow([_fmt(row[col]) for col in COLUMNS])
+
+
+def write_json(report, out):
+    """
+    Write the report in JSON format
+    """
+    json.dump(report, out, indent=2)
+    out.write('\n')
+
+
+def main(job_id, fmt='text', slowest=10, out=None):
+    """
+    Print the performance report of the given job
+
+    :param int job_id: the ID of the job
+    :param str fmt: one of :data:`FORMATS`
+    :param int slowest: the number of slowest tasks to report
+    :param out: a file-like object (by default sys.stdout)
+    """
+    out = out or sys.stdout
+    report = performance_report(read_performance(job_id), slowest)
+    dict(text=write_text, csv=write_csv, json=write_json)[fmt](report, out)
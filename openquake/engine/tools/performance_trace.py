@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+# Copyright (c) 2013, GEM Foundation.
+#
+# OpenQuake is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# OpenQuake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with OpenQuake.  If not, see <http://www.gnu.org/licenses/>.
+
+
+"""
+Export the rows of the uiapi.performance table of a job as a timeline
+in the Chrome trace event format, which can be opened with
+chrome://tracing or with Perfetto (https://ui.perfetto.dev).
+
+Each host is displayed as a process and each process of the host as a
+thread, so that the overlap of the tasks on the workers and the idle
+gaps are visible; the nested monitors of a task are displayed as nested
+slices. The transitions between the phases of the job are displayed on
+a separate track.
+"""
+
+import json
+import collections
+
+from openquake.engine.db import models
+from openquake.engine.performance import JOB_PHASE_PREFIX
+
+TraceRow = collections.namedtuple(
+    'TraceRow',
+    'task task_id operation start_time duration pymemory pgmemory '
+    'hostname pid')
+
+#: The trace pid of the track of the job phases
+PHASES_PID = 0
+
+
+def read_trace_rows(job_id):
+    """
+    :returns:
+        the list of :class:`TraceRow` of the given job, in order of
+        start time
+    """
+    rows = models.Performance.objects.filter(oq_job=job_id).order_by(
+        'start_time', 'id').values_list(*TraceRow._fields)
+    return [TraceRow(*row) for row in rows.iterator()]
+
+
+def _metadata(name, pid, tid, value):
+    return dict(name=name, ph='M', pid=pid, tid=tid, args=dict(name=value))
+
+
+def chrome_trace(rows):
+    """
+    :param rows: a list of :class:`TraceRow` instances
+    :returns: a dictionary in the Chrome trace event format
+    """
+    if not rows:
+        return dict(traceEvents=[], displayTimeUnit='ms')
+    t0 = min(row.start_time for row in rows)
+
+    def micros(start_time):
+        delta = start_time - t0
+        return (delta.days * 86400 + delta.seconds) * 10 ** 6 + \
+            delta.microseconds
+
+    events = []
+    trace_pids = {}  # hostname -> trace pid
+    threads = set()  # (hostname, pid) of the processes
+    controller_pids = set()  # (hostname, pid) of the controller
+    phases = []
+    for row in rows:
+        if row.operation.startswith(JOB_PHASE_PREFIX):
+            phases.append(row)
+            continue
+        hostname = row.hostname or 'unknown host'
+        if hostname not in trace_pids:
+            trace_pids[hostname] = len(trace_pids) + 1
+        pid = trace_pids[hostname]
+        tid = row.pid or 0
+        threads.add((hostname, tid))
+        if row.task_id is None:
+            controller_pids.add((hostname, tid))
+        events.append(dict(
+            name=row.operation, cat=row.task or 'controller', ph='X',
+            ts=micros(row.start_time), dur=(row.duration or 0) * 10 ** 6,
+            pid=pid, tid=tid,
+            args=dict(task_id=row.task_id, pymemory=row.pymemory,
+                      pgmemory=row.pgmemory)))
+
+    # the phases last from a transition to the next one
+    for phase, next_phase in zip(phases, phases[1:] + [None]):
+        name = phase.operation[len(JOB_PHASE_PREFIX):]
+        start = micros(phase.start_time)
+        if next_phase is None:  # the last transition
+            events.append(dict(name=name, cat='phase', ph='i', s='p',
+                               ts=start, pid=PHASES_PID, tid=0))
+        else:
+            events.append(dict(name=name, cat='phase', ph='X', ts=start,
+                               dur=micros(next_phase.start_time) - start,
+                               pid=PHASES_PID, tid=0))
+
+    events.sort(key=lambda event: event['ts'])
+
+    metadata = []
+    if phases:
+        metadata.append(
+            _metadata('process_name', PHASES_PID, 0, 'job phases'))
+    for hostname, pid in sorted(trace_pids.items(), key=lambda x: x[1]):
+        metadata.append(_metadata('process_name', pid, 0, hostname))
+    for hostname, tid in sorted(threads):
+        name = 'process %d' % tid
+        if (hostname, tid) in controller_pids:
+            name = 'controller (%s)' % name
+        metadata.append(
+            _metadata('thread_name', trace_pids[hostname], tid, name))
+
+    return dict(traceEvents=metadata + events, displayTimeUnit='ms')
+
+
+def main(job_id, path):
+    """
+    Export the timeline of the given job in the file `path`
+    """
+    with open(path, 'w') as trace_file:
+        json.dump(chrome_trace(read_trace_rows(job_id)), trace_file)
@@ -24,6 +24,8 @@ import weakref
 import atexit
 from cStringIO import StringIO
 
+import numpy
+
 from django.db import transaction
 from django.db import connections
 from django.db import router
@@ -56,19 +58,32 @@ class CacheInserter(object):
         objects.
         """
         self = cls(objects[0].__class__, block_size)
+        with transaction.commit_on_success(using=self.alias):
+            return self.copy(objects)
+
+    def copy(self, objects):
+        """
+        Save a sequence of Django objects in the database by using a
+        COPY FROM, without committing the current transaction. The ids
+        of the objects are reserved from the sequence of the table and
+        set on the objects, so that they can be referenced by other
+        objects saved in the same transaction. Returns the ids.
+        """
+        if not objects:
+            return []
         curs = connections[self.alias].cursor()
         seq = self.tname.replace('"', '') + '_id_seq'
-        with transaction.commit_on_success(using=self.alias):
-            reserve_ids = "select nextval('%s') "\
-                "from generate_series(1, %d)" % (seq, len(objects))
-            curs.execute(reserve_ids)
-            ids = [i for (i,) in curs.fetchall()]
-            stringio = StringIO()
-            for i, obj in zip(ids, objects):
-                stringio.write('%d\t%s\n' % (i, self.to_line(obj)))
-            stringio.reset()
-            curs.copy_from(stringio, self.tname)
-            stringio.close()
+        reserve_ids = "select nextval('%s') "\
+            "from generate_series(1, %d)" % (seq, len(objects))
+        curs.execute(reserve_ids)
+        ids = [i for (i,) in curs.fetchall()]
+        stringio = StringIO()
+        for i, obj in zip(ids, objects):
+            obj.id = i
+            stringio.write('%d\t%s\n' % (i, self.to_line(obj)))
+        stringio.reset()
+        curs.copy_from(stringio, self.tname, columns=['id'] + self.fields)
+        stringio.close()
         return ids
 
     def __init__(self, dj_model, max_cache_size):
@@ -153,9 +168,12 @@ class CacheInserter(object):
                 col = 'SRID=4326;' + col.wkt
             elif isinstance(col, GeometryField):
                 col = col.wkt()
-            elif isinstance(col, (tuple, list)):
+            elif isinstance(col, (tuple, list, numpy.ndarray)):
                 # for numeric arrays; this is fragile
                 col = self.array_to_pgstring(col)
+            elif isinstance(col, float):
+                # repr keeps all the digits (also for numpy floats)
+                col = repr(float(col))
             else:
                 col = unicode(col).encode('utf8')
             cols.append(col)
@@ -19,6 +19,8 @@
 
 import unittest
 
+import numpy
+
 from openquake.engine import writer
 
 from openquake.engine.db.models import GmfData
@@ -82,3 +84,23 @@ class CacheInserterTestCase(unittest.TestCase):
             connection.columns,
             ['gmf_id', 'ses_id', 'imt', 'sa_period', 'sa_damping',
              'gmvs', 'rupture_ids', 'site_id'])
+
+    def test_copy(self):
+        connection = writer.connections['job_init']
+        connection.fetchall = lambda: [(10,), (11,)]
+        gmfs = [GmfData(gmf_id=1, imt='PGA', gmvs=numpy.array([0.1, 0.2]),
+                        rupture_ids=[1, 2], site_id=site_id)
+                for site_id in (1, 2)]
+        ids = CacheInserter(GmfData, 10).copy(gmfs)
+
+        # the reserved ids are set on the objects
+        self.assertEqual([10, 11], ids)
+        self.assertEqual([10, 11], [gmf.id for gmf in gmfs])
+        self.assertEqual(
+            connection.data,
+            '10\t1\t\\N\tPGA\t\\N\t\\N\t{0.1,0.2}\t{1,2}\t1\n'
+            '11\t1\t\\N\tPGA\t\\N\t\\N\t{0.1,0.2}\t{1,2}\t2\n')
+        self.assertEqual(
+            connection.columns,
+            ['id', 'gmf_id', 'ses_id', 'imt', 'sa_period', 'sa_damping',
+             'gmvs', 'rupture_ids', 'site_id'])
@@ -486,3 +486,14 @@ class UHSTestCase(unittest.TestCase):
         actual = post_proc.make_uhs(maps)
 
         self.assertEqual(expected, actual)
+
+
+class MeanStdTestCase(unittest.TestCase):
+    def test_chunks(self):
+        samples = numpy.random.RandomState(42).random_sample((5, 23, 3))
+        stats = post_processing.MeanStd(axis=1)
+        for start in range(0, 23, 7):
+            stats.update(samples[:, start:start + 7])
+        mean, std = stats.get()
+        numpy.testing.assert_allclose(samples.mean(axis=1), mean)
+        numpy.testing.assert_allclose(samples.std(axis=1, ddof=1), std)
@@ -0,0 +1,63 @@
+# Copyright (c) 2010-2013, GEM Foundation.
+#
+# OpenQuake is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# OpenQuake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with OpenQuake.  If not, see <http://www.gnu.org/licenses/>.
+
+import cPickle
+import unittest
+
+import mock
+import numpy
+
+from django.contrib.gis.geos import Point
+
+from openquake.engine.calculators.risk import asset_groups
+
+
+def make_asset(taxonomy, lon, lat, value):
+    asset = mock.Mock(taxonomy=taxonomy, site=Point(lon, lat))
+    asset.value.return_value = value
+    return asset
+
+
+class AssetGroupsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.assets = [make_asset('RC', 0.5, 0.5, 10.),
+                       make_asset('W', 1.5, 0.5, 100.),
+                       make_asset('RC', 5, 5, 1000.)]
+        self.loss_matrix = [[0.1, 0.2], [0.3, 0.], [0.5, 0.5]]
+
+    def test_invalid_key(self):
+        self.assertRaises(ValueError, asset_groups.AssetGroups, 'tag')
+        self.assertRaises(ValueError, asset_groups.AssetGroups, 'region')
+
+    def test_by_taxonomy(self):
+        groups = asset_groups.AssetGroups('taxonomy')
+        losses = groups.sum_by_group(
+            self.assets, 'structural', self.loss_matrix)
+        self.assertEqual(['RC', 'W'], sorted(losses))
+        numpy.testing.assert_allclose([501., 502.], losses['RC'])
+        numpy.testing.assert_allclose([30., 0.], losses['W'])
+
+    def test_by_region(self):
+        groups = asset_groups.AssetGroups('region', [
+            ('A', 'POLYGON((0 0, 1 0, 1 1, 0 1, 0 0))'),
+            ('B', 'POLYGON((1 0, 2 0, 2 1, 1 1, 1 0))')])
+        # the groups are sent to the tasks
+        groups = cPickle.loads(cPickle.dumps(groups))
+        losses = groups.sum_by_group(
+            self.assets, 'structural', self.loss_matrix)
+        # the third asset is outside all the regions
+        self.assertEqual(['A', 'B'], sorted(losses))
+        numpy.testing.assert_allclose([1., 2.], losses['A'])
+        numpy.testing.assert_allclose([30., 0.], losses['B'])
@@ -13,11 +13,13 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with OpenQuake.  If not, see <http://www.gnu.org/licenses/>.
 
+import itertools
 import unittest
 import mock
 
 from tests.utils import helpers
 from tests.utils.helpers import get_data_path
+from openquake.engine import engine
 from openquake.engine.calculators.risk import base
 from openquake.engine.db import models
 
@@ -59,3 +61,102 @@ class RiskCalculatorTestCase(BaseRiskCalculatorTestCase):
     def setUp(self):
         super(RiskCalculatorTestCase, self).setUp()
         self.calculator = FakeRiskCalculator(self.job)
+
+    def test_exposure_reuse(self):
+        self.calculator.pre_execute()
+        exposure_model = self.job.risk_calculation.exposure_model
+        self.assertIsNotNone(exposure_model.checksum)
+
+        # a second job on the same exposure file reuses the stored
+        # exposure model
+        job, _ = helpers.get_fake_risk_job(
+            get_data_path('classical_psha_based_risk/job.ini'),
+            get_data_path('simple_fault_demo_hazard/job.ini'))
+        models.JobStats.objects.create(oq_job=job)
+        FakeRiskCalculator(job).pre_execute()
+        self.assertEqual(exposure_model.checksum,
+                         job.risk_calculation.exposure_model.checksum)
+        self.assertIsNotNone(job.risk_calculation.preloaded_exposure_model)
+        self.assertFalse(models.ExposureModel.objects.filter(
+            job=job).exists())
+
+    def test_prune_exposures_keeps_stored_asset_ids(self):
+        self.calculator.pre_execute()
+        rc = self.job.risk_calculation
+        exposure_model = rc.exposure_model
+
+        # a more recent copy of the same exposure
+        job, _ = helpers.get_fake_risk_job(
+            get_data_path('classical_psha_based_risk/job.ini'),
+            get_data_path('simple_fault_demo_hazard/job.ini'))
+        copy = models.ExposureModel.objects.create(
+            job=job, name=exposure_model.name,
+            category=exposure_model.category,
+            taxonomy_source=exposure_model.taxonomy_source,
+            checksum=exposure_model.checksum)
+
+        # the risk calculation has stored the ids of its assets
+        asset = exposure_model.exposuredata_set.all()[0]
+        site = models.HazardSite.objects.create(
+            hazard_calculation=self.hazard_calculation,
+            location=asset.site)
+        models.AssetSite.objects.create(
+            risk_calculation=rc, asset=asset, site=site)
+        self.assertNotIn(exposure_model.id, engine.prune_exposures())
+        self.assertTrue(models.ExposureModel.objects.filter(
+            id=exposure_model.id).exists())
+
+        models.AssetSite.objects.filter(risk_calculation=rc).delete()
+        self.assertIn(exposure_model.id, engine.prune_exposures())
+        self.assertEqual(copy, models.RiskCalculation.objects.get(
+            id=rc.id).preloaded_exposure_model)
+
+    def test_prune_exposures_keeps_running_jobs(self):
+        self.calculator.pre_execute()
+        exposure_model = self.job.risk_calculation.exposure_model
+        self.job.is_running = False
+        self.job.save()
+
+        # a running job reusing the exposure model, without storing
+        # the ids of the assets (as the classical calculators do)
+        job, _ = helpers.get_fake_risk_job(
+            get_data_path('classical_psha_based_risk/job.ini'),
+            get_data_path('simple_fault_demo_hazard/job.ini'))
+        job.risk_calculation.preloaded_exposure_model = exposure_model
+        job.risk_calculation.save()
+        job.is_running = True
+        job.save()
+
+        # a more recent copy of the same exposure
+        models.ExposureModel.objects.create(
+            job=job, name=exposure_model.name,
+            category=exposure_model.category,
+            taxonomy_source=exposure_model.taxonomy_source,
+            checksum=exposure_model.checksum)
+
+        self.assertNotIn(exposure_model.id, engine.prune_exposures())
+        self.assertEqual(exposure_model, models.RiskCalculation.objects.get(
+            id=job.risk_calculation.id).preloaded_exposure_model)
+
+        job.is_running = False
+        job.save()
+        self.assertIn(exposure_model.id, engine.prune_exposures())
+
+
+class RealizationSlicesTestCase(unittest.TestCase):
+    def test_slices(self):
+        with mock.patch('openquake.engine.utils.config.get') as get:
+            get.return_value = '4'
+            self.assertEqual(
+                [slice(0, 4), slice(4, 8), slice(8, 12)],
+                list(itertools.islice(base.realization_slices(), 3)))
+            get.return_value = '0'
+            self.assertEqual([slice(0, None)],
+                             list(base.realization_slices()))
+
+    def test_is_last_chunk(self):
+        self.assertFalse(base.is_last_chunk(slice(4, 8), 4))
+        self.assertTrue(base.is_last_chunk(slice(8, 12), 2))
+        self.assertTrue(base.is_last_chunk(slice(8, 12), 0))
+        self.assertTrue(base.is_last_chunk(slice(0, None), 10))
+
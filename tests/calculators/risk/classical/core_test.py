@@ -13,6 +13,10 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with OpenQuake.  If not, see <http://www.gnu.org/licenses/>.
 
+import unittest
+import cPickle as pickle
+
+import numpy
 
 from tests.utils import helpers
 from tests.calculators.risk import base_test
@@ -78,3 +82,32 @@ class ClassicalRiskCalculatorTestCase(base_test.BaseRiskCalculatorTestCase):
 
         files = self.calculator.export(exports=['xml'])
         self.assertEqual(4, len(files))
+
+
+def double_curves(hazard_curves):
+    double_curves.calls.append(len(hazard_curves))
+    return [[[iml for iml, _poe in curve], [2 * poe for _iml, poe in curve]]
+            for curve in hazard_curves]
+
+
+class DistinctLossCurvesTestCase(unittest.TestCase):
+    def setUp(self):
+        double_curves.calls = []
+        self.curves = classical.DistinctLossCurves(double_curves)
+
+    def test_curves_computed_once_per_site(self):
+        curve1 = zip([0.1, 0.2], [0.3, 0.1])
+        curve2 = zip([0.1, 0.2], [0.4, 0.2])
+        loss_curves = self.curves([curve1, curve2, list(curve1), curve2])
+        self.assertEqual([2], double_curves.calls)
+        numpy.testing.assert_allclose(
+            [[[0.1, 0.2], [0.6, 0.2]], [[0.1, 0.2], [0.8, 0.4]],
+             [[0.1, 0.2], [0.6, 0.2]], [[0.1, 0.2], [0.8, 0.4]]],
+            loss_curves)
+
+    def test_no_curves(self):
+        self.assertEqual([], self.curves([]))
+
+    def test_is_pickleable(self):
+        curves = pickle.loads(pickle.dumps(self.curves))
+        self.assertIs(double_curves, curves.calculator)
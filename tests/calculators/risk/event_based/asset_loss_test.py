@@ -0,0 +1,77 @@
+# Copyright (c) 2010-2013, GEM Foundation.
+#
+# OpenQuake is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# OpenQuake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with OpenQuake.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+
+import mock
+import numpy
+
+from openquake.risklib import scientific
+
+from openquake.engine.calculators.risk.event_based import asset_loss
+
+
+class AssetLossTestCase(unittest.TestCase):
+    def test_sparse_losses(self):
+        assets = [mock.Mock(id=1), mock.Mock(id=2)]
+        assets[0].value.return_value = 10.
+        assets[1].value.return_value = 100.
+        asset_ids, rupture_ids, losses = asset_loss.sparse_losses(
+            assets, 'structural', [[0., 0.1, 0.], [0.5, 0., 0.2]],
+            [11, 12, 13])
+        self.assertEqual([1, 2, 2], asset_ids.tolist())
+        self.assertEqual([12, 11, 13], rupture_ids.tolist())
+        self.assertEqual(numpy.float32, losses.dtype)
+        numpy.testing.assert_allclose([1., 50., 20.], losses)
+
+    def test_sum_by_rupture(self):
+        rupture_ids, losses = asset_loss.sum_by_rupture(
+            numpy.array([13, 11, 13]), numpy.array([1., 2., 3.]))
+        self.assertEqual([11, 13], rupture_ids.tolist())
+        self.assertEqual([2., 4.], losses.tolist())
+
+    @mock.patch('openquake.engine.db.models.ExposureData.objects')
+    def test_select_assets_by_region(self, objects):
+        rc = mock.Mock()
+        queryset = objects.filter.return_value
+        queryset.filter.return_value.values_list.return_value = [3, 1]
+        asset_ids = asset_loss.select_assets(
+            rc, region='POLYGON((0 0, 1 0, 1 1, 0 1, 0 0))')
+        # the assets are selected with a lookup supported by geography
+        # fields
+        queryset.filter.assert_called_once_with(
+            site__coveredby='POLYGON((0 0, 1 0, 1 1, 0 1, 0 0))')
+        self.assertEqual([1, 3], asset_ids.tolist())
+
+    def test_aggregate_loss_curves_without_zero_losses(self):
+        rc = mock.Mock(id=1, investigation_time=50, loss_curve_resolution=5)
+        hc = rc.get_hazard_calculation.return_value
+        hc.ses_per_logic_tree_path = 10
+        hc.investigation_time = 50
+        rc.hazard_outputs.return_value = [mock.Mock(id=2)]
+        losses = numpy.array([1., 4., 2.])
+        with mock.patch.object(asset_loss, 'aggregate_losses',
+                               return_value=([11, 12, 14], losses)):
+            [curve] = asset_loss.aggregate_loss_curves(rc, 'structural')
+
+        # the curve is the same computed by the calculator, which also
+        # counts the ruptures with zero loss...
+        expected_losses, expected_poes = scientific.event_based(
+            numpy.array([1., 4., 0., 2.]), tses=500, time_span=50,
+            curve_resolution=5)
+        numpy.testing.assert_allclose(expected_losses, curve.losses)
+        numpy.testing.assert_allclose(expected_poes, curve.poes)
+        # ...but the standard deviation considers the non-zero losses only
+        self.assertAlmostEqual(numpy.std(losses), curve.stddev_loss)
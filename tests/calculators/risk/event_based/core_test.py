@@ -13,6 +13,12 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with OpenQuake.  If not, see <http://www.gnu.org/licenses/>.
 
+import collections
+import unittest
+
+import mock
+import numpy
+
 from tests.utils import helpers
 from tests.utils.helpers import get_data_path
 from tests.calculators.risk import base_test
@@ -37,6 +43,20 @@ class EventBasedRiskCalculatorTestCase(base_test.BaseRiskCalculatorTestCase):
         self.job.status = 'executing'
         self.job.save()
 
+    def test_rupture_chunks(self):
+        # the ruptures are split in chunks to keep the loss matrix of
+        # each task below max_loss_matrix_size
+        self.calculator.all_rupture_ids = numpy.array([2, 3, 5, 8, 9])
+        params = {'block_size': '100', 'max_loss_matrix_size': '200'}
+        with mock.patch('openquake.engine.utils.config.get') as get:
+            get.side_effect = lambda _section, key: params[key]
+            self.assertEqual([slice(2, 5), slice(5, 9), slice(9, 10)],
+                             self.calculator.rupture_chunks())
+            params['max_loss_matrix_size'] = '500'
+            self.assertIsNone(self.calculator.rupture_chunks())
+            params['max_loss_matrix_size'] = '0'
+            self.assertIsNone(self.calculator.rupture_chunks())
+
     def test_calculator_parameters(self):
         # Test that the specific calculation parameters are present
 
@@ -111,3 +131,150 @@ class EventBasedRiskCalculatorTestCase(base_test.BaseRiskCalculatorTestCase):
 
         files = self.calculator.export(exports=['xml'])
         self.assertEqual(7, len(files))
+
+
+Output = collections.namedtuple(
+    'Output', 'assets loss_matrix loss_curves average_losses stddev_losses '
+    'insured_curves average_insured_losses stddev_insured_losses '
+    'loss_maps event_loss_table')
+
+
+class FakeWorkflow(object):
+    """
+    An event based workflow returning as loss ratios half of the ground
+    motion values
+    """
+    seed = None
+
+    def __call__(self, assets, hazard):
+        gmvs, rupture_ids = hazard
+        loss_matrix = numpy.array(gmvs) / 2.
+        values = numpy.array([asset.value('structural') for asset in assets])
+        event_loss_table = collections.Counter(dict(zip(
+            rupture_ids, numpy.dot(values, loss_matrix))))
+        return Output(assets, loss_matrix, None, None, None,
+                      None, None, None, None, event_loss_table)
+
+
+class FakeCalculationUnit(object):
+    def __init__(self, loss_type, workflow, getter):
+        self.loss_type = loss_type
+        self.workflow = workflow
+        self.getter = getter
+
+    def __call__(self, monitor_hazard, monitor_risk, *args):
+        return [(hid, self.workflow(assets, hazard))
+                for hid, assets, hazard in self.getter(monitor_hazard)], None
+
+
+class FakeGetter(object):
+    """
+    A getter on a single hazard output; like GroundMotionValuesGetter,
+    the assets without ground motion values are discarded
+    """
+    def __init__(self, assets, gmvs, rupture_ids, ruptures=slice(0, None)):
+        self.assets = assets
+        self.gmvs = gmvs
+        self.rupture_ids = rupture_ids
+        self.ruptures = ruptures
+
+    def select_ruptures(self, ruptures):
+        return self.__class__(self.assets, self.gmvs, self.rupture_ids,
+                              ruptures)
+
+    def __call__(self, monitor=None):
+        start = self.rupture_ids.searchsorted(self.ruptures.start)
+        stop = self.rupture_ids.searchsorted(
+            self.ruptures.stop or self.rupture_ids[-1] + 1)
+        gmvs = self.gmvs[:, start:stop]
+        indices = [i for i in range(len(self.assets)) if gmvs[i].any()]
+        yield (1, [self.assets[i] for i in indices],
+               ([gmvs[i] for i in indices],
+                self.rupture_ids[start:stop].tolist()))
+
+
+class ChunkedEventBasedTestCase(unittest.TestCase):
+    def run_event_based(self, rupture_chunks):
+        assets = [mock.Mock(id=i) for i in (1, 2)]
+        for i, asset in enumerate(assets):
+            asset.value.return_value = 10. * (i + 1)
+        numpy.random.seed(42)
+        gmvs = numpy.random.uniform(size=(2, 10))
+        # the second asset has no ground motion values for the
+        # ruptures 4, 5 and 6
+        gmvs[1, 3:6] = 0
+        unit = FakeCalculationUnit('structural', FakeWorkflow(), FakeGetter(
+            assets, gmvs, numpy.arange(1, 11)))
+        containers = mock.Mock()
+        params = mock.Mock(
+            asset_groups=None, sites_disagg=[], quantiles=[],
+            conditional_loss_poes=[0.5], tses=50, time_span=50,
+            loss_curve_resolution=5, rupture_chunks=rupture_chunks)
+        with mock.patch('openquake.engine.utils.config.get',
+                        return_value='4'), \
+                mock.patch.object(event_based.workflows, 'CalculationUnit',
+                                  FakeCalculationUnit):
+            event_loss_tables, _groups = event_based.do_event_based(
+                [unit], containers, params, mock.MagicMock())
+        write = containers.with_args.return_value.with_args.return_value.write
+        [((_assets, (curves, averages, stddevs)), _kwargs)] = (
+            write.call_args_list)
+        return event_loss_tables['structural'], curves, averages, stddevs
+
+    def test_chunks_do_not_change_the_results(self):
+        elt, curves, averages, stddevs = self.run_event_based(None)
+        self.assertEqual(range(1, 11), sorted(elt))
+        chunked_elt, chunked_curves, chunked_averages, chunked_stddevs = (
+            self.run_event_based([slice(1, 4), slice(4, 7), slice(7, 11)]))
+        self.assertEqual(elt, chunked_elt)
+        numpy.testing.assert_allclose(curves, chunked_curves)
+        numpy.testing.assert_allclose(averages, chunked_averages)
+        numpy.testing.assert_allclose(stddevs, chunked_stddevs)
+
+
+class EventLossTableTestCase(unittest.TestCase):
+    def test_add_and_get(self):
+        table = event_based.EventLossTable(numpy.array([1, 3, 5, 7, 9]))
+        table.add(*event_based.event_loss_arrays(
+            collections.Counter({3: 1.5, 7: 0.})))
+        table.add(*event_based.event_loss_arrays(
+            collections.Counter({3: 2., 9: 1.})))
+
+        rupture_ids, losses = table.get(numpy.array([1, 3, 5, 7]))
+        self.assertEqual([3, 7], rupture_ids.tolist())
+        self.assertEqual([3.5, 0.], losses.tolist())
+
+
+class SumByBinTestCase(unittest.TestCase):
+    def test_sum_by_bin(self):
+        bins, fractions = event_based.sum_by_bin(
+            numpy.array([[1, 2, 3, 4], [1, 2, 3, 4], [0, 5, 3, 4]]),
+            numpy.array([0.1, 0.2, 0.4]))
+        self.assertEqual([[0, 5, 3, 4], [1, 2, 3, 4]], bins.tolist())
+        numpy.testing.assert_allclose([0.4, 0.3], fractions)
+
+
+class DisaggregateTestCase(unittest.TestCase):
+    def setUp(self):
+        site = mock.Mock(coords=(1, 2))
+        self.asset = mock.Mock(site=site)
+        self.params = mock.Mock(sites_disagg=[site])
+        # the magnitude bin of each rupture is rupture_id // 10
+        self.geometries = mock.Mock()
+        self.geometries.bins = lambda rupture_ids, sites, params: (
+            numpy.array([[[r // 10, 0, 0, 0]] for r in rupture_ids]))
+
+    def test_losses_follow_the_sorted_ruptures(self):
+        outputs = mock.Mock(assets=[self.asset],
+                            loss_matrix=[numpy.array([0.1, 0.2, 0.4])])
+        disagg = event_based.disaggregate(
+            outputs, numpy.array([10, 20, 30]), self.params, self.geometries)
+        self.assertEqual(['1,0', '2,0', '3,0'], disagg.magnitude_distance)
+        numpy.testing.assert_allclose([0.1, 0.2, 0.4], disagg.fractions)
+
+    def test_length_mismatch(self):
+        outputs = mock.Mock(assets=[self.asset],
+                            loss_matrix=[numpy.array([0.1, 0.2, 0.4])])
+        self.assertRaises(AssertionError, event_based.disaggregate,
+                          outputs, numpy.array([10, 20]), self.params,
+                          self.geometries)
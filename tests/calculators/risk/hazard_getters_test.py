@@ -101,6 +101,18 @@ class GroundMotionValuesGetterTestCase(HazardCurveGetterPerAssetTestCase):
         self.assertEqual([], ruptures)
         self.assertEqual([], assets)
 
+    def test_stored_association(self):
+        rc = self.job.risk_calculation
+        RiskCalculator(self.job).associate_sites()
+        getter = self.getter_class(
+            self.ho(), self.assets(), rc.best_maximum_distance, "PGA")
+        stored_getter = self.getter_class(
+            self.ho(), self.assets(), rc.best_maximum_distance, "PGA",
+            risk_calculation_id=rc.id)
+        ho = self.ho()[0].output_container
+        self.assertEqual(list(getter.assets_gen(ho)),
+                         list(stored_getter.assets_gen(ho)))
+
 
 class GroundMotionScenarioGetterTestCase(HazardCurveGetterPerAssetTestCase):
 
@@ -123,6 +135,33 @@ class GroundMotionScenarioGetterTestCase(HazardCurveGetterPerAssetTestCase):
         self.assertEqual([], data[0])  # no assets
 
 
+class GroundMotionValuesMissingSiteTestCase(unittest.TestCase):
+    """
+    Event based case, with a site without stored ground motion values
+    """
+    def test_assets_without_gmvs_are_discarded(self):
+        assets = [mock.Mock(id=i) for i in range(3)]
+        getter = object.__new__(hazard_getters.GroundMotionValuesGetter)
+        getter.risk_calculation_id = None
+        getter.imt_type = 'PGA'
+        getter.sa_period = getter.sa_damping = None
+        site_assets = [(1, assets[:1]), (2, assets[1:2]), (3, assets[2:])]
+        site_data = {1: (numpy.array([0.1, 0.2]), numpy.array([10, 12])),
+                     3: (numpy.array([0.3]), numpy.array([11]))}
+        hazard_output = mock.Mock()
+        hazard_output.output.output_type = 'gmf'
+        with mock.patch.object(getter, 'assets_gen',
+                               return_value=site_assets), \
+                mock.patch.object(getter, 'get_gmvs_ruptures',
+                                  return_value=site_data), \
+                mock.patch('openquake.engine.db.models.GmfData.objects'):
+            got_assets, (gmvs, ruptures) = getter.get_data(
+                hazard_output, hazard_getters.DummyMonitor())
+        self.assertEqual([assets[0], assets[2]], got_assets)
+        self.assertEqual([10, 11, 12], ruptures)
+        numpy.testing.assert_equal([[0.1, 0, 0.2], [0, 0.3, 0]], gmvs)
+
+
 class GroundMotionValuesCalcGetterTestCase(unittest.TestCase):
     def setUp(self):
         self.imt = "SA(0.15)"
@@ -232,3 +271,176 @@ class GroundMotionValuesCalcGetterTestCase(unittest.TestCase):
         self.assertIsNone(tot)
         numpy.testing.assert_allclose([-0.20894387], inter)
         numpy.testing.assert_allclose([0.58203861, -2.975205], intra)
+
+    def test_correlation_matrix_cache(self):
+        cache = hazard_getters.GroundMotionValuesCalcGetter.correlation_cache
+        cache.clear()
+        calc1 = hazard_getters.GroundMotionValuesCalcGetter(
+            self.imt, self.sites, self.sites_assets, 3, self.gsims, self.cormo,
+            hazard_calculation_id=1)
+        calc2 = hazard_getters.GroundMotionValuesCalcGetter(
+            self.imt, self.sites, ((1, []),), 3, self.gsims, self.cormo,
+            hazard_calculation_id=1)
+
+        # only the row of the site of interest is kept
+        self.assertEqual((1, 3), calc2.correlation_matrix.shape)
+        numpy.testing.assert_allclose(
+            calc1.correlation_matrix[1:2], calc2.correlation_matrix)
+        self.assertEqual([(1, self.imt)], cache.keys())
+
+        # the matrices of the previous hazard calculation are discarded
+        hazard_getters.GroundMotionValuesCalcGetter(
+            self.imt, self.sites, ((1, []),), 3, self.gsims, self.cormo,
+            hazard_calculation_id=2)
+        self.assertEqual([(2, self.imt)], cache.keys())
+
+        # without the hazard calculation id nothing is cached
+        cache.clear()
+        hazard_getters.GroundMotionValuesCalcGetter(
+            self.imt, self.sites, ((1, []),), 3, self.gsims, self.cormo)
+        self.assertEqual({}, cache)
+
+    def test_epsilons_batch(self):
+        calc = hazard_getters.GroundMotionValuesCalcGetter(
+            self.imt, self.sites, self.sites_assets, 3, self.gsims, self.cormo)
+
+        batch = calc.epsilons_batch([1, 2], [[0, 1], [2]], [False, True])
+        for (tot, inter, intra), args in zip(
+                batch, [(1, [0, 1], False), (2, [2], True)]):
+            expected_tot, expected_inter, expected_intra = calc.epsilons(*args)
+            numpy.testing.assert_equal(expected_tot, tot)
+            numpy.testing.assert_equal(expected_inter, inter)
+            if expected_intra is None:
+                self.assertIsNone(intra)
+            else:
+                numpy.testing.assert_allclose(expected_intra, intra)
+
+
+class FakeGetter(hazard_getters.HazardGetter):
+    """
+    A getter returning as hazard data ten times the asset ids
+    """
+    calls = 0
+
+    def __init__(self, assets, imt="PGA"):
+        self.hazard_outputs = [mock.Mock(id=1)]
+        self.imt = imt
+        self.assets = assets
+
+    def clone(self, assets):
+        return self.__class__(assets, self.imt)
+
+    def __call__(self, monitor=None):
+        FakeGetter.calls += 1
+        yield 1, self.assets, [asset.id * 10 for asset in self.assets]
+
+
+class ShareGettersTestCase(unittest.TestCase):
+    def setUp(self):
+        FakeGetter.calls = 0
+        self.assets = [mock.Mock(id=i) for i in range(4)]
+
+    def test_shared(self):
+        getters = [FakeGetter(self.assets[:1]), FakeGetter(self.assets[1:]),
+                   FakeGetter(self.assets[1:], "SA(0.1)")]
+        shared = hazard_getters.share_getters(getters)
+
+        # the getter with a different IMT is not shared
+        self.assertIs(getters[2], shared[2])
+
+        [(_hid, assets0, data0)] = list(shared[0]())
+        [(_hid, assets1, data1)] = list(shared[1]())
+        self.assertEqual(self.assets[:1], assets0)
+        self.assertEqual([0], data0)
+        self.assertEqual(self.assets[1:], assets1)
+        self.assertEqual([10, 20, 30], data1)
+
+        # the hazard has been read only once
+        self.assertEqual(1, FakeGetter.calls)
+        # and the cache has been released
+        self.assertIsNone(shared[0].shared._cache)
+
+    def test_shared_slices(self):
+        getter = FakeGetter(self.assets)
+        getter.slice = mock.Mock(side_effect=lambda realizations: getter)
+        shared = hazard_getters.SharedHazardGetter(getter)
+        views = [shared.view(self.assets[:2]), shared.view(self.assets[2:])]
+
+        # each slice of the realizations is read once for all the views
+        for realizations in [slice(0, 2), slice(2, 4)]:
+            for view in views:
+                [(_hid, assets, _data)] = list(
+                    view.slice(realizations)())
+                self.assertEqual(view.assets, assets)
+        self.assertEqual(2, FakeGetter.calls)
+        self.assertEqual([mock.call(slice(0, 2)), mock.call(slice(2, 4))],
+                         getter.slice.call_args_list)
+
+    def test_bcr_single_fetch(self):
+        getter = hazard_getters.BCRGetter(FakeGetter(self.assets))
+        [(_hid, assets, (orig, retro))] = list(getter(None))
+        self.assertEqual(self.assets, assets)
+        self.assertEqual([0, 10, 20, 30], orig)
+        self.assertIs(orig, retro)
+        self.assertEqual(1, FakeGetter.calls)
+
+        # with different IMTs the hazard is read twice
+        FakeGetter.calls = 0
+        getter = hazard_getters.BCRGetter(
+            FakeGetter(self.assets), FakeGetter(self.assets, "SA(0.1)"))
+        list(getter(None))
+        self.assertEqual(2, FakeGetter.calls)
+
+    def test_shared_bcr(self):
+        getters = [hazard_getters.BCRGetter(FakeGetter(self.assets),
+                                            FakeGetter(self.assets)),
+                   FakeGetter(self.assets)]
+        shared = hazard_getters.share_getters(getters)
+
+        [(_hid, assets, (orig, retro))] = list(shared[0](None))
+        [(_hid, _assets, data)] = list(shared[1]())
+        self.assertEqual(self.assets, assets)
+        self.assertEqual([0, 10, 20, 30], orig)
+        self.assertEqual([0, 10, 20, 30], retro)
+        self.assertEqual([0, 10, 20, 30], data)
+        self.assertEqual(1, FakeGetter.calls)
+
+
+class UniqueDataTestCase(unittest.TestCase):
+    def test(self):
+        gmvs1 = numpy.array([0.1, 0.2])
+        gmvs2 = numpy.array([0.1, 0.2])  # equal values on another site
+        unique, inverse = hazard_getters.unique_data(
+            [gmvs1, gmvs2, gmvs1.copy(), gmvs2, gmvs1], [7, 3, 7, 3, 7])
+        self.assertEqual(2, len(unique))
+        self.assertIs(gmvs1, unique[0])
+        self.assertIs(gmvs2, unique[1])
+        self.assertEqual([0, 1, 0, 1, 0], list(inverse))
+
+    def test_empty(self):
+        unique, inverse = hazard_getters.unique_data([], [])
+        self.assertEqual([], unique)
+        self.assertEqual(0, len(inverse))
+
+
+class AssetSitesTestCase(unittest.TestCase):
+    def setUp(self):
+        self.assets = [mock.Mock(id=i) for i in range(3)]
+        self.getter = object.__new__(hazard_getters.GroundMotionValuesGetter)
+        self.getter.hazard_outputs = [mock.Mock()]
+        self.getter.assets = self.assets
+        site_assets = [(1, self.assets[:2]), (2, self.assets[2:])]
+        self.patch = mock.patch.object(
+            self.getter, 'assets_gen', return_value=site_assets)
+        self.patch.start()
+
+    def tearDown(self):
+        self.patch.stop()
+
+    def test_getter(self):
+        self.assertEqual({0: 1, 1: 1, 2: 2}, self.getter.asset_sites())
+
+    def test_view(self):
+        shared = hazard_getters.SharedHazardGetter(self.getter)
+        view = shared.view(self.assets[1:])
+        self.assertEqual({0: 1, 1: 1, 2: 2}, view.asset_sites())
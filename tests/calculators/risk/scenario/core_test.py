@@ -13,6 +13,11 @@
 # You should have received a copy of the GNU Affero General Public License
 # along with OpenQuake.  If not, see <http://www.gnu.org/licenses/>.
 
+import unittest
+
+import mock
+import numpy
+
 from tests.utils import helpers
 from tests.utils.helpers import get_data_path
 from tests.calculators.risk import base_test
@@ -77,3 +82,78 @@ class ScenarioRiskCalculatorTestCase(base_test.BaseRiskCalculatorTestCase):
 
         files = self.calculator.export(exports=['xml'])
         self.assertEqual(2, len(files))
+
+
+class FakeWorkflow(object):
+    """
+    A scenario workflow sampling the epsilons like the risklib one:
+    the generator is seeded only if the seed is not None, and one
+    epsilon per asset is drawn for each realization
+    """
+    def __init__(self, seed):
+        self.seed = seed
+
+    def __call__(self, assets, gmvs):
+        if self.seed is not None:
+            numpy.random.seed(self.seed)
+        gmvs = numpy.array(gmvs)
+        epsilons = numpy.random.normal(
+            size=(gmvs.shape[1], len(assets))).transpose()
+        losses = gmvs * (1 + 0.1 * epsilons)
+        return assets, losses, losses.sum(axis=0), None, None
+
+
+class FakeCalculationUnit(object):
+    def __init__(self, loss_type, workflow, getter):
+        self.loss_type = loss_type
+        self.workflow = workflow
+        self.getter = getter
+
+    def __call__(self, monitor_hazard, monitor_risk):
+        [(hid, assets, gmvs)] = list(self.getter(monitor_hazard))
+        return [(hid, self.workflow(assets, gmvs))], None
+
+
+class FakeGetter(object):
+    def __init__(self, assets, gmvs, realizations=slice(0, None)):
+        self.assets = assets
+        self.gmvs = gmvs
+        self.realizations = realizations
+
+    def slice(self, realizations):
+        return self.__class__(self.assets, self.gmvs, realizations)
+
+    def __call__(self, monitor=None):
+        # like GroundMotionValuesGetter, for scenario outputs
+        numpy.random.seed(None)
+        yield 1, self.assets, [g[self.realizations] for g in self.gmvs]
+
+
+class ChunkedScenarioTestCase(unittest.TestCase):
+    def run_scenario(self, gmf_block_size):
+        assets = [mock.Mock(id=1), mock.Mock(id=2)]
+        numpy.random.seed(42)
+        gmvs = numpy.random.uniform(size=(2, 10))
+        unit = FakeCalculationUnit(
+            'structural', FakeWorkflow(7), FakeGetter(assets, gmvs))
+        containers = mock.Mock()
+        with mock.patch('openquake.engine.utils.config.get',
+                        return_value=gmf_block_size), \
+                mock.patch.object(scenario.workflows, 'CalculationUnit',
+                                  FakeCalculationUnit):
+            agg, _insured, _groups = scenario.do_scenario(
+                [unit], containers, mock.Mock(asset_groups=None),
+                mock.MagicMock())
+        write = containers.with_args.return_value.write
+        [((_assets, means, stddevs), _kwargs)] = write.call_args_list
+        return agg['structural'], means, stddevs
+
+    def test_chunks_do_not_change_the_results(self):
+        agg, means, stddevs = self.run_scenario('0')
+        self.assertEqual(10, len(agg))
+        for block_size in ('3', '5', '10'):
+            chunked_agg, chunked_means, chunked_stddevs = (
+                self.run_scenario(block_size))
+            numpy.testing.assert_allclose(agg, chunked_agg)
+            numpy.testing.assert_allclose(means, chunked_means)
+            numpy.testing.assert_allclose(stddevs, chunked_stddevs)
@@ -0,0 +1,76 @@
+# Copyright (c) 2010-2013, GEM Foundation.
+#
+# OpenQuake is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# OpenQuake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with OpenQuake.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+
+import mock
+
+from openquake.engine.calculators.risk import workflow_cache
+
+
+class FakeUnit(object):
+    def __init__(self, taxonomy, loss_type, workflow):
+        self.loss_type = loss_type
+        self.getter = mock.Mock(assets=[mock.Mock(taxonomy=taxonomy)])
+        self.workflow = workflow
+
+
+class WorkflowCacheTestCase(unittest.TestCase):
+    def test_lookup_store(self):
+        cache = workflow_cache.WorkflowCache(0)
+        unit = FakeUnit('RC', 'structural', [1, 2, 3])
+        self.assertFalse(cache.lookup(1, unit))
+        cache.store(1, unit)
+
+        other = FakeUnit('RC', 'structural', [1, 2, 3])
+        self.assertTrue(cache.lookup(1, other))
+        self.assertIs(unit.workflow, other.workflow)
+
+        # different job, taxonomy or loss type
+        self.assertFalse(cache.lookup(2, FakeUnit('RC', 'structural', [])))
+        self.assertFalse(cache.lookup(1, FakeUnit('W', 'structural', [])))
+        self.assertFalse(cache.lookup(1, FakeUnit('RC', 'fatalities', [])))
+
+    def test_lru_eviction(self):
+        size = workflow_cache.sizeof(range(10))
+        cache = workflow_cache.WorkflowCache(2 * size)
+        units = [FakeUnit(taxonomy, 'structural', range(10))
+                 for taxonomy in ('A', 'B', 'C')]
+        cache.store(1, units[0])
+        cache.store(1, units[1])
+        # A becomes the most recently used workflow
+        cache.lookup(1, units[0])
+        cache.store(1, units[2])  # B is evicted
+
+        self.assertEqual(2, len(cache))
+        self.assertEqual(2 * size, cache.size)
+        self.assertTrue(cache.lookup(1, units[0]))
+        self.assertFalse(cache.lookup(1, units[1]))
+        self.assertTrue(cache.lookup(1, units[2]))
+
+    def test_too_big(self):
+        cache = workflow_cache.WorkflowCache(1)
+        cache.store(1, FakeUnit('A', 'structural', range(10)))
+        self.assertEqual(0, len(cache))
+
+    def test_cached(self):
+        cache = workflow_cache.WorkflowCache(0)
+        units = [FakeUnit('A', 'structural', [1]),
+                 FakeUnit('A', 'structural', [1])]
+        with mock.patch.object(workflow_cache, 'get_cache',
+                               return_value=cache):
+            computed = list(workflow_cache.cached(1, units))
+        self.assertEqual(units, computed)
+        self.assertIs(units[0].workflow, units[1].workflow)
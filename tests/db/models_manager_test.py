@@ -123,6 +123,21 @@ class ExposureContainedInTestCase(unittest.TestCase):
         self.assertEqual(1, len(list(results)))
         self.assertEqual("test2", results[0].asset_ref)
 
+    def test_get_asset_blocks(self):
+        self.rc.region_constraint = Polygon(
+            ((-1, -1), (-1, 1), (180, 1), (180, -1), (-1, -1)))
+
+        blocks = list(models.ExposureData.objects.get_asset_blocks(
+            self.rc, "test", 1))
+        chunks = [models.ExposureData.objects.get_asset_chunk(
+                  self.rc, "test", offset, 1) for offset in (0, 1)]
+
+        self.assertEqual(2, len(blocks))
+        for block, chunk in zip(blocks, chunks):
+            self.assertEqual([a.id for a in chunk], [a.id for a in block])
+            self.assertEqual([a.people for a in chunk],
+                             [a.people for a in block])
+
 
 class AssetManagerTestCase(unittest.TestCase):
     base = 'openquake.engine.db.models.AssetManager.'
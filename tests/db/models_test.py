@@ -158,6 +158,35 @@ class HazardCalculationGeometryTestCase(unittest.TestCase):
         numpy.testing.assert_array_equal(lons, mesh.lons)
         numpy.testing.assert_array_equal(lats, mesh.lats)
 
+    def test_points_to_compute_saves_sites(self):
+        hc = models.HazardCalculation.create(
+            sites='6.5 45.8, 6.5 46.5, 8.5 46.5, 8.5 45.8')
+        with mock.patch.object(hc, 'copy_sites') as copy_sites, \
+                mock.patch.object(hc, 'save_sites') as save_sites:
+            mesh = hc.points_to_compute(save_sites=True)
+        # the sites are copied from the coordinates, without
+        # instantiating HazardSite objects
+        self.assertEqual(0, save_sites.call_count)
+        [((lons, lats), _kw)] = copy_sites.call_args_list
+        numpy.testing.assert_array_equal(mesh.lons, lons)
+        numpy.testing.assert_array_equal(mesh.lats, lats)
+
+
+class CopySitesTestCase(unittest.TestCase):
+    def test(self):
+        job = helpers.get_hazard_job(
+            helpers.get_data_path('simple_fault_demo_hazard/job.ini'))
+        hc = job.hazard_calculation
+        hc.copy_sites(numpy.array([1.1, 2.2]), numpy.array([3.3, 4.4]))
+        # the sites are not committed, so they must be read with the
+        # same connection
+        cursor = models.getcursor('job_init')
+        cursor.execute("""
+        SELECT ST_X(location::geometry), ST_Y(location::geometry)
+        FROM hzrdi.hazard_site WHERE hazard_calculation_id = %s
+        ORDER BY id""", (hc.id,))
+        self.assertEqual([(1.1, 3.3), (2.2, 4.4)], cursor.fetchall())
+
 
 class SESRuptureTestCase(unittest.TestCase):
 
@@ -343,6 +372,31 @@ class PrepGeometryTestCase(unittest.TestCase):
         self.assertEqual(expected, models._prep_geometry(the_input))
 
 
+class SnapToGridTestCase(unittest.TestCase):
+
+    def test_snap_to_grid(self):
+        # two close locations and a far one
+        lons = numpy.array([10.5, 10.02, 10.021])
+        lats = numpy.array([45.5, 45.02, 45.021])
+        clons, clats = models.snap_to_grid(lons, lats, 5.)
+        self.assertEqual(2, len(clons))
+        # sorted by longitude
+        self.assertLess(clons[0], clons[1])
+
+        # the centers are in the cells of the locations
+        cells = set(zip(*models.grid_cells(lons, lats, 5.)))
+        self.assertEqual(cells,
+                         set(zip(*models.grid_cells(clons, clats, 5.))))
+
+    def test_cell_size(self):
+        lons, lats = models.cell_centers([450, 451], [100, 100], 10.)
+        # about 10 km in latitude
+        self.assertAlmostEqual(10. / models.KM_PER_DEGREE, lats[1] - lats[0])
+        width = (models.cell_centers([450], [101], 10.)[0] - lons[0]) * \
+            numpy.cos(numpy.radians(lats[0])) * models.KM_PER_DEGREE
+        self.assertAlmostEqual(10., width[0])
+
+
 class GetSiteCollectionTestCase(unittest.TestCase):
 
     @attr('slow')
@@ -132,16 +132,6 @@ random_seed=0
         finally:
             shutil.rmtree(temp_dir)
 
-    def test__parse_sites_csv(self):
-        expected_wkt = 'MULTIPOINT(0.1 0.2, 2 3, 4.1 5.6)'
-        source = StringIO.StringIO("""\
-0.1,0.2
-2,3
-4.1,5.6
-""")
-        wkt = engine._parse_sites_csv(source)
-        self.assertEqual(expected_wkt, wkt)
-
     def test_parse_config_with_sites_csv(self):
         sites_csv = helpers.touch(content='1.0,2.1\n3.0,4.1\n5.0,6.1')
         try:
@@ -161,12 +151,11 @@ random_seed=5
 
             expected_params = {
                 'base_path': exp_base_path,
-                'sites': 'MULTIPOINT(1.0 2.1, 3.0 4.1, 5.0 6.1)',
                 'calculation_mode': 'classical',
                 'truncation_level': '3',
                 'random_seed': '5',
                 'maximum_distance': '0',
-                'inputs': {},
+                'inputs': {'sites': sites_csv},
             }
 
             params = engine.parse_config(source)
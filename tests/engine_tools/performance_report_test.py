@@ -0,0 +1,125 @@
+# Copyright (c) 2013, GEM Foundation.
+#
+# OpenQuake is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# OpenQuake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with OpenQuake.  If not, see <http://www.gnu.org/licenses/>.
+
+import json
+import datetime
+import unittest
+from StringIO import StringIO
+
+from openquake.engine.tools import performance_report as pr
+
+T0 = datetime.datetime(2013, 11, 20, 10, 0, 0)
+
+
+def perf_row(task, task_id, operation, duration, pymemory, seconds):
+    return pr.PerformanceRow(task, task_id, operation, duration, pymemory,
+                             None, T0 + datetime.timedelta(seconds=seconds))
+
+
+ROWS = [
+    perf_row(None, None, 'job phase: pre_executing', 0, 0, 0),
+    perf_row(None, None, 'pre_execute', 2.0, 100, 0.5),
+    perf_row(None, None, 'job phase: executing', 0, 0, 3),
+    perf_row('classical', 't1', 'getting data', 1.0, 10, 3),
+    perf_row('classical', 't1', 'total classical', 3.0, 30, 3),
+    perf_row('classical', 't2', 'getting data', 3.0, 20, 4),
+    perf_row('classical', 't2', 'total classical', 5.0, 40, 4),
+    perf_row(None, None, 'execute', 6.0, 200, 3),
+    perf_row(None, None, 'job phase: complete', 0, 0, 10),
+]
+
+
+class PerformanceReportTestCase(unittest.TestCase):
+    def test_report(self):
+        report = pr.performance_report(ROWS, slowest=1)
+
+        self.assertEqual(
+            [('pre_executing', 3.0), ('executing', 7.0), ('complete', 0.0)],
+            [(row['operation'], row['total_time'])
+             for row in report['phases']])
+        self.assertEqual(['pre_execute', 'execute'],
+                         [row['operation'] for row in report['controller']])
+
+        data, total = report['operations']
+        self.assertEqual('getting data', data['operation'])
+        self.assertEqual(2, data['count'])
+        self.assertEqual(4.0, data['total_time'])
+        self.assertEqual(2.0, data['mean_time'])
+        self.assertEqual(2.0, data['p50_time'])
+        self.assertEqual(3.0, data['max_time'])
+        self.assertEqual(20, data['max_pymemory'])
+        self.assertIsNone(data['max_pgmemory'])
+        self.assertEqual(8.0, total['total_time'])
+
+        [slowest] = report['slowest_tasks']
+        self.assertEqual('t2', slowest['task_id'])
+        self.assertEqual(5.0, slowest['max_time'])
+
+    def test_formats(self):
+        report = pr.performance_report(ROWS)
+
+        out = StringIO()
+        pr.write_csv(report, out)
+        lines = out.getvalue().splitlines()
+        self.assertEqual(','.join(pr.COLUMNS), lines[0])
+        # 3 phases, 2 controller operations, 2 operations, 2 tasks
+        self.assertEqual(10, len(lines))
+
+        out = StringIO()
+        pr.write_json(report, out)
+        self.assertEqual(2, len(json.loads(out.getvalue())['slowest_tasks']))
+
+        out = StringIO()
+        pr.write_text(report, out)
+        text = out.getvalue()
+        self.assertIn('SLOWEST TASKS', text)
+        self.assertNotIn('max_pgmemory', text)
+
+    def test_json_without_durations(self):
+        rows = [perf_row(None, None, 'execute', None, None, 0)]
+        report = pr.performance_report(rows)
+        self.assertIsInstance(report['controller'][0]['total_time'], float)
+
+        out = StringIO()
+        pr.write_json(report, out)
+        [operation] = json.loads(out.getvalue())['controller']
+        self.assertEqual(0, operation['max_time'])
+
+    def test_only_phase_markers(self):
+        # a risk job, where the controller operations are not monitored
+        rows = [
+            perf_row(None, None, 'job phase: pre_executing', 0, 0, 0),
+            perf_row(None, None, 'job phase: executing', 0, 0, 20),
+            perf_row('classical', 't1', 'total classical', 15.0, 30, 21),
+            perf_row(None, None, 'job phase: post_processing', 0, 0, 40),
+        ]
+        report = pr.performance_report(rows)
+        self.assertEqual([], report['controller'])
+        self.assertEqual(
+            [('pre_executing', 20.0), ('executing', 20.0),
+             ('post_processing', 0.0)],
+            [(phase['operation'], phase['total_time'])
+             for phase in report['phases']])
+        [phase] = [phase for phase in report['phases']
+                   if phase['operation'] == 'executing']
+        self.assertIsNone(phase['max_pymemory'])
+
+    def test_last_phase_lasts_up_to_the_last_operation(self):
+        rows = [
+            perf_row(None, None, 'job phase: executing', 0, 0, 0),
+            perf_row('classical', 't1', 'total classical', 15.0, 30, 5),
+        ]
+        [phase] = pr.performance_report(rows)['phases']
+        self.assertEqual(20.0, phase['total_time'])
@@ -0,0 +1,66 @@
+# Copyright (c) 2013, GEM Foundation.
+#
+# OpenQuake is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# OpenQuake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with OpenQuake.  If not, see <http://www.gnu.org/licenses/>.
+
+import unittest
+from datetime import datetime, timedelta
+
+from openquake.engine.tools import performance_trace as pt
+
+T0 = datetime(2013, 10, 1, 12)
+
+
+def row(task, task_id, operation, start, duration, hostname, pid):
+    return pt.TraceRow(task, task_id, operation, T0 + timedelta(seconds=start),
+                       duration, None, None, hostname, pid)
+
+ROWS = [
+    row(None, None, 'job phase: pre_executing', 0, 0, 'master', 1),
+    row(None, None, 'pre_execute', 0, 2, 'master', 1),
+    row(None, None, 'job phase: executing', 2, 0, 'master', 1),
+    row('classical', 't1', 'total classical', 3, 4, 'worker', 10),
+    row('classical', 't1', 'getting data', 3.5, 1, 'worker', 10),
+    row('classical', 't2', 'total classical', 3, 2, 'worker', 11),
+    row(None, None, 'job phase: complete', 8, 0, 'master', 1),
+]
+
+
+class ChromeTraceTestCase(unittest.TestCase):
+    def test_trace(self):
+        events = pt.chrome_trace(ROWS)['traceEvents']
+        metadata = [e for e in events if e['ph'] == 'M']
+        slices = [e for e in events if e['ph'] == 'X']
+
+        names = set(e['args']['name'] for e in metadata)
+        self.assertEqual(
+            set(['job phases', 'master', 'worker', 'process 10',
+                 'process 11', 'controller (process 1)']), names)
+
+        # the phases are displayed as slices between the transitions
+        phases = [e for e in slices if e['cat'] == 'phase']
+        self.assertEqual(['pre_executing', 'executing'],
+                         [e['name'] for e in phases])
+        self.assertEqual([2 * 10 ** 6, 6 * 10 ** 6],
+                         [e['dur'] for e in phases])
+        [last] = [e for e in events if e['ph'] == 'i']
+        self.assertEqual('complete', last['name'])
+
+        # the nested monitor is on the same track of its task
+        [total, data] = [e for e in slices if e['tid'] == 10]
+        self.assertEqual(3 * 10 ** 6, total['ts'])
+        self.assertEqual(3.5 * 10 ** 6, data['ts'])
+        self.assertEqual(total['pid'], data['pid'])
+
+    def test_empty(self):
+        self.assertEqual([], pt.chrome_trace([])['traceEvents'])
@@ -0,0 +1,74 @@
+# Copyright (c) 2013, GEM Foundation.
+#
+# OpenQuake is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# OpenQuake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with OpenQuake.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import unittest
+from StringIO import StringIO
+
+from openquake.engine.input import exposure
+
+from tests.utils.helpers import get_data_path
+
+
+class ExposureCSVParserTestCase(unittest.TestCase):
+
+    def test_parse(self):
+        parser = exposure.exposure_parser(get_data_path('exposure.csv'))
+        self.assertIsInstance(parser, exposure.ExposureCSVParser)
+
+        assets = list(parser)
+        self.assertEqual(['a1', 'a2', 'a3'], [a.asset_ref for a in assets])
+        self.assertEqual((-1.0, 1.0), assets[1].site)
+        self.assertEqual('VF', assets[1].taxonomy)
+        self.assertIsNone(assets[1].number)
+        self.assertEqual([exposure.Cost('structural', 3.0, 0.2, None, None)],
+                         assets[1].costs)
+        self.assertEqual([], assets[1].occupancy)
+
+        metadata = assets[0].exposure_metadata
+        self.assertEqual('ep', metadata.exposure_id)
+        self.assertEqual('single_asset', metadata.asset_category)
+        self.assertEqual([exposure.CostType(
+            'structural', 'aggregated', 'USD', 'aggregated', 'USD')],
+            metadata.conversions.cost_types)
+        self.assertTrue(metadata.conversions.deductible_is_absolute)
+
+    def test_occupancy_and_missing_values(self):
+        data = StringIO('''\
+# exposure_id = ep
+# category = buildings
+# area_type = per_asset
+# deductible_is_absolute = false
+# cost_type = structural per_area EUR
+# cost_type = contents per_asset EUR
+asset_ref,lon,lat,taxonomy,number,area,structural,deductible_structural,\
+contents,occupants_day,occupants_night
+a0,81.2985,29.1098,RM,3,10,100,0.25,,5,15
+''')
+        [asset] = list(exposure.ExposureCSVParser(data))
+        self.assertEqual(3, asset.number)
+        self.assertEqual(10, asset.area)
+        # the missing contents cost is detected by the ExposureDBWriter
+        self.assertEqual([exposure.Cost('structural', 100, None, 0.25, None)],
+                         asset.costs)
+        self.assertEqual([exposure.OccupancyData(5, 'day'),
+                          exposure.OccupancyData(15, 'night')],
+                         asset.occupancy)
+        self.assertFalse(
+            asset.exposure_metadata.conversions.deductible_is_absolute)
+
+    def test_invalid_metadata(self):
+        data = StringIO('# unknown = 1\nasset_ref,lon,lat,taxonomy\n')
+        self.assertRaises(ValueError, list, exposure.ExposureCSVParser(data))
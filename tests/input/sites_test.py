@@ -0,0 +1,93 @@
+# Copyright (c) 2013, GEM Foundation.
+#
+# OpenQuake is free software: you can redistribute it and/or modify it
+# under the terms of the GNU Affero General Public License as published
+# by the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# OpenQuake is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU Affero General Public License
+# along with OpenQuake.  If not, see <http://www.gnu.org/licenses/>.
+
+import os
+import unittest
+
+from openquake.engine.input import sites
+
+from tests.utils import helpers
+
+
+class ReadSitesCSVTestCase(unittest.TestCase):
+
+    def test_chunks(self):
+        path = helpers.touch(content='0.1,0.2\n2,3\n\n4.1,5.6\n')
+        try:
+            chunks = list(sites.read_sites_csv(path, chunk_size=2))
+        finally:
+            os.unlink(path)
+        self.assertEqual(2, len(chunks))
+        self.assertEqual([0.1, 2], list(chunks[0][0]))
+        self.assertEqual([0.2, 3], list(chunks[0][1]))
+        self.assertEqual([4.1], list(chunks[1][0]))
+        self.assertEqual([5.6], list(chunks[1][1]))
+
+    def test_all_sites(self):
+        path = helpers.touch(content='0.1,0.2\n2,3\n4.1,5.6\n')
+        try:
+            [(lons, lats)] = list(sites.read_sites_csv(path))
+        finally:
+            os.unlink(path)
+        self.assertEqual([0.1, 2, 4.1], list(lons))
+        self.assertEqual([0.2, 3, 5.6], list(lats))
+
+    def test_single_line(self):
+        # without ndmin=2 numpy.loadtxt would return a 1D array
+        path = helpers.touch(content='1.5,2.5')
+        try:
+            [(lons, lats)] = list(sites.read_sites_csv(path))
+        finally:
+            os.unlink(path)
+        self.assertEqual([1.5], list(lons))
+        self.assertEqual([2.5], list(lats))
+
+    def test_blank_chunks_are_skipped(self):
+        path = helpers.touch(content='1,2\n\n  \n3,4\n\n')
+        try:
+            chunks = list(sites.read_sites_csv(path, chunk_size=1))
+        finally:
+            os.unlink(path)
+        self.assertEqual([([1], [2]), ([3], [4])],
+                         [(list(lons), list(lats)) for lons, lats in chunks])
+
+    def test_empty_file(self):
+        path = helpers.touch()
+        try:
+            self.assertEqual([], list(sites.read_sites_csv(path)))
+        finally:
+            os.unlink(path)
+
+    def test_wrong_columns(self):
+        path = helpers.touch(content='0.1,0.2,0.3\n')
+        try:
+            with self.assertRaises(ValueError) as ctx:
+                list(sites.read_sites_csv(path))
+        finally:
+            os.unlink(path)
+        self.assertEqual(
+            'Expected two columns lon,lat in %s, got 3' % path,
+            str(ctx.exception))
+
+    def test_single_column(self):
+        path = helpers.touch(content='0.1\n0.2\n')
+        try:
+            with self.assertRaises(ValueError) as ctx:
+                list(sites.read_sites_csv(path))
+        finally:
+            os.unlink(path)
+        self.assertEqual(
+            'Expected two columns lon,lat in %s, got 1' % path,
+            str(ctx.exception))
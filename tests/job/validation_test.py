@@ -16,9 +16,12 @@
 
 import itertools
 import json
+import os
 import unittest
 import warnings
 
+import mock
+
 from openquake.engine import engine
 from openquake.engine.db import models
 from openquake.engine.job import validation
@@ -904,6 +907,34 @@ class ScenarioRiskValidationTestCase(unittest.TestCase):
         self.assertEqual(expected_errors, dict(form.errors))
 
 
+class SitesCSVIsValidTestCase(unittest.TestCase):
+    """
+    Tests for :func:`openquake.engine.job.validation.sites_csv_is_valid`
+    """
+    def is_valid(self, content):
+        path = helpers.touch(content=content)
+        try:
+            return validation.sites_csv_is_valid(
+                mock.Mock(inputs={'sites': path}))
+        finally:
+            os.unlink(path)
+
+    def test_valid(self):
+        self.assertEqual((True, []),
+                         self.is_valid('-122.114,38.113\n180,-90\n'))
+
+    def test_out_of_range(self):
+        self.assertEqual(
+            (False, ['Longitude values must in the range [-180, 180]',
+                     'Latitude values must be in the range [-90, 90]']),
+            self.is_valid('-122.114,38.113\n-180.001,90.001\n'))
+
+    def test_wrong_columns(self):
+        valid, [error] = self.is_valid('-122.114,38.113,0\n')
+        self.assertFalse(valid)
+        self.assertTrue(error.startswith('Invalid sites file: Expected two'))
+
+
 class ValidateTestCase(unittest.TestCase):
     """
     Tests for :func:`openquake.engine.job.validation.validate`.